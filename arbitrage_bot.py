@@ -1,11 +1,16 @@
 from services.arbitrage import ArbitrageBot
+from services.metrics import start_http_exporter
+from services.tracing import TRACER
 import logging
 import asyncio
+import os
 from core.utils.logs import setup_logger
 if __name__ == "__main__":
     logging.getLogger().setLevel(logging.INFO)
     setup_logger(global_logger_name="arbitrage")
+    TRACER.init("arbitrage_bot")
     ab = ArbitrageBot()
+    start_http_exporter(int(os.getenv("ARBITRAGE_METRICS_PORT", "9103")))
 
     async def main():
         await ab.init()
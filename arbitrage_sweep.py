@@ -0,0 +1,45 @@
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from core.db import TimesScaleDb
+from core.utils.logs import setup_logger
+from services.arbitrage.sweep import run_sweep, grid_search, random_search, deltas_to_spreads
+
+GRID = {
+    "spread_threshold_open": [0.3, 0.46, 0.6, 0.8],
+    "spread_threshold_close": [0.15, 0.23, 0.3],
+    "max_pair_quantity": [25],
+    "max_total_quantity": [100, 200],
+}
+RANGES = {
+    "spread_threshold_open": (0.2, 1.0),
+    "spread_threshold_close": (0.1, 0.5),
+    "max_pair_quantity": (10, 50),
+    "max_total_quantity": (50, 300),
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--random", type=int, default=0, help="random search size, grid search if 0")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--commission", type=float, default=0.1, help="commission per order, %%")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+    setup_logger(global_logger_name="arbitrage")
+
+    async def load_deltas():
+        db = TimesScaleDb(use_pool=True)
+        await db.init()
+        now_ = datetime.utcnow()
+        return await db.load_arbitrage_deltas(start_time=now_ - timedelta(days=args.days), end_time=now_)
+
+    spreads = deltas_to_spreads(asyncio.run(load_deltas()))
+    candidates = random_search(RANGES, args.random, args.seed) if args.random > 0 else grid_search(GRID)
+    result = run_sweep(spreads, candidates, commission_perc=args.commission, max_workers=args.workers)
+    print(result.head(args.top).to_string())
@@ -0,0 +1,55 @@
+from patch_submod import dummy  # <- REQUIRED
+import argparse
+import asyncio
+import os
+import sys
+
+from services.benchmarks import BENCHMARKS, run_benchmarks, compare_results, load_results, save_results
+from services.benchmarks.runner import BENCHMARK_DIR, BENCHMARK_REPEATS, BENCHMARK_MIN_TIME, REGRESSION_TOLERANCE
+
+dummy()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the services hot paths")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run benchmarks and store the results as JSON")
+    run_parser.add_argument("names", nargs="*", help="substrings of benchmark names, all by default")
+    run_parser.add_argument("--sizes", nargs="*", type=int)
+    run_parser.add_argument("--repeats", type=int, default=BENCHMARK_REPEATS)
+    run_parser.add_argument("--min-time", type=float, default=BENCHMARK_MIN_TIME, help="s per repeat")
+    run_parser.add_argument("--out", default=os.path.join(BENCHMARK_DIR, "latest.json"))
+    run_parser.add_argument("--save-baseline", action="store_true",
+                            help=f"also store as {os.path.join(BENCHMARK_DIR, 'baseline.json')}")
+
+    compare_parser = commands.add_parser("compare", help="flag regressions, failed and missing benchmarks against "
+                                                         "a baseline, exit code 1 if any")
+    compare_parser.add_argument("--baseline", default=os.path.join(BENCHMARK_DIR, "baseline.json"))
+    compare_parser.add_argument("--current", default=os.path.join(BENCHMARK_DIR, "latest.json"))
+    compare_parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE,
+                                help="allowed slowdown of the median, 0.15 = 15%%")
+
+    commands.add_parser("list", help="list benchmarks and sizes")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for b in BENCHMARKS.values():
+            print(f"{b.name}: {b.sizes}")
+    elif args.command == "run":
+        data = asyncio.run(run_benchmarks(args.names, args.sizes, args.repeats, args.min_time))
+        save_results(data, args.out)
+        if data["failed"]:
+            print(f"Failed: {', '.join(data['failed'].keys())}")
+            sys.exit(1)  # not stored as the baseline either
+        if args.save_baseline:
+            save_results(data, os.path.join(BENCHMARK_DIR, "baseline.json"))
+    else:
+        rows = compare_results(load_results(args.baseline), load_results(args.current), args.tolerance)
+        for r in rows:
+            if r["error"] is not None:
+                print(f"{r['key']:<60} {r['error']}")
+                continue
+            flag = "REGRESSION" if r["regression"] else ""
+            print(f"{r['key']:<60} {r['baseline'] * 1000:>12.4f} -> {r['current'] * 1000:>12.4f} ms "
+                  f"{(r['ratio'] - 1) * 100:>+8.1f}% {flag}")
+        sys.exit(1 if any(r["regression"] or r["error"] is not None for r in rows) else 0)
@@ -0,0 +1,46 @@
+from patch_submod import dummy  # <- REQUIRED
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+
+from tc.config import Config
+from tc.core.db.timescaledb import TimesScaleDb
+from tc.core.utils.logs import setup_logger
+from services.collector.binance_rest import BinanceRestClient, RateLimitBudget, REQUEST_WEIGHT_PER_MINUTE
+from services.collector.data_collector import DATA_COLLECTOR_TFS
+from services.importer import CandlesImporter, ImportCheckpoints, RestSource, ArchiveSource
+from services.importer.candles_importer import IMPORT_CONCURRENCY
+
+config = Config.load_from_env()
+dummy()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill candles and aggTrades into TimescaleDB")
+    parser.add_argument("--symbols", nargs="*", help="binance symbols, all active symbols by default")
+    parser.add_argument("--tfs", nargs="*", default=DATA_COLLECTOR_TFS)
+    parser.add_argument("--start", type=datetime.fromisoformat, required=True, help="UTC, e.g. 2022-01-01")
+    parser.add_argument("--end", type=datetime.fromisoformat, default=None, help="UTC, now by default")
+    parser.add_argument("--trades", action="store_true", help="import aggTrades too")
+    parser.add_argument("--archive-dir", help="read data.binance.vision zip/csv files instead of the REST API")
+    parser.add_argument("--concurrency", type=int, default=IMPORT_CONCURRENCY)
+    parser.add_argument("--weight", type=int, default=REQUEST_WEIGHT_PER_MINUTE, help="REST weight per minute")
+    args = parser.parse_args()
+
+    setup_logger()
+
+    async def main():
+        db = TimesScaleDb(**config.get_timescale_db_params())
+        await db.init()
+        symbols = args.symbols or [r['symbol'] for r in await db.get_symbol_status(active=True)]
+        source = ArchiveSource(args.archive_dir) if args.archive_dir else \
+            RestSource(BinanceRestClient(budget=RateLimitBudget(args.weight)))
+        importer = CandlesImporter(db, source, ImportCheckpoints(), concurrency=args.concurrency)
+        try:
+            await importer.run(symbols, args.tfs, args.start, args.end, with_trades=args.trades)
+        finally:
+            await source.close()
+        if importer.failed:
+            logging.error(f"Failed jobs: {importer.failed}")
+
+    asyncio.run(main())
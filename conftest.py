@@ -0,0 +1 @@
+from patch_submod import dummy  # <- REQUIRED
@@ -1,9 +1,14 @@
 from patch_submod import dummy  # <- REQUIRED
 from services.collector import DataCollector, ta_processor_client
+from services.collector.shards import ProcessShardPool
+from services.market_data import MARKET_DATA_SHM_NAME
+from services.metrics import start_http_exporter
+from services.tracing import TRACER
 import logging
 import asyncio
 from tc.core.utils.logs import setup_logger, add_traceback
 import atexit
+import os
 from multiprocessing import Process
 from tc.config import Config
 
@@ -12,14 +17,26 @@ dummy()
 
 if __name__ == "__main__":
     setup_logger()
-    dc = DataCollector(config)
+    TRACER.init("data_collector")
+    dc = DataCollector(config, market_store_name=MARKET_DATA_SHM_NAME,
+                       with_depth=os.getenv("DATA_COLLECTOR_DEPTH", "0") == "1",
+                       ws_shards=int(os.getenv("DATA_COLLECTOR_WS_SHARDS", "1")),
+                       ws_shard_processes=os.getenv("DATA_COLLECTOR_WS_PROCESSES", "0") == "1",
+                       resample=os.getenv("DATA_COLLECTOR_RESAMPLE", "0") == "1",
+                       backfill_gaps=os.getenv("DATA_COLLECTOR_BACKFILL", "1") == "1")
 
-    ta_processor = Process(target=ta_processor_client, args=(config,))
+    metrics_port = int(os.getenv("DATA_COLLECTOR_METRICS_PORT", "9101"))  # the TA processor exports on port + 1
+    ta_processor = Process(target=ta_processor_client, args=(config, metrics_port + 1))
     ta_processor.start()
+    start_http_exporter(metrics_port)
 
     @atexit.register
     def cleanup():
         logging.info("Cleanup")
+        if dc.market_store is not None:
+            dc.market_store.close()
+        if isinstance(dc.ws_shards, ProcessShardPool):
+            dc.ws_shards.stop()
         ta_processor.join()
         ta_processor.close()
         asyncio.get_event_loop().close()
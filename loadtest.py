@@ -0,0 +1,123 @@
+from patch_submod import dummy  # <- REQUIRED
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from tc.config import Config
+from tc.core.db.timescaledb import TimesScaleDb
+from tc.core.utils.logs import setup_logger
+from services.collector.data_collector import DATA_COLLECTOR_FEEDS, DATA_COLLECTOR_TFS
+from services.collector.shards import MAX_STREAMS_PER_CONNECTION, get_streams
+from services.loadtest import FrameWriter, capture_streams, read_frames, read_manifest
+from services.loadtest.capture import BINANCE_SPOT_STREAM, BINANCE_FUTURES_STREAM
+from services.loadtest.fake_exchange import FakeExchange, FAKE_EXCHANGE_PORT
+from services.loadtest.synthetic import SyntheticMarket, SYNTHETIC_TRADE_RATE, SYNTHETIC_DEPTH_LEVELS
+from services.loadtest.targets import TARGETS
+from services.tracing import TRACER
+
+config = Config.load_from_env()
+dummy()
+
+
+async def capture(args):
+    db = TimesScaleDb(**config.get_timescale_db_params())
+    await db.init()
+    symbol_status = await db.get_symbol_status(active=True)
+    if args.symbols:
+        symbol_status = [r for r in symbol_status if r['symbol'] in args.symbols]
+
+    writer = FrameWriter(args.out)
+    writer.write_manifest(dict(started=time.time(), minutes=args.minutes, feeds=args.feeds, arbitrage=args.arbitrage,
+                               symbols=[dict(symbol=r['symbol'], cluster_size=r['cluster_size'])
+                                        for r in symbol_status]))
+    streams = [s for r in symbol_status for s in get_streams(r['symbol'], args.feeds)]
+    jobs = [capture_streams(args.spot_url, streams[i:i + MAX_STREAMS_PER_CONNECTION], writer, "spot",
+                            args.minutes * 60) for i in range(0, len(streams), MAX_STREAMS_PER_CONNECTION)]
+    if args.arbitrage:
+        jobs += [capture_streams(args.spot_url, ["!miniTicker@arr"], writer, "spot", args.minutes * 60),
+                 capture_streams(args.futures_url, ["!markPrice@arr@1s"], writer, "futures", args.minutes * 60)]
+    try:
+        await asyncio.gather(*jobs)
+    finally:
+        writer.close()
+    logging.info(f"Captured {writer.frames} frames of {len(streams)} streams to {args.out}")
+
+
+def generate(args):
+    market = SyntheticMarket(args.symbols, args.tfs, trade_rate=args.rate, seed=args.seed,
+                             depth_levels=args.depth_levels)
+    writer = FrameWriter(args.out)
+    writer.write_manifest(dict(started=market.now_ms / 1000, minutes=args.minutes, **market.manifest()))
+    for t, source, msg in market.frames(args.minutes * 60):
+        writer.write(source, json.dumps(msg), t)
+    writer.close()
+    logging.info(f"Generated {writer.frames} frames of {args.symbols} synthetic symbols to {args.out}")
+
+
+async def serve(args):
+    market = SyntheticMarket(args.symbols, args.tfs, trade_rate=args.rate, seed=args.seed,
+                             depth_levels=args.depth_levels)
+    await FakeExchange(market, speed=args.speed).run(port=args.port)
+
+
+async def replay(args):
+    manifest = read_manifest(args.path)
+    driver = await TARGETS[args.target](config, manifest, args.speed)
+    TRACER.init(f"loadtest_{args.target}")
+    TRACER.sample_rate = args.trace_sample
+    result = await driver.run(read_frames(args.path), limit=args.limit)
+    print(json.dumps(result, indent=2))
+    if args.trace_out:
+        TRACER.dump(args.trace_out)
+        logging.info(f"Chrome trace of {len(TRACER.spans)} spans written to {args.trace_out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Capture Binance websocket traffic and replay it against services")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    capture_parser = commands.add_parser("capture", help="write raw websocket frames to chunked gzip files")
+    capture_parser.add_argument("--out", required=True, help="capture directory")
+    capture_parser.add_argument("--minutes", type=float, default=60)
+    capture_parser.add_argument("--symbols", nargs="*", help="binance symbols, all active symbols by default")
+    capture_parser.add_argument("--feeds", nargs="*", default=DATA_COLLECTOR_FEEDS)
+    capture_parser.add_argument("--arbitrage", action="store_true", help="capture spot/futures all-price streams too")
+    capture_parser.add_argument("--spot-url", default=BINANCE_SPOT_STREAM, help="e.g. ws://localhost:9443/stream")
+    capture_parser.add_argument("--futures-url", default=BINANCE_FUTURES_STREAM,
+                                help="e.g. ws://localhost:9443/futures/stream")
+
+    def add_market_args(command_parser):
+        command_parser.add_argument("--symbols", type=int, default=500)
+        command_parser.add_argument("--tfs", nargs="*", default=DATA_COLLECTOR_TFS)
+        command_parser.add_argument("--rate", type=float, default=SYNTHETIC_TRADE_RATE, help="trades/s per symbol")
+        command_parser.add_argument("--seed", type=int, default=0)
+        command_parser.add_argument("--depth-levels", type=int, default=SYNTHETIC_DEPTH_LEVELS,
+                                    help="order book levels per side of the @depth streams, 0 disables them")
+
+    generate_parser = commands.add_parser("generate", help="write a synthetic capture for replay")
+    generate_parser.add_argument("--out", required=True, help="capture directory")
+    generate_parser.add_argument("--minutes", type=float, default=60)
+    add_market_args(generate_parser)
+
+    serve_parser = commands.add_parser("serve", help="run a fake binance exchange with synthetic streams")
+    serve_parser.add_argument("--port", type=int, default=FAKE_EXCHANGE_PORT)
+    serve_parser.add_argument("--speed", type=float, default=1.0, help="simulated seconds per real second")
+    add_market_args(serve_parser)
+
+    replay_parser = commands.add_parser("replay", help="feed a capture into service callbacks")
+    replay_parser.add_argument("--path", required=True, help="capture directory")
+    replay_parser.add_argument("--target", choices=sorted(TARGETS.keys()), default="collector")
+    replay_parser.add_argument("--speed", type=lambda v: None if v == "max" else float(v), default=1.0,
+                               help="pace multiplier of the captured time, or max")
+    replay_parser.add_argument("--limit", type=int, default=None, help="stop after N frames")
+    replay_parser.add_argument("--trace-out", help="write the sampled spans as Chrome trace JSON")
+    replay_parser.add_argument("--trace-sample", type=float, default=TRACER.sample_rate, help="traced part of events")
+    args = parser.parse_args()
+
+    setup_logger()
+    if args.command == "generate":
+        generate(args)
+    else:
+        asyncio.run(dict(capture=capture, serve=serve, replay=replay)[args.command](args))
@@ -1,7 +1,7 @@
 import asyncio
 import logging
 from datetime import datetime
-from typing import Any, List
+from typing import Any, Dict, List, Optional
 
 import pandas as pd
 import numpy as np
@@ -13,24 +13,36 @@ from core.types import SymbolStr
 from core.exchange.binance import PrivateBinance, PrivateFuturesBinance
 from core.types import Tf
 from core.utils.logs import add_traceback
+from services.metrics import counter, histogram
+from services.loop_monitor import start_loop_monitor
+from services.tracing import TRACER
 from config import BINANCE_API_SECRET, BINANCE_API_KEY, ZMQ_ARBITRAGE_BOT_PORT, CMD_ARBITRAGE_SPREADS, IS_DEV
 import zmq
 import zmq.asyncio
 from .arbitrage_trading_system import ArbitrageTradingSystem
+from .settings import ArbitrageSettings
+
+
+PRICE_UPDATES = counter("arbitrage_price_updates", "All-price stream messages", ["market"])
+SPOT_PRICE_UPDATES = PRICE_UPDATES.labels(market="spot")
+FUTURES_PRICE_UPDATES = PRICE_UPDATES.labels(market="futures")
+UPDATE_SPREADS = histogram("arbitrage_update_spreads_seconds", "Spreads recalculation")
 
 
 class ArbitrageBot(object):
     collateral = "USDT"
 
-    def __init__(self):
+    def __init__(self, settings: Optional[ArbitrageSettings] = None):
         self.spot = PrivateBinance(api_key=BINANCE_API_KEY, api_secret=BINANCE_API_SECRET)
         self.futures = PrivateFuturesBinance(api_key=BINANCE_API_KEY, api_secret=BINANCE_API_SECRET)
         self.symbols: List[SymbolStr] = []
         self.spreads = pd.DataFrame(columns=["spot_price", "futures_price", "delta", "delta_perc"])
+        self.price_event_time: Dict[str, float] = {}  # market -> exchange time of the last all-price message
         context = zmq.asyncio.Context()
         self.socket = context.socket(zmq.PUSH)
         self.socket.bind("tcp://*:%s" % ZMQ_ARBITRAGE_BOT_PORT)
-        self.trading_system = ArbitrageTradingSystem(spot_api=self.spot, futures_api=self.futures)
+        self.trading_system = ArbitrageTradingSystem(spot_api=self.spot, futures_api=self.futures,
+                                                     settings=settings)
 
         self.db = TimesScaleDb(use_pool=True)
 
@@ -51,6 +63,7 @@ class ArbitrageBot(object):
             CoreBase.get_loop().create_task(self.save_spread_snapshot_loop())
             CoreBase.get_loop().create_task(self.push_updates_to_oracle_loop())
         CoreBase.get_loop().create_task(self.update_trading_system())
+        start_loop_monitor("arbitrage_bot")
 
     async def load_symbol_names(self):
         future_symbols = [symbol for symbol, info in self.futures.public.symbol_info.items()
@@ -68,6 +81,11 @@ class ArbitrageBot(object):
         return self.symbols
 
     def on_price_change(self, is_futures: bool, data: List[Any]):
+        (FUTURES_PRICE_UPDATES if is_futures else SPOT_PRICE_UPDATES).inc()
+        if data and 'E' in data[0]:  # one event time for the whole array
+            market = "futures" if is_futures else "spot"
+            self.price_event_time[market] = data[0]['E'] / 1000
+            TRACER.record("price_received", TRACER.new_context(self.price_event_time[market]), market=market)
         if is_futures:
             futures_prices = {SymbolStr(item['s']): item['p'] for item in data if item['s'] in self.symbols}
             self.spreads['futures_price'] = pd.Series(futures_prices, dtype="float")
@@ -76,8 +94,9 @@ class ArbitrageBot(object):
             self.spreads['spot_price'].update(pd.Series(spot_prices, dtype="float"))
 
     async def update_spreads(self):
-        self.spreads['delta'] = self.spreads['spot_price'] - self.spreads['futures_price']
-        self.spreads['delta_perc'] = self.spreads['delta'] / self.spreads['futures_price'] * 100
+        with UPDATE_SPREADS.time():
+            self.spreads['delta'] = self.spreads['spot_price'] - self.spreads['futures_price']
+            self.spreads['delta_perc'] = self.spreads['delta'] / self.spreads['futures_price'] * 100
 
     async def load_historical_data(self):
         now_ = datetime.utcnow()
@@ -141,6 +160,8 @@ class ArbitrageBot(object):
         while True:
             try:
                 # print(len(self.spreads[self.spreads['delta'].notna()]))
+                if len(self.price_event_time) == 2:
+                    self.trading_system.price_event_time = min(self.price_event_time.values())
                 for symbol, row in self.spreads.iterrows():
                     if not (np.isnan(row.spot_price) or np.isnan(row.futures_price)):
                         await self.trading_system.process_spread(symbol=symbol,
@@ -1,4 +1,5 @@
 import logging
+from contextlib import nullcontext
 from typing import Dict, List, Tuple, Optional
 
 import numpy as np
@@ -10,6 +11,14 @@ from core.exchange.binance.entities import Order
 from core.exceptions import ShouldRetryApiException, NotAllowedApiException, BalanceApiException
 from enum import Enum
 from core.utils.logs import add_traceback
+from services.metrics import histogram
+from services.tracing import TRACER
+from .settings import ArbitrageSettings
+
+
+ORDER_ROUND_TRIP = histogram("arbitrage_order_seconds", "Order placement round trip", ["exchange"])
+SPOT_ORDER_ROUND_TRIP = ORDER_ROUND_TRIP.labels(exchange="spot")
+FUTURES_ORDER_ROUND_TRIP = ORDER_ROUND_TRIP.labels(exchange="futures")
 
 
 def get_avg_price(lst: List[Order], by_side: bool = False) -> Optional[float]:
@@ -32,12 +41,6 @@ class AmountType(Enum):
     FILLED = "FILLED"
 
 
-SPREAD_THRESHOLD_MIN = 0.23
-SPREAD_THRESHOLD_OPEN = 0.23 * 2
-SPREAD_THRESHOLD_CLOSE = 0.23
-MAX_TOTAL_QUANTITY = 100
-MAX_PAIR_QUANTITY = 25
-
 IS_ISOLATED = False
 
 
@@ -86,8 +89,9 @@ async def send_msg(msg):
 
 
 class ArbitragePairStateBase(object):
-    def __init__(self, symbol: SymbolStr):
+    def __init__(self, symbol: SymbolStr, settings: Optional[ArbitrageSettings] = None):
         self.symbol = symbol
+        self.settings = settings or ArbitrageSettings()
         self.orders: Dict[ExchangeType, List[Order]] = {ExchangeType.FUTURES: [], ExchangeType.SPOT: []}
         self.sell_side: Optional[ExchangeType] = None
 
@@ -123,7 +127,7 @@ class ArbitragePairStateBase(object):
         return len(self.orders[pair_side]) > 0
 
     def is_full(self):
-        return self.get_quantity(ExchangeType.SPOT, AmountType.FILLED) >= MAX_PAIR_QUANTITY
+        return self.get_quantity(ExchangeType.SPOT, AmountType.FILLED) >= self.settings.max_pair_quantity
 
     def set_sell_side(self, pair_side: ExchangeType):
         self.sell_side = pair_side
@@ -137,45 +141,60 @@ class ArbitragePairStateBase(object):
 
 
 class ArbitragePairStatePaper(ArbitragePairStateBase):
-    def __init__(self, symbol: SymbolStr):
-        super(ArbitragePairStatePaper, self).__init__(symbol)
+    def __init__(self, symbol: SymbolStr, settings: Optional[ArbitrageSettings] = None):
+        super(ArbitragePairStatePaper, self).__init__(symbol, settings)
 
 
 class ArbitrageTradingSystem(object):
-    def __init__(self, spot_api: PrivateBinance, futures_api: PrivateFuturesBinance):
+    def __init__(self, spot_api: PrivateBinance, futures_api: PrivateFuturesBinance,
+                 settings: Optional[ArbitrageSettings] = None, notify: bool = True):
         self.spot = spot_api
         self.futures = futures_api
+        self.settings = settings or ArbitrageSettings()
         self.pair: Dict[SymbolStr, ArbitragePairStateBase] = {}
         self.ban: List[Symbol] = []
         self.stop: bool = False
+        self.price_event_time: Optional[float] = None  # exchange time of the oldest price in use, epoch seconds
+        self.notify = notify  # log and telegram the orders, off for paper replays
+
+    async def send_msg(self, msg):
+        if self.notify:
+            await send_msg(msg)
 
     def get_pair(self, symbol: SymbolStr):
         pair = self.pair.get(symbol, None)
         if pair is None:
-            pair = self.pair[symbol] = ArbitragePairStatePaper(symbol)
+            pair = self.pair[symbol] = ArbitragePairStatePaper(symbol, self.settings)
 
         return pair
 
     def get_amount_total(self):
         return sum([p.get_quoted_price(ExchangeType.SPOT) for p in self.pair.values()])
 
+    def order_span(self, stage: str):
+        if self.price_event_time is None:
+            return nullcontext()
+        return TRACER.span(stage, TRACER.new_context(self.price_event_time))
+
     async def place_spot_order(self, open_mode: bool, symbol: SymbolStr, side: Side,
                                price: Optional[float] = None, amount: Optional[float] = None) -> Order:
         if open_mode:
             quantity = self.spot.public.get_asset_quantity(symbol, price, amount)
-            order = await self.spot.place_order(symbol=symbol, side=side, order_type=OrderType.MARKET,
-                                                is_isolated=IS_ISOLATED, side_effect_type=SideEffectType.MARGIN_BUY,
-                                                quantity=quantity)
+            with SPOT_ORDER_ROUND_TRIP.time(), self.order_span("spot_order_ack"):
+                order = await self.spot.place_order(symbol=symbol, side=side, order_type=OrderType.MARKET,
+                                                    is_isolated=IS_ISOLATED,
+                                                    side_effect_type=SideEffectType.MARGIN_BUY, quantity=quantity)
         else:
             quantity = self.pair[symbol].get_quantity(ExchangeType.SPOT, AmountType.FILLED)
             params = dict(symbol=symbol, side=side, order_type=OrderType.MARKET,
                           is_isolated=IS_ISOLATED, side_effect_type=SideEffectType.AUTO_REPAY)
             try:
-                order = await self.spot.place_order(**params, quantity=quantity)
+                with SPOT_ORDER_ROUND_TRIP.time(), self.order_span("spot_order_ack"):
+                    order = await self.spot.place_order(**params, quantity=quantity)
             except BalanceApiException as e:
                 if e.code == -2010:  # fix asset quantity ??
                     asset = await self.spot.get_cross_margin_asset_balance(symbol.replace("USDT", ""))
-                    await send_msg(f"FIX {symbol} REPAY AMOUNT {quantity} TO {asset['netAsset']}")
+                    await self.send_msg(f"FIX {symbol} REPAY AMOUNT {quantity} TO {asset['netAsset']}")
                     order = await self.spot.place_order(**params, quantity=asset['netAsset'])
                 else:
                     raise e
@@ -192,10 +211,11 @@ class ArbitrageTradingSystem(object):
         else:
             quantity = amount
 
-        order = await self.futures.place_order(symbol=symbol, side=side,
-                                               order_type=OrderType.MARKET,
-                                               quantity=quantity,
-                                               reduce_only=not open_mode)
+        with FUTURES_ORDER_ROUND_TRIP.time(), self.order_span("futures_order_ack"):
+            order = await self.futures.place_order(symbol=symbol, side=side,
+                                                   order_type=OrderType.MARKET,
+                                                   quantity=quantity,
+                                                   reduce_only=not open_mode)
 
         self.pair[symbol].add_order(pair_side=ExchangeType.FUTURES, order=order)
 
@@ -275,8 +295,8 @@ class ArbitrageTradingSystem(object):
 
             pair = self.get_pair(symbol)
 
-            if not pair.is_full() and abs(spread) >= SPREAD_THRESHOLD_OPEN and not \
-                    self.get_amount_total() >= MAX_TOTAL_QUANTITY:
+            if not pair.is_full() and abs(spread) >= self.settings.spread_threshold_open and not \
+                    self.get_amount_total() >= self.settings.max_total_quantity:
                 sell_side = get_sell_pair_side(spread)
                 spot_side, futures_side = get_pair_order_sides(sell_side)
                 pair.set_sell_side(sell_side)
@@ -284,31 +304,32 @@ class ArbitrageTradingSystem(object):
                 msg = f"Open arbitrage <b>{symbol}</b> with <b>{round(spread, 3)}</b>\r\n" \
                       f"{spot_side.value} SPOT @ {spot_price}\r\n " \
                       f"{futures_side.value} FUTURES @ {futures_price}"
-                await send_msg(msg)
+                await self.send_msg(msg)
                 spot_order = await self.place_spot_order(open_mode=True, symbol=symbol, side=spot_side,
-                                                         price=spot_price, amount=MAX_PAIR_QUANTITY)
+                                                         price=spot_price, amount=self.settings.max_pair_quantity)
 
                 futures_order = await self.place_futures_order(open_mode=True, symbol=symbol, side=futures_side,
-                                                               price=futures_price, amount=MAX_PAIR_QUANTITY)
+                                                               price=futures_price, amount=self.settings.max_pair_quantity)
 
-                await send_msg(f"Opened arbitrage <b>{symbol} sell {sell_side.value}</b> with \r\n"
-                               f"<b>SPOT: {spot_order}</b>\r\n"
-                               f"<b>FUTURES: {futures_order}</b>")
-            elif pair.is_full() and get_spread_diff(spread, pair.get_spread_perc()) >= SPREAD_THRESHOLD_CLOSE:
+                await self.send_msg(f"Opened arbitrage <b>{symbol} sell {sell_side.value}</b> with \r\n"
+                                    f"<b>SPOT: {spot_order}</b>\r\n"
+                                    f"<b>FUTURES: {futures_order}</b>")
+            elif pair.is_full() and \
+                    get_spread_diff(spread, pair.get_spread_perc()) >= self.settings.spread_threshold_close:
                 sell_side = opposite_sell_pair_side(pair.sell_side)
                 spot_side, futures_side = get_pair_order_sides(sell_side)
                 spread_diff = pair.get_spread_diff(spread)
                 price_open_spot = pair.get_avg_price(ExchangeType.SPOT)
                 price_open_futures = pair.get_avg_price(ExchangeType.FUTURES)
-                await send_msg(f"Close arbitrage <b>{symbol}</b> with <b>{round(spread, 3)}"
-                               f"(diff: {round(spread_diff, 6)})</b>\r\n "
-                               f"{spot_side.value} SPOT @ {spot_price} open. "
-                               f"(diff. {spot_price - price_open_spot}), \r\n"
-                               f"{futures_side.value} FUTURES @ {futures_price} "
-                               f"(diff. {futures_price - price_open_futures})")
+                await self.send_msg(f"Close arbitrage <b>{symbol}</b> with <b>{round(spread, 3)}"
+                                    f"(diff: {round(spread_diff, 6)})</b>\r\n "
+                                    f"{spot_side.value} SPOT @ {spot_price} open. "
+                                    f"(diff. {spot_price - price_open_spot}), \r\n"
+                                    f"{futures_side.value} FUTURES @ {futures_price} "
+                                    f"(diff. {futures_price - price_open_futures})")
 
                 spot_order = await self.place_spot_order(open_mode=False, symbol=symbol, side=spot_side,
-                                                         price=spot_price, amount=MAX_PAIR_QUANTITY)
+                                                         price=spot_price, amount=self.settings.max_pair_quantity)
 
                 futures_order = await self.place_futures_order(open_mode=False, symbol=symbol, side=futures_side,
                                                                price=futures_price)
@@ -318,7 +339,7 @@ class ArbitrageTradingSystem(object):
                 msg = f"Cosed arbitrage <b>{symbol} sell {sell_side.value}</b> with <b>SPOT: {spot_order}</b> " \
                       f"<b>FUTURES: {futures_order}</b>\r\n" \
                       f"PROFIT: spot {spot_profit}$ futures {futures_profit}$ = {spot_profit + futures_profit}$ "
-                await send_msg(msg)
+                await self.send_msg(msg)
 
                 del self.pair[symbol]
         except NotAllowedApiException as e:
@@ -334,7 +355,7 @@ class ArbitrageTradingSystem(object):
             if pair is not None and pair.is_full():
                 futures_order_place_problem = futures_order is None and spot_order is not None
                 if futures_order_place_problem:
-                    await send_msg(f"FUTURES CLOSE PROBLEM {symbol}")
+                    await self.send_msg(f"FUTURES CLOSE PROBLEM {symbol}")
                     # f_order = await self.futures.place_order(symbol=symbol, side=futures_side,
                     #                                order_type=OrderType.MARKET,
                     #                                close_position=True, quantity=1)
@@ -12,12 +12,7 @@ from core.exchange.binance.entities import Order
 from core.exceptions import ShouldRetryApiException, NotAllowedApiException, BalanceApiException
 from enum import Enum
 from core.utils.logs import add_traceback
-
-SPREAD_THRESHOLD_MIN = 0.23
-SPREAD_THRESHOLD_OPEN = 0.23 * 2
-SPREAD_THRESHOLD_CLOSE = 0.23
-MAX_TOTAL_QUANTITY = 100
-MAX_PAIR_QUANTITY = 25
+from .settings import ArbitrageSettings
 
 IS_ISOLATED = False
 
@@ -85,8 +80,10 @@ class OrdersSet(object):
 
 
 class ArbitragePairAtom(object):
-    def __init__(self, symbol: SymbolStr, spot_api: PrivateBinance, futures_api: PrivateFuturesBinance):
+    def __init__(self, symbol: SymbolStr, spot_api: PrivateBinance, futures_api: PrivateFuturesBinance,
+                 settings: Optional[ArbitrageSettings] = None):
         self.symbol = symbol
+        self.settings = settings or ArbitrageSettings()
         self.spot = spot_api
         self.futures = futures_api
         self.orders: Dict[str, OrdersSet] = {FUTURES: OrdersSet(), SPOT: OrdersSet()}
@@ -112,7 +109,7 @@ class ArbitragePairAtom(object):
         return round(pair_spread - spread if pair_spread > 0 and spread > 0 else pair_spread + spread, 3)
 
     def is_full(self):
-        return self.orders[SPOT].quantity >= MAX_PAIR_QUANTITY
+        return self.orders[SPOT].quantity >= self.settings.max_pair_quantity
 
     def set_sell_exchange_type(self, spread: float):
         self.spread_open = spread
@@ -123,7 +120,7 @@ class ArbitragePairAtom(object):
 
     async def open(self, price_spot: Optional[float] = None, price_futures: Optional[float] = None):
         spot_side, futures_side = get_pair_order_sides(self.sell_exchange_type)
-        quantity_usd = MAX_PAIR_QUANTITY
+        quantity_usd = self.settings.max_pair_quantity
         quantity = self.spot.public.get_asset_quantity(self.symbol, price_spot, quantity_usd)
         order_s = await self.spot.place_order(symbol=self.symbol, side=spot_side, order_type=OrderType.MARKET,
                                               is_isolated=IS_ISOLATED, side_effect_type=SideEffectType.MARGIN_BUY,
@@ -173,9 +170,11 @@ class ArbitragePairAtom(object):
 
 
 class ArbitrageTradingSystem(object):
-    def __init__(self, spot_api: PrivateBinance, futures_api: PrivateFuturesBinance):
+    def __init__(self, spot_api: PrivateBinance, futures_api: PrivateFuturesBinance,
+                 settings: Optional[ArbitrageSettings] = None):
         self.spot = spot_api
         self.futures = futures_api
+        self.settings = settings or ArbitrageSettings()
         self.pair: Dict[SymbolStr, ArbitragePairAtom] = {}
         self.ban: List[Symbol] = []
         self.stop: bool = False
@@ -183,7 +182,8 @@ class ArbitrageTradingSystem(object):
     def get_pair_atom(self, symbol: SymbolStr):
         pair = self.pair.get(symbol, None)
         if pair is None:
-            pair = self.pair[symbol] = ArbitragePairAtom(symbol, futures_api=self.futures, spot_api=self.spot)
+            pair = self.pair[symbol] = ArbitragePairAtom(symbol, futures_api=self.futures, spot_api=self.spot,
+                                                         settings=self.settings)
 
         return pair
 
@@ -191,7 +191,7 @@ class ArbitrageTradingSystem(object):
         return sum([p.orders[SPOT].get_quoted_price() for p in self.pair.values()])
 
     def is_full_depo(self):
-        return self.get_amount_total() >= MAX_TOTAL_QUANTITY
+        return self.get_amount_total() >= self.settings.max_total_quantity
 
     async def halt_and_recover_balance(self):
         pass
@@ -205,11 +205,11 @@ class ArbitrageTradingSystem(object):
             pair = self.get_pair_atom(symbol)
             is_full = pair.is_full()
 
-            if not is_full and abs(spread) >= SPREAD_THRESHOLD_OPEN and not self.is_full_depo():
+            if not is_full and abs(spread) >= self.settings.spread_threshold_open and not self.is_full_depo():
                 pair.set_sell_exchange_type(spread)
                 await pair.open(price_spot=spot_price, price_futures=futures_price)
 
-            elif is_full and pair.get_spread_diff(spread) >= SPREAD_THRESHOLD_CLOSE:
+            elif is_full and pair.get_spread_diff(spread) >= self.settings.spread_threshold_close:
                 await pair.safe_close(price_spot=spot_price, price_futures=futures_price)
                 del self.pair[symbol]
 
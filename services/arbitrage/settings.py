@@ -0,0 +1,17 @@
+from pydantic import BaseModel
+
+SPREAD_THRESHOLD_MIN = 0.23
+SPREAD_THRESHOLD_OPEN = 0.23 * 2
+SPREAD_THRESHOLD_CLOSE = 0.23
+MAX_TOTAL_QUANTITY = 100
+MAX_PAIR_QUANTITY = 25
+
+
+class ArbitrageSettings(BaseModel):
+    spread_threshold_open: float = SPREAD_THRESHOLD_OPEN
+    spread_threshold_close: float = SPREAD_THRESHOLD_CLOSE
+    max_pair_quantity: float = MAX_PAIR_QUANTITY
+    max_total_quantity: float = MAX_TOTAL_QUANTITY
+
+    class Config:
+        frozen = True
@@ -0,0 +1,168 @@
+import asyncio
+import itertools
+import logging
+import random
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from core.exchange.binance.entities import Order
+from core.types import Side
+from .arbitrage_trading_system import ArbitrageTradingSystem, generate_paper_order
+from .settings import ArbitrageSettings
+
+SWEEP_RESULT_COLUMNS = ["spread_threshold_open", "spread_threshold_close", "max_pair_quantity",
+                        "max_total_quantity", "trades", "wins", "profit", "max_drawdown", "open_pairs"]
+PAPER_FUTURES_PRICE = 1.0
+
+_history: Optional[np.ndarray] = None
+_history_shm: Optional[shared_memory.SharedMemory] = None
+_symbols: List[str] = []
+
+
+class SharedSpreadHistory(object):
+    """
+    Spread history (symbols x timestamps of delta_perc) placed in shared memory,
+    so sweep workers attach to it instead of receiving a pickled copy per task.
+    """
+
+    def __init__(self, spreads: pd.DataFrame):
+        data = np.ascontiguousarray(spreads.to_numpy(dtype=np.float64))
+        self.symbols: List[str] = list(spreads.index)
+        self.timestamps = list(spreads.columns)
+        self.shape: Tuple[int, ...] = data.shape
+        self.dtype = data.dtype.str
+        self.shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+        np.ndarray(self.shape, dtype=data.dtype, buffer=self.shm.buf)[:] = data
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _attach_history(name: str, shape: Tuple[int, ...], dtype: str, symbols: List[str]):
+    global _history, _history_shm, _symbols
+    _history_shm = shared_memory.SharedMemory(name=name)
+    _history = np.ndarray(shape, dtype=np.dtype(dtype), buffer=_history_shm.buf)
+    _symbols = symbols
+
+
+class PaperPublic(object):
+    def get_asset_quantity(self, symbol: str, price: float, amount: float) -> float:
+        return amount
+
+
+class PaperExchange(object):
+    """
+    Fills every market order at the price set for the symbol, keeps the cash flow of the fills per symbol.
+    Stands in for both exchange clients of ArbitrageTradingSystem.
+    """
+
+    def __init__(self, commission_perc: float = 0.0):
+        self.public = PaperPublic()
+        self.commission_perc = commission_perc
+        self.prices: Dict[str, float] = {}
+        self.cash: Dict[str, float] = {}
+
+    async def place_order(self, symbol: str, side: Side, quantity: float, **kwargs) -> Order:
+        price = self.prices[symbol]
+        notional = price * quantity
+        cash = notional if side == Side.SELL else -notional
+        self.cash[symbol] = self.cash.get(symbol, 0.0) + cash - notional * self.commission_perc / 100
+        return generate_paper_order(symbol, side, price, quantity, quantity)
+
+
+async def replay(settings: ArbitrageSettings, spreads: np.ndarray, symbols: Sequence[str],
+                 commission_perc: float = 0.0) -> Dict[str, Any]:
+    system = ArbitrageTradingSystem(spot_api=PaperExchange(commission_perc),
+                                    futures_api=PaperExchange(commission_perc), settings=settings, notify=False)
+    trades = wins = 0
+    profit = peak = max_drawdown = 0.0
+
+    for step in range(spreads.shape[1]):
+        for symbol, spread in zip(symbols, spreads[:, step]):
+            if np.isnan(spread):
+                continue
+
+            spot_price = PAPER_FUTURES_PRICE * (1 + spread / 100)
+            system.spot.prices[symbol] = spot_price
+            system.futures.prices[symbol] = PAPER_FUTURES_PRICE
+            is_open = symbol in system.pair and system.pair[symbol].is_full()
+            await system.process_spread(symbol, spot_price, PAPER_FUTURES_PRICE, spread)
+            if is_open and symbol not in system.pair:
+                pnl = system.spot.cash.pop(symbol, 0.0) + system.futures.cash.pop(symbol, 0.0)
+                profit += pnl
+                trades += 1
+                wins += int(pnl > 0)
+
+        peak = max(peak, profit)
+        max_drawdown = max(max_drawdown, peak - profit)
+
+    open_pairs = sum(1 for pair in system.pair.values() if pair.is_full())
+    return dict(trades=trades, wins=wins, profit=profit, max_drawdown=max_drawdown, open_pairs=open_pairs)
+
+
+def simulate(settings: ArbitrageSettings, spreads: np.ndarray, commission_perc: float = 0.0,
+             symbols: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """
+    Runs ArbitrageTradingSystem.process_spread with paper orders over a spread history
+    (rows - symbols, columns - snapshots). Futures are priced PAPER_FUTURES_PRICE, spot by the spread,
+    so a max_pair_quantity pair is worth about max_pair_quantity.
+    """
+    symbols = list(symbols) if symbols is not None else [str(i) for i in range(spreads.shape[0])]
+    return asyncio.run(replay(settings, spreads, symbols, commission_perc))
+
+
+def _run_task(settings: ArbitrageSettings, commission_perc: float) -> Dict[str, Any]:
+    result = simulate(settings, _history, commission_perc, _symbols)
+    result.update(settings.dict())
+    return result
+
+
+def grid_search(grid: Dict[str, Sequence[float]]) -> List[ArbitrageSettings]:
+    keys = list(grid.keys())
+    return [ArbitrageSettings(**dict(zip(keys, values))) for values in itertools.product(*grid.values())]
+
+
+def random_search(ranges: Dict[str, Tuple[float, float]], n: int, seed: Optional[int] = None) -> List[ArbitrageSettings]:
+    rnd = random.Random(seed)
+    return [ArbitrageSettings(**{k: rnd.uniform(low, high) for k, (low, high) in ranges.items()})
+            for _ in range(n)]
+
+
+def run_sweep(spreads: pd.DataFrame, candidates: Iterable[ArbitrageSettings], commission_perc: float = 0.0,
+              max_workers: Optional[int] = None) -> pd.DataFrame:
+    """
+    Fans candidates out to a process pool and returns results ranked by profit.
+    :param spreads: delta_perc history, index - symbols, columns - timestamps
+    """
+    with SharedSpreadHistory(spreads) as history:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_attach_history,
+                                 initargs=(history.name, history.shape, history.dtype,
+                                           history.symbols)) as executor:
+            futures = [executor.submit(_run_task, c, commission_perc) for c in candidates]
+            results = [f.result() for f in futures]
+
+    logging.info(f"Arbitrage sweep: {len(results)} candidates over {spreads.shape} spreads")
+    df = pd.DataFrame(results, columns=SWEEP_RESULT_COLUMNS)
+    return df.sort_values(["profit", "max_drawdown"], ascending=[False, True]).reset_index(drop=True)
+
+
+def deltas_to_spreads(deltas: pd.DataFrame) -> pd.DataFrame:
+    """
+    Pivots TimesScaleDb.load_arbitrage_deltas output into symbols x timestamps matrix.
+    """
+    return deltas.pivot_table(index="symbol", columns="timestamp", values="delta_perc").sort_index(axis=1)
@@ -1,15 +1,22 @@
 import logging
+import os
+import time
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
 from tc.core.base import CoreBase
 from services.market_prediction import MarketPredictionOracle
 from services.telegram_bot import TradingSysTelegramBot
+from services.backend.replica import OracleStatePublisher, OracleReplica
+from services.metrics import histogram
+from services.loop_monitor import start_loop_monitor
+from services.tracing import TRACER
 from tc.core.utils.logs import setup_logger
 from tc.config import Config
 import asyncio
 setup_logger()
+TRACER.init("backend")
 
 app = FastAPI()
 
@@ -28,9 +35,39 @@ app.add_middleware(
 )
 
 config = Config.load_from_env(root_path="..")
-oracle = MarketPredictionOracle(config=config)
+# set ORACLE_MARKET_STORE to read candles/prices from the data collector shared memory store
+market_store_name = os.getenv("ORACLE_MARKET_STORE")
+# standalone - oracle in-process (single worker), primary - standalone + state publisher,
+# replica - API worker serving snapshots of the primary, run with uvicorn --workers N
+oracle_role = os.getenv("ORACLE_ROLE", "standalone")
 
-tg_bot = TradingSysTelegramBot(oracle=oracle, config=config)
+if oracle_role == "replica":
+    oracle = OracleReplica(config=config, primary_host=os.getenv("ORACLE_PRIMARY_HOST", "localhost"),
+                           market_store_name=market_store_name)
+    tg_bot = None
+else:
+    oracle = MarketPredictionOracle(config=config, market_store_name=market_store_name)
+    tg_bot = TradingSysTelegramBot(oracle=oracle, config=config)
+
+
+HTTP_REQUEST = histogram("http_request_seconds", "API request handling time", ["path"])
+
+
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route", None)  # the path template keeps the label cardinality low
+    HTTP_REQUEST.labels(route.path if route is not None else "other").observe(time.perf_counter() - start)
+    return response
+
+
+@app.middleware("http")
+async def stale_data_header(request: Request, call_next):
+    response = await call_next(request)
+    if oracle.stale:
+        response.headers["X-Oracle-Stale"] = "1"
+    return response
 
 
 # async def send_signal(
@@ -41,11 +78,16 @@ tg_bot = TradingSysTelegramBot(oracle=oracle, config=config)
 async def startup_event():
     try:
         CoreBase.get_request()
+        oracle.restore_checkpoint()
         # loop = asyncio.get_event_loop()
         CoreBase.loop.create_task(oracle.init())
         CoreBase.loop.create_task(oracle.update_loop())
-        asyncio.create_task(tg_bot.start())
-        logging.info("SERVER STARTED...")
+        start_loop_monitor("backend")
+        if tg_bot is not None:
+            asyncio.create_task(tg_bot.start())
+        if oracle_role == "primary":
+            asyncio.create_task(OracleStatePublisher(oracle).publish_loop())
+        logging.info(f"SERVER STARTED ({oracle_role})...")
     except Exception as e:
         logging.error(f"SERVER NOT STARTED {e}")
     # tasks.add_task(oracle.init)
@@ -0,0 +1,259 @@
+import asyncio
+import logging
+import pickle
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import zmq
+import zmq.asyncio
+
+from tc.config import Config
+from tc.core.db import TimesScaleDb
+from tc.core.types import Symbol, SymbolTf, Tf
+from tc.core.utils.logs import add_traceback
+from services.market_data import MarketDataStore, SeqLockTimeout
+from services.market_prediction import MarketPredictionOracle
+from services.market_prediction.level_index import LevelIndex
+from services.market_prediction.features import CandleFeatures, FeatureStore, get_timestamps_ms
+
+ZMQ_ORACLE_STATE_PORT = 5566
+ORACLE_STATE_TOPIC = b"oracle_state"
+ORACLE_CANDLES_TOPIC = b"oracle_candles"
+STATE_PUBLISH_INTERVAL = 2  # s
+CANDLES_PUBLISH_INTERVAL = 60  # s, full candle frames, the rows appended in between on every oracle data change
+
+
+class OracleStatePublisher(object):
+    """
+    Runs next to the primary oracle and publishes versioned state snapshots over ZMQ PUB.
+    Every state snapshot is complete. Candles go out in full every CANDLES_PUBLISH_INTERVAL and as the rows changed
+    since the previous candle frame otherwise, so a late or lagging subscriber recovers with the next full frame.
+    """
+
+    def __init__(self, oracle: MarketPredictionOracle, port: int = ZMQ_ORACLE_STATE_PORT):
+        self.oracle = oracle
+        self.socket = zmq.asyncio.Context.instance().socket(zmq.PUB)
+        self.socket.setsockopt(zmq.SNDHWM, 4)
+        self.socket.bind(f"tcp://*:{port}")
+        self.version = 0
+        self.candles_version = 0  # version of the last candle frame, the base of the next partial one
+        self.candles_data_version: Optional[int] = None
+        self.candles_time = 0.0
+        self.candles_sent: Dict[SymbolTf, int] = {}  # ms, open time of the last row published per key
+        self.summary: Dict[Symbol, Dict[Any, Any]] = {}
+        self.summary_data_version: Optional[int] = None
+
+    async def get_summary(self) -> Dict[Symbol, Dict[Any, Any]]:
+        """
+        Recomputed only when the oracle data changed, one symbol at a time so the primary loop keeps running.
+        """
+        oracle = self.oracle
+        if oracle.data_version != self.summary_data_version:
+            data_version = oracle.data_version
+            summary = {}
+            for s in oracle.symbols:
+                summary[s] = oracle.get_summary_by_symbol(s)
+                await asyncio.sleep(0)
+            self.summary, self.summary_data_version = summary, data_version
+        return self.summary
+
+    async def get_state(self) -> Dict[str, Any]:
+        oracle = self.oracle
+        state = oracle.get_state()
+        state.update(version=self.version, data_version=oracle.data_version, initialized=oracle.initialized,
+                     stale=oracle.stale, timestamp=time.time(), summary={}, dnv={})
+        if oracle.initialized:
+            state["summary"] = await self.get_summary()
+            state["dnv"] = {key_: oracle.get_dnv(*key_) for key_ in oracle.symbol_tfs}
+            state["mark_prices"] = {s: oracle.get_mark_price(s) for s in oracle.symbols}
+        return state
+
+    def get_candles(self) -> Dict[SymbolTf, pd.DataFrame]:
+        return {key_: self.oracle.get_candles(*key_) for key_ in self.oracle.symbol_tfs}
+
+    def get_candles_update(self) -> Optional[Dict[SymbolTf, pd.DataFrame]]:
+        """
+        Rows of every key from the last one published on (it may have been updated since), None when a key is new
+        or its candles no longer reach the last published row, which takes a full frame.
+        """
+        update = {}
+        for key_ in self.oracle.symbol_tfs:
+            last_sent = self.candles_sent.get(key_, None)
+            candles = self.oracle.get_candles(*key_)
+            if last_sent is None or len(candles) == 0:
+                return None
+            index = get_timestamps_ms(candles)
+            i = int(np.searchsorted(index, last_sent))
+            if i == len(index) or index[i] != last_sent:
+                return None
+            update[key_] = candles.iloc[i:]
+        return update
+
+    async def publish(self):
+        self.version += 1
+        state = await self.get_state()
+        await self.socket.send_multipart([ORACLE_STATE_TOPIC, pickle.dumps(state, protocol=-1)])
+
+        data_version = self.oracle.data_version
+        is_candles_outdated = time.time() - self.candles_time >= CANDLES_PUBLISH_INTERVAL
+        if not self.oracle.initialized or (data_version == self.candles_data_version and not is_candles_outdated):
+            return
+        candles = self.get_candles_update() if not is_candles_outdated else None
+        is_full = candles is None
+        if is_full:
+            candles = self.get_candles()
+        frame = dict(version=self.version, base_version=self.candles_version, data_version=data_version,
+                     full=is_full, candles=candles)
+        await self.socket.send_multipart([ORACLE_CANDLES_TOPIC, pickle.dumps(frame, protocol=-1)])
+        self.candles_sent = {key_: int(get_timestamps_ms(c)[-1]) for key_, c in candles.items() if len(c)}
+        self.candles_version = self.version
+        self.candles_data_version = data_version
+        if is_full:
+            self.candles_time = time.time()
+
+    async def publish_loop(self):
+        while True:
+            try:
+                await self.publish()
+            except Exception as e:
+                logging.error(add_traceback(e))
+            await asyncio.sleep(STATE_PUBLISH_INTERVAL)
+
+
+class OracleReplica(object):
+    """
+    Read-only oracle for API worker processes: same attributes and getters the backend uses,
+    filled from the primary's snapshots. Candles are read from the shared memory store when attached.
+    """
+
+    def __init__(self, config: Config, primary_host: str = "localhost", port: int = ZMQ_ORACLE_STATE_PORT,
+                 market_store_name: Optional[str] = None):
+        self.db = TimesScaleDb(**config.get_timescale_db_params())
+        self.config = config
+        self.uri = f"tcp://{primary_host}:{port}"
+        self.market_store_name = market_store_name
+        self.market_store: Optional[MarketDataStore] = None
+        self.symbols: List[Symbol] = []
+        self.tfs: List[Tf] = []
+        self.symbol_tfs: List[SymbolTf] = []
+        self.dnv_levels: Dict[SymbolTf, Optional[float]] = {}
+        self.price_levels = LevelIndex()
+        self.features = FeatureStore()
+        self.arbitrage_spreads: pd.DataFrame = pd.DataFrame()
+        self.mark_prices_: Dict[Symbol, float] = {}
+        self.dnv: Dict[SymbolTf, Optional[float]] = {}
+        self.summary: Dict[Symbol, Dict[Any, Any]] = {}
+        self.candles: Dict[SymbolTf, pd.DataFrame] = {}
+        self.candles_version: Optional[int] = None  # version of the last candle frame applied
+        self.done_signals: List[Any] = []  # SignalDedup state of the primary
+        self.initialized = False
+        self.stale = False
+        self.data_version = 0
+        self.version = 0
+        self.signal_callback = None
+        self.logger = logging.getLogger("oracle_replica")
+
+    async def init(self):
+        try:
+            await self.db.init()
+            if self.market_store_name is not None:
+                try:
+                    self.market_store = MarketDataStore.attach(self.market_store_name)
+                except FileNotFoundError:
+                    self.logger.warning(f"Market data store {self.market_store_name} not found, use snapshots")
+            asyncio.create_task(self.subscribe_loop())
+        except Exception as e:
+            self.logger.error(add_traceback(e))
+
+    async def update_loop(self):
+        pass
+
+    def restore_checkpoint(self) -> bool:
+        return False
+
+    def apply_state(self, state: Dict[str, Any]):
+        self.symbols = state["symbols"]
+        self.tfs = state["tfs"]
+        self.symbol_tfs = state["symbol_tfs"]
+        self.dnv_levels = state["dnv_levels"]
+        self.price_levels = LevelIndex(state["price_levels"])
+        self.arbitrage_spreads = state["arbitrage_spreads"]
+        self.mark_prices_ = state["mark_prices"]
+        self.done_signals = state["done_signals"]
+        self.dnv = state["dnv"]
+        self.summary = state["summary"]
+        self.data_version = state["data_version"]
+        self.stale = state["stale"]
+        self.version = state["version"]
+        self.initialized = state["initialized"] and (self.market_store is not None or len(self.candles) > 0)
+
+    def apply_candles(self, frame: Dict[str, Any]):
+        """
+        A partial frame only applies on top of the frame it was built from, after a dropped one the candles wait for
+        the next full frame.
+        """
+        if frame["full"]:
+            self.candles = frame["candles"]
+        elif frame["base_version"] == self.candles_version:
+            candles = dict(self.candles)
+            for key_, rows in frame["candles"].items():
+                previous = candles[key_]
+                candles[key_] = pd.concat([previous[previous.index < rows.index[0]], rows])
+            self.candles = candles
+        else:
+            return
+        self.candles_version = frame["version"]
+
+    async def subscribe_loop(self):
+        socket = zmq.asyncio.Context.instance().socket(zmq.SUB)
+        socket.setsockopt(zmq.RCVHWM, 4)
+        socket.setsockopt(zmq.SUBSCRIBE, ORACLE_STATE_TOPIC)
+        socket.setsockopt(zmq.SUBSCRIBE, ORACLE_CANDLES_TOPIC)
+        socket.connect(self.uri)
+        self.logger.info(f"Oracle replica subscribed @ {self.uri}")
+        while True:
+            try:
+                topic, data = await socket.recv_multipart()
+                frame = pickle.loads(data)
+                if topic == ORACLE_CANDLES_TOPIC:
+                    self.apply_candles(frame)
+                else:
+                    self.apply_state(frame)
+            except Exception as e:
+                self.logger.error(add_traceback(e))
+
+    def get_candles(self, symbol: Symbol, tf: Tf) -> pd.DataFrame:
+        if self.market_store is not None and self.market_store.has(symbol, tf):
+            try:
+                return self.market_store.get_candles(symbol, tf, include_open=True)
+            except SeqLockTimeout as e:
+                self.logger.warning(f"{symbol} {tf}: {e}, candles of the last snapshot")
+        return self.candles[(symbol, tf)].copy()
+
+    def get_features(self, symbol: Symbol, tf: Tf, candles: Optional[pd.DataFrame] = None) -> CandleFeatures:
+        """
+        No candle callbacks here: synced with the candles on every read, which only computes the new rows.
+        """
+        if candles is None:
+            no_store = self.market_store is None or not self.market_store.has(symbol, tf)
+            candles = self.candles[(symbol, tf)] if no_store else self.get_candles(symbol, tf)
+        return self.features.sync((symbol, tf), candles)  # only read, the snapshot frame needs no copy
+
+    def get_mark_price(self, symbol: Symbol) -> Optional[float]:
+        if self.market_store is not None and self.market_store.has(symbol):
+            try:
+                return self.market_store.get_price(symbol)[0]
+            except SeqLockTimeout as e:
+                self.logger.warning(f"{symbol}: {e}, price of the last snapshot")
+        return self.mark_prices_.get(symbol, None)
+
+    def get_dnv(self, symbol: Symbol, tf: Tf) -> Optional[float]:
+        return self.dnv.get((symbol, tf), None)
+
+    def get_summary_by_symbol(self, symbol: Symbol) -> Dict[Any, Any]:
+        return self.summary[symbol]
+
+    def get_summary(self) -> Dict[Symbol, Dict[Any, Any]]:
+        return self.summary
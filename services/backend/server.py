@@ -1,11 +1,15 @@
 from services.backend import app, oracle
 from tc.core.exchange.common.mappers import symbol_to_binance, binance_to_symbol
-from fastapi import Path
+from fastapi import Path, HTTPException, Request
+from fastapi.responses import PlainTextResponse, Response
+from services.metrics import REGISTRY, METRICS_CONTENT_TYPE
+from services.tracing import TRACER
+import services.loop_monitor as loop_monitor
 
 from services.backend.models import SymbolItems, CandlesItem, CandlesBounds, SymbolCandles, \
     SummaryItem, SummaryItemByTf, AtrItem, LargeSummaryItem, ClustersItem, \
     ArbitrageStatsItem, ArbitrageHistoryStatsItem, ArbitragePriceDeltaItem, ArbitrageChartData
-from services.backend.utils import check_is_oracle_initialized
+from services.backend.utils import check_is_oracle_initialized, check_is_local_request
 from tc.core.ta.clusters import normalize_clusters_for_plot
 from tc.config import Config
 from typing import List, Dict
@@ -22,9 +26,40 @@ async def root():
     return {"message": "Hello World"}
 
 
+@app.get("/metrics")
+async def metrics():
+    return Response(content=REGISTRY.generate_text(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/traces")
+async def traces():
+    return TRACER.to_chrome_trace()
+
+
+def get_loop_monitor() -> loop_monitor.LoopMonitor:
+    if loop_monitor.LOOP_MONITOR is None:
+        raise HTTPException(status_code=400, detail={"message": "Loop monitor is not started"})
+    return loop_monitor.LOOP_MONITOR
+
+
+@app.post("/admin/profile/{action}")
+async def profile(request: Request, action: str):
+    check_is_local_request(request)
+    if action not in ("start", "stop"):
+        raise HTTPException(status_code=404, detail={"message": f"Unknown profiler action {action}"})
+    monitor = get_loop_monitor()
+    return monitor.start_profiler() if action == "start" else monitor.stop_profiler()
+
+
+@app.get("/admin/stalls", response_class=PlainTextResponse)
+async def stalls(request: Request):
+    check_is_local_request(request)
+    return get_loop_monitor().format_stalls()
+
+
 @app.get("/symbols", response_model=SymbolItems)
 async def symbols():
-    check_is_oracle_initialized()
+    check_is_oracle_initialized(allow_stale=True)
     symbols = oracle.symbols
     symbols.sort()
     return SymbolItems(symbols=oracle.symbols, tfs=Config().ORACLE_TFS)
@@ -32,26 +67,30 @@ async def symbols():
 
 @app.get("/candles/{symbol}/{tf}", response_model=SymbolCandles)
 async def candles(symbol: str = Path(), tf: str = Path(), timestamp_from: int = 0, timestamp_to: int = 0):
-    check_is_oracle_initialized()
-
-    candles = oracle.api_client.get_candles(symbol.upper(), tf.lower())
-
-    candles["dnv"] = candles["v"] * candles["c"]
-
-    clusters_all = await oracle.db.load_clusters(symbol, start_time=candles.index[0].to_pydatetime(),
-                                                 end_time=candles.index[-1].to_pydatetime())
-    clusters_items = normalize_clusters_for_plot(clusters_all)
-
-    clusters = {i: ClustersItem(timestamp=[d.to_pydatetime() for d in df.timestamp],
-                                price=list(df.price), volume=list(df.volume)) for i, df in clusters_items.items()}
+    check_is_oracle_initialized(allow_stale=True)
+
+    candles = oracle.get_candles(binance_to_symbol(symbol.upper()), tf.lower())
+    dnv = oracle.get_features(binance_to_symbol(symbol.upper()), tf.lower(), candles).get("dnv", len(candles))
+
+    clusters = {}
+    try:
+        clusters_all = await oracle.db.load_clusters(symbol, start_time=candles.index[0].to_pydatetime(),
+                                                     end_time=candles.index[-1].to_pydatetime())
+        clusters_items = normalize_clusters_for_plot(clusters_all)
+        clusters = {i: ClustersItem(timestamp=[d.to_pydatetime() for d in df.timestamp],
+                                    price=list(df.price), volume=list(df.volume))
+                    for i, df in clusters_items.items()}
+    except Exception:
+        if not oracle.serving_checkpoint:  # the db may not be connected yet while init runs
+            raise
 
     candles_item = CandlesItem(o=list(candles.o), h=list(candles.h), l=list(candles.l), c=list(candles.c),
-                               v=list(candles.dnv), timestamp=list(candles.index.to_pydatetime()))
+                               v=dnv.tolist(), timestamp=list(candles.index.to_pydatetime()))
     symbol_ts = (binance_to_symbol(symbol), tf)
     price_levels = oracle.price_levels[symbol_ts]
     volume_level = oracle.dnv_levels[symbol_ts]
     bounds = CandlesBounds(maxPrice=float(candles.h.max()), minPrice=float(candles.l.min()),
-                           minVolume=float(candles.dnv.min()), maxVolume=float(candles.dnv.max()))
+                           minVolume=float(dnv.min()), maxVolume=float(dnv.max()))
     result = SymbolCandles(symbol=symbol, tf=tf, candles=candles_item, bounds=bounds,
                            volumeLevel=float(volume_level), priceLevels=list(price_levels),
                            clusters=clusters)
@@ -60,7 +99,7 @@ async def candles(symbol: str = Path(), tf: str = Path(), timestamp_from: int =
 
 @app.get("/market-summary", response_model=List[SummaryItem])
 async def market_summary():
-    check_is_oracle_initialized()
+    check_is_oracle_initialized(allow_stale=True)
     summary = oracle.get_summary()
     result = []
     for symbol, tfs in summary.items():
@@ -82,7 +121,7 @@ async def market_summary():
 
 @app.get("/long-summary", response_model=List[LargeSummaryItem])
 async def market_summary():
-    check_is_oracle_initialized()
+    check_is_oracle_initialized(allow_stale=True)
     result = []
     for symbol in oracle.symbols:
         tfs = get_summary_by_symbol(symbol, oracle)
@@ -1,10 +1,16 @@
-from fastapi import HTTPException
+from fastapi import HTTPException, Request
 
 from services.backend import oracle
 from services.backend.models import ErrorType
+from services.metrics import is_loopback
 
 
-def check_is_oracle_initialized():
-    if not oracle.initialized:
+def check_is_oracle_initialized(allow_stale: bool = False):
+    if not (oracle.initialized or (allow_stale and oracle.stale)):
         raise HTTPException(status_code=400, detail={"message": "Oracle is not initialized",
-                                                     "errorType": ErrorType.ORACLE_INIT_ERR.value})
\ No newline at end of file
+                                                     "errorType": ErrorType.ORACLE_INIT_ERR.value})
+
+
+def check_is_local_request(request: Request):
+    if request.client is None or not is_loopback(request.client.host):
+        raise HTTPException(status_code=403, detail={"message": "Admin routes are only served to localhost"})
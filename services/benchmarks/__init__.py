@@ -0,0 +1,2 @@
+from .runner import BENCHMARKS, benchmark, run_benchmarks, compare_results, load_results, save_results
+from . import cases
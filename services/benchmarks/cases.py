@@ -0,0 +1,188 @@
+from datetime import timedelta
+
+import pandas as pd
+
+from tc.core.types import Tf
+from services.benchmarks.runner import benchmark
+from services.benchmarks.fixtures import BENCHMARK_PRICE, BenchmarkDb, get_symbols, make_arbitrage_bot, \
+    make_candles, make_clusters, make_oracle, make_price_data, make_trades, make_trading_system
+
+# sizes: trades per 15m candle, candles per TA run, active symbols
+
+
+@benchmark("store_clusters", sizes=[1000, 10000, 100000])
+def store_clusters_case(size: int):
+    from services.collector.data_collector import store_clusters
+
+    start = pd.Timestamp("2023-11-14").to_pydatetime()
+    trades = make_trades(size, start, 15 * 60)
+    prices = [t[1] for t in trades]
+
+    def run():
+        store_clusters("SYN0000USDT", Tf("15m"), 1, start, max(prices), min(prices), trades, step=0.1)
+
+    return run
+
+
+@benchmark("store_levels", sizes=[100, 500, 1000])
+def store_levels_case(size: int):
+    from services.collector.data_collector import store_levels
+
+    candles = make_candles(size, Tf("1h"))
+
+    def run():
+        store_levels("SYN0000USDT", Tf("1h"), 1, candles)
+
+    return run
+
+
+@benchmark("DataCollector.start_clusters_process", sizes=[1000, 10000, 100000])
+def start_clusters_process_case(size: int):
+    """
+    The trades buffer holds the closed candle and the first minute of the next one, it is restored before every call.
+    """
+    from services.collector.data_collector import DataCollector
+    from services.loadtest.replay import StubSocket
+
+    symbol = get_symbols(1)[0]
+    candles = make_candles(1, Tf("15m"))
+    open_time = candles.index[0].to_pydatetime()
+    close_time = open_time + timedelta(minutes=15) - timedelta(milliseconds=1)
+    trades = make_trades(size, open_time, 16 * 60)
+    candle_item = [open_time, *candles.iloc[0].tolist()]
+
+    dc = object.__new__(DataCollector)
+    dc.db = BenchmarkDb()
+    dc.socket = StubSocket()
+    dc.gaps = None
+    dc.symbols = {symbol: dict(symbol=symbol, cluster_size=0.1)}
+
+    def run():
+        dc.trades = {symbol: list(trades)}
+        dc.start_clusters_process(symbol, Tf("15m"), candle_item, close_time)
+
+    return run
+
+
+@benchmark("MarketPredictionOracle.check_signals", sizes=[50, 200, 500])
+def check_signals_case(size: int):
+    oracle = make_oracle(size)
+
+    async def run():
+        await oracle.check_signals()
+
+    return run
+
+
+@benchmark("MarketPredictionOracle.get_summary_by_symbol", sizes=[100, 500, 1000])
+def get_summary_by_symbol_case(size: int):
+    """
+    size: candles per tf. The ttl cache is bypassed, every call computes the summary.
+    """
+    from services.market_prediction.oracle import MarketPredictionOracle
+
+    oracle = make_oracle(1, candles=size)
+    get_summary_by_symbol = MarketPredictionOracle.get_summary_by_symbol.__wrapped__
+
+    def run():
+        get_summary_by_symbol(oracle, oracle.symbols[0])
+
+    return run
+
+
+@benchmark("ArbitrageBot.on_price_change", sizes=[100, 300, 600])
+def on_price_change_case(size: int):
+    bot = make_arbitrage_bot(size)
+    spot, futures = make_price_data(bot.symbols, False, 2), make_price_data(bot.symbols, True, 3)
+
+    def run():
+        bot.on_price_change(is_futures=False, data=spot)
+        bot.on_price_change(is_futures=True, data=futures)
+
+    return run
+
+
+@benchmark("ArbitrageBot.update_spreads", sizes=[100, 300, 600])
+def update_spreads_case(size: int):
+    bot = make_arbitrage_bot(size)
+
+    async def run():
+        await bot.update_spreads()
+
+    return run
+
+
+@benchmark("ArbitrageBot.refresh_history_stats", sizes=[100, 300, 600])
+def refresh_history_stats_case(size: int):
+    bot = make_arbitrage_bot(size)
+
+    def run():
+        bot.refresh_history_stats()
+
+    return run
+
+
+@benchmark("ArbitrageTradingSystem.process_spread", sizes=[100, 300, 600])
+def process_spread_case(size: int):
+    """
+    One update_trading_system pass: every symbol once, a tenth of them with open pairs, no orders are placed.
+    """
+    system = make_trading_system(size, open_pairs=size // 10)
+    symbols = get_symbols(size)
+
+    async def run():
+        for symbol in symbols:
+            await system.process_spread(symbol=symbol, spot_price=BENCHMARK_PRICE * 1.003,
+                                        futures_price=BENCHMARK_PRICE, spread=0.3)
+
+    return run
+
+
+def get_backend_route(path: str, oracle):
+    """
+    Endpoint of the FastAPI app with the module level oracle of the backend replaced by the benchmark oracle.
+    """
+    import services.backend.server as server
+    import services.backend.utils as utils
+
+    server.oracle = utils.oracle = oracle
+    return next(r.endpoint for r in server.app.routes if getattr(r, "path", None) == path)
+
+
+@benchmark("backend /candles", sizes=[100, 500, 1000])
+def candles_handler_case(size: int):
+    oracle = make_oracle(1, candles=size)
+    symbol, tf = get_symbols(1)[0], Tf("1h")
+    oracle.db = BenchmarkDb(make_clusters(oracle.get_candles(oracle.symbols[0], tf).iloc[-100:], step=0.5))
+    endpoint = get_backend_route("/candles/{symbol}/{tf}", oracle)
+
+    async def run():
+        await endpoint(symbol=symbol, tf=tf, timestamp_from=0, timestamp_to=0)
+
+    return run
+
+
+@benchmark("backend /market-summary", sizes=[50, 200, 500])
+def market_summary_handler_case(size: int):
+    from services.market_prediction.oracle import MarketPredictionOracle
+
+    oracle = make_oracle(size)
+    endpoint = get_backend_route("/market-summary", oracle)
+
+    async def run():
+        MarketPredictionOracle.get_summary_by_symbol.cache_clear()
+        await endpoint()
+
+    return run
+
+
+@benchmark("OrderBook replay", sizes=[10000, 100000])
+def order_book_case(size: int):
+    from services.collector.order_book import generate_depth_events, replay_benchmark
+
+    snapshots, events = generate_depth_events(50, size)
+
+    def run():
+        replay_benchmark(snapshots, events)
+
+    return run
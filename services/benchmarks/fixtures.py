@@ -0,0 +1,200 @@
+import atexit
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from tc.core.exchange.common.mappers import binance_to_symbol
+from tc.core.types import Symbol, SymbolStr, Tf
+from services.collector.resampler import get_bucket_end
+from services.market_data import MarketDataStore
+from services.market_data.candle_cache import rows_to_data_frame
+from services.loadtest.replay import StubDb
+from services.loadtest.synthetic import get_symbol_name
+
+BENCHMARK_START_MS = 1_700_000_000_000 - 1_700_000_000_000 % (7 * 24 * 60 * 60 * 1000)
+BENCHMARK_TFS = [Tf("15m"), Tf("1h"), Tf("4h"), Tf("1d")]
+BENCHMARK_PRICE = 100.0
+
+stores: List[MarketDataStore] = []
+
+
+@atexit.register
+def close_stores():
+    for store in stores:
+        store.close()
+
+
+def make_candle_rows(n: int, tf: Tf, price: float = BENCHMARK_PRICE, seed: int = 0) -> np.ndarray:
+    """
+    [timestamp_ms, o, h, l, c, v] rows of a random walk ending now-ish, as stored by CandleCache.
+    """
+    rnd = np.random.default_rng(seed)
+    tf_ms = get_bucket_end(0, tf)
+    close = price * np.exp(np.cumsum(rnd.normal(0, 0.01, n)))
+    open_ = np.concatenate([[price], close[:-1]])
+    spread = np.abs(rnd.normal(0, 0.005, n)) * close
+    rows = np.empty((n, 6))
+    rows[:, 0] = BENCHMARK_START_MS - tf_ms * np.arange(n, 0, -1)
+    rows[:, 1], rows[:, 4] = open_, close
+    rows[:, 2] = np.maximum(open_, close) + spread
+    rows[:, 3] = np.minimum(open_, close) - spread
+    rows[:, 5] = rnd.exponential(1000, n)
+    return rows
+
+
+def make_candles(n: int, tf: Tf, price: float = BENCHMARK_PRICE, seed: int = 0) -> pd.DataFrame:
+    return rows_to_data_frame(make_candle_rows(n, tf, price, seed))
+
+
+def make_trades(n: int, start: datetime, seconds: float, price: float = BENCHMARK_PRICE,
+                seed: int = 0) -> List[List[Any]]:
+    """
+    [timestamp, price, volume, is_buyer] as buffered by DataCollector.on_trade.
+    """
+    rnd = np.random.default_rng(seed)
+    offsets = np.sort(rnd.uniform(0, seconds, n))
+    prices = price * (1 + rnd.normal(0, 0.002, n))
+    volumes = rnd.exponential(1, n)
+    is_buyer = rnd.random(n) < 0.5
+    return [[start + pd.Timedelta(seconds=float(o)), float(p), float(v), bool(b)]
+            for o, p, v, b in zip(offsets, prices, volumes, is_buyer)]
+
+
+def get_symbols(n: int) -> List[SymbolStr]:
+    return [get_symbol_name(i) for i in range(n)]
+
+
+def make_market_store(symbols: List[SymbolStr], tfs: List[Tf], candles: int) -> MarketDataStore:
+    """
+    Shared memory store seeded with candles, open candles and prices, as filled by the data collector.
+    """
+    store = MarketDataStore.create(symbols, tfs, name=f"tc_benchmark_{os.getpid()}_{len(stores)}", capacity=candles)
+    stores.append(store)
+    for n, symbol in enumerate(symbols):
+        for tf in tfs:
+            rows = make_candle_rows(candles, tf, seed=n)
+            store.seed_candles(symbol, tf, rows_to_data_frame(rows))
+            last = rows[-1]
+            open_time = pd.to_datetime(int(last[0]) + get_bucket_end(0, tf), unit="ms").to_pydatetime()
+            store.update_candle(symbol, tf, [open_time, last[4], last[4], last[4], last[4], last[5] / 2], False)
+        store.update_price(symbol, BENCHMARK_PRICE, datetime.utcnow())
+    return store
+
+
+class BenchmarkDb(StubDb):
+    """
+    StubDb with the reads used by the API handlers.
+    """
+
+    def __init__(self, clusters: Optional[pd.DataFrame] = None):
+        super(BenchmarkDb, self).__init__()
+        self.clusters = clusters if clusters is not None else pd.DataFrame(
+            columns=["timestamp", "price_from", "price_to", "volume"])
+
+    async def load_clusters(self, *args, **kwargs) -> pd.DataFrame:
+        return self.clusters
+
+
+def make_clusters(candles: pd.DataFrame, step: float, seed: int = 0) -> pd.DataFrame:
+    """
+    Volume per price step of every candle, rows as written by TimesScaleDb.save_clusters.
+    """
+    rnd = np.random.default_rng(seed)
+    rows = []
+    for timestamp, c in candles.iterrows():
+        for price_from in np.arange(np.floor(c.l / step) * step, c.h, step):
+            rows.append([timestamp, price_from, price_from + step, rnd.exponential(10)])
+    return pd.DataFrame(rows, columns=["timestamp", "price_from", "price_to", "volume"])
+
+
+def make_oracle(symbols_count: int, candles: int = 300, levels: int = 10, seed: int = 0):
+    """
+    MarketPredictionOracle without exchange client and DB: candles and prices come from a seeded market store.
+    """
+    from services.market_prediction.oracle import MarketPredictionOracle, get_price_level_symbol
+    from services.market_prediction.level_index import LevelIndex
+    from services.market_prediction.signal_dedup import SignalDedup
+    from services.market_prediction.features import FeatureStore
+
+    rnd = np.random.default_rng(seed)
+    oracle = object.__new__(MarketPredictionOracle)
+    oracle.symbols = [binance_to_symbol(s) for s in get_symbols(symbols_count)]
+    oracle.tfs = list(BENCHMARK_TFS)
+    oracle.symbol_tfs = [(s, tf) for tf in oracle.tfs for s in oracle.symbols]
+    oracle.market_store = make_market_store(oracle.symbols, oracle.tfs, candles)
+    oracle.market_store_counts = {}
+    oracle.mark_prices_ = {s: BENCHMARK_PRICE for s in oracle.symbols}
+    oracle.dnv_levels = {key_: float(rnd.uniform(1e5, 1e6)) for key_ in oracle.symbol_tfs}
+    oracle.price_levels = LevelIndex({key_: rnd.uniform(0.8, 1.2, levels) * BENCHMARK_PRICE
+                                      for key_ in oracle.symbol_tfs})
+    oracle.done_signals = SignalDedup(group_of=get_price_level_symbol)
+    oracle.features = FeatureStore()
+    oracle.signal_callback = None
+    oracle.db = BenchmarkDb()
+    oracle.logger = logging.getLogger("oracle")
+    oracle.arbitrage_spreads = pd.DataFrame()
+    oracle.initialized = True
+    oracle.stale = False
+    oracle.data_version = 0
+    return oracle
+
+
+def make_price_data(symbols: List[SymbolStr], is_futures: bool, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    !markPrice@arr (futures) or !miniTicker@arr (spot) payload.
+    """
+    rnd = np.random.default_rng(seed)
+    prices = BENCHMARK_PRICE * (1 + rnd.normal(0, 0.003, len(symbols)))
+    key_ = "p" if is_futures else "c"
+    return [{"s": s, key_: f"{p:.8f}"} for s, p in zip(symbols, prices)]
+
+
+def make_arbitrage_bot(symbols_count: int, seed: int = 0):
+    """
+    ArbitrageBot without exchange clients, ZMQ socket and DB, spreads filled with prices and history stats.
+    """
+    from constants import HIST_INTERVAL
+    from services.arbitrage import ArbitrageBot
+
+    rnd = np.random.default_rng(seed)
+    bot = object.__new__(ArbitrageBot)
+    bot.symbols = get_symbols(symbols_count)
+    bot.spreads = pd.DataFrame(columns=["spot_price", "futures_price", "delta", "delta_perc"])
+    bot.spreads['symbol'] = bot.symbols
+    bot.spreads.set_index("symbol", inplace=True)
+    bot.db = StubDb()
+    bot.price_event_time = {}
+    bot.on_price_change(is_futures=False, data=make_price_data(bot.symbols, False, seed))
+    bot.on_price_change(is_futures=True, data=make_price_data(bot.symbols, True, seed + 1))
+    for name in HIST_INTERVAL.keys():
+        for column in [f'delta_{name}', f'delta_{name}_max', f'delta_{name}_min']:
+            bot.spreads[column] = rnd.normal(0, 0.1, symbols_count)
+        for column in [f'delta_perc_{name}', f'delta_perc_{name}_max', f'delta_perc_{name}_min']:
+            bot.spreads[column] = rnd.normal(0, 0.1, symbols_count)
+    return bot
+
+
+def make_trading_system(symbols_count: int, open_pairs: int):
+    """
+    ArbitrageTradingSystem without exchange clients: open_pairs symbols hold filled paper orders,
+    so process_spread runs the close checks, the rest the open checks.
+    """
+    from core.types import ExchangeType, Side
+    from services.arbitrage.arbitrage_trading_system import ArbitrageTradingSystem, generate_paper_order
+    from services.arbitrage.settings import ArbitrageSettings
+
+    system = ArbitrageTradingSystem(spot_api=None, futures_api=None,
+                                    settings=ArbitrageSettings(max_total_quantity=float("inf")))
+    for symbol in get_symbols(symbols_count)[:open_pairs]:
+        pair = system.get_pair(symbol)
+        pair.set_sell_side(ExchangeType.SPOT)
+        quantity = system.settings.max_pair_quantity
+        pair.add_order(ExchangeType.SPOT, generate_paper_order(symbol, Side.SELL, BENCHMARK_PRICE * 1.005,
+                                                               quantity, quantity))
+        pair.add_order(ExchangeType.FUTURES, generate_paper_order(symbol, Side.BUY, BENCHMARK_PRICE,
+                                                                  quantity, quantity))
+    return system
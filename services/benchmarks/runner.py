@@ -0,0 +1,140 @@
+import asyncio
+import gc
+import json
+import os
+import platform
+import statistics
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from tc.core.utils.logs import add_traceback
+
+BENCHMARK_DIR = "./data/benchmarks"
+BENCHMARK_REPEATS = 7
+BENCHMARK_MIN_TIME = 0.2  # s per repeat, the number of calls is calibrated to reach it
+REGRESSION_TOLERANCE = 0.15  # median slower than the baseline by more than this part is a regression
+
+Setup = Callable[[int], Callable[[], Union[None, Awaitable[None]]]]
+
+
+class Benchmark(object):
+    """
+    setup(size) builds the synthetic inputs and returns the measured call, sync or async.
+    """
+
+    def __init__(self, name: str, setup: Setup, sizes: List[int]):
+        self.name = name
+        self.setup = setup
+        self.sizes = sizes
+
+
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+
+def benchmark(name: str, sizes: List[int]):
+    def register(setup: Setup) -> Setup:
+        BENCHMARKS[name] = Benchmark(name, setup, sizes)
+        return setup
+
+    return register
+
+
+def get_key(name: str, size: int) -> str:
+    return f"{name}[{size}]"
+
+
+async def measure(fn: Callable[[], Union[None, Awaitable[None]]], repeats: int = BENCHMARK_REPEATS,
+                  min_time: float = BENCHMARK_MIN_TIME) -> Dict[str, float]:
+    is_async = asyncio.iscoroutinefunction(fn)
+
+    async def run(number: int) -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            if is_async:
+                await fn()
+            else:
+                fn()
+        return time.perf_counter() - start
+
+    number = 1
+    while True:  # calibration, also the warmup
+        elapsed = await run(number)
+        if elapsed >= min_time / 10 or number >= 10 ** 6:
+            break
+        number *= 10
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        times = [await run(number) / number for _ in range(repeats)]
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return dict(number=number, min=min(times), median=statistics.median(times), mean=statistics.mean(times),
+                stdev=statistics.stdev(times) if len(times) > 1 else 0.0)
+
+
+async def run_benchmarks(names: Optional[List[str]] = None, sizes: Optional[List[int]] = None,
+                         repeats: int = BENCHMARK_REPEATS, min_time: float = BENCHMARK_MIN_TIME,
+                         log: Callable[[str], None] = print) -> Dict[str, Any]:
+    """
+    :return: medians etc. per key in results, the error of every benchmark which raised in failed
+    """
+    results = {}
+    failed = {}
+    for name, b in BENCHMARKS.items():
+        if names and not any(n in name for n in names):
+            continue
+        for size in b.sizes:
+            if sizes and size not in sizes:
+                continue
+            try:
+                fn = b.setup(size)
+                result = await measure(fn, repeats, min_time)
+            except Exception as e:
+                failed[get_key(name, size)] = repr(e)
+                log(f"{get_key(name, size):<60} failed: {add_traceback(e)}")
+                continue
+            results[get_key(name, size)] = result
+            log(f"{get_key(name, size):<60} {result['median'] * 1000:>12.4f} ms  (+/- {result['stdev'] * 1000:.4f})")
+    return dict(created=time.time(), python=platform.python_version(), machine=platform.machine(),
+                processor=platform.processor(), results=results, failed=failed)
+
+
+def save_results(data: Dict[str, Any], file_name: str):
+    os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+    with open(file_name, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def load_results(file_name: str) -> Dict[str, Any]:
+    with open(file_name) as f:
+        return json.load(f)
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any],
+                    tolerance: float = REGRESSION_TOLERANCE) -> List[Dict[str, Any]]:
+    """
+    :return: a row per key of either run, regression=True when the median got slower than tolerance,
+        error set when the benchmark failed in the current run or is missing from one of the runs
+    """
+    failed = current.get("failed", {})
+    rows = []
+    for key in sorted(set(baseline["results"]) | set(current["results"]) | set(failed)):
+        base, result = baseline["results"].get(key, None), current["results"].get(key, None)
+        error = None
+        if key in failed:
+            error = f"failed: {failed[key]}"
+        elif base is None:
+            error = "missing from the baseline"
+        elif result is None:
+            error = "missing from the current run"
+        if error is not None:
+            rows.append(dict(key=key, baseline=base["median"] if base else None,
+                             current=result["median"] if result else None, ratio=None, regression=False, error=error))
+            continue
+        ratio = result["median"] / base["median"] if base["median"] > 0 else 1.0
+        rows.append(dict(key=key, baseline=base["median"], current=result["median"], ratio=ratio,
+                         regression=ratio > 1 + tolerance, error=None))
+    return rows
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import aiohttp
+
+BINANCE_SPOT_API = os.getenv("BINANCE_SPOT_API", "https://api.binance.com")  # e.g. the loadtest fake exchange
+REQUEST_WEIGHT_PER_MINUTE = 1200  # binance limit is 6000, keep the rest for the trading services
+REQUEST_RETRIES = 5
+KLINES_LIMIT = 1000
+AGG_TRADES_LIMIT = 1000
+AGG_TRADES_WEIGHT = 4
+AGG_TRADES_WINDOW_MS = 60 * 60 * 1000  # binance max startTime-endTime window without fromId
+
+
+def get_depth_weight(limit: int) -> int:
+    if limit <= 100:
+        return 5
+    if limit <= 500:
+        return 25
+    if limit <= 1000:
+        return 50
+    return 250
+
+
+class RateLimitBudget(object):
+    """
+    Token bucket of request weight refilled continuously up to weight_per_minute.
+    """
+
+    def __init__(self, weight_per_minute: int = REQUEST_WEIGHT_PER_MINUTE):
+        self.capacity = weight_per_minute
+        self.tokens = float(weight_per_minute)
+        self.rate = weight_per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, weight: int):
+        async with self.lock:
+            while True:
+                now_ = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now_ - self.updated) * self.rate)
+                self.updated = now_
+                if self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                await asyncio.sleep((weight - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class BinanceRestClient(object):
+    def __init__(self, base_url: str = BINANCE_SPOT_API, budget: Optional[RateLimitBudget] = None):
+        self.base_url = base_url
+        self.budget = budget or RateLimitBudget()
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def get(self, path: str, params: Dict[str, Any], weight: int = 1) -> Any:
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+
+        for attempt in range(REQUEST_RETRIES):
+            await self.budget.acquire(weight)
+            async with self.session.get(f"{self.base_url}{path}", params=params) as response:
+                if response.status in (418, 429):
+                    retry_after = float(response.headers.get("Retry-After", 2 ** attempt))
+                    logging.warning(f"Binance REST rate limited {path}, retry in {retry_after}s")
+                    self.budget.pause(retry_after)
+                    continue
+                response.raise_for_status()
+                return await response.json()
+
+        raise Exception(f"Binance REST {path} {params} failed after {REQUEST_RETRIES} attempts")
+
+    async def get_depth_snapshot(self, symbol: str, limit: int = 1000) -> Dict[str, Any]:
+        return await self.get("/api/v3/depth", dict(symbol=symbol.upper(), limit=limit), get_depth_weight(limit))
+
+    async def get_klines(self, symbol: str, interval: str, start_time: Optional[int] = None,
+                         end_time: Optional[int] = None, limit: int = KLINES_LIMIT) -> List[List[Any]]:
+        """
+        :param start_time: open time ms, inclusive
+        :return: raw klines [open time, o, h, l, c, v, close time, quote volume, trades, taker base, taker quote, -]
+        """
+        params = dict(symbol=symbol.upper(), interval=interval, limit=limit)
+        if start_time is not None:
+            params["startTime"] = start_time
+        if end_time is not None:
+            params["endTime"] = end_time
+        return await self.get("/api/v3/klines", params, weight=2)
+
+    async def iter_agg_trades(self, symbol: str, start_ms: int, end_ms: int,
+                              from_id: Optional[int] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Raw aggTrades pages of [start_ms, end_ms), paginated by trade id.
+        """
+        while from_id is None and start_ms < end_ms:  # find the first trade id by time
+            trades = await self.get("/api/v3/aggTrades", dict(symbol=symbol.upper(), startTime=start_ms,
+                                                              endTime=min(start_ms + AGG_TRADES_WINDOW_MS, end_ms) - 1,
+                                                              limit=1), AGG_TRADES_WEIGHT)
+            if trades:
+                from_id = trades[0]["a"]
+            else:
+                start_ms += AGG_TRADES_WINDOW_MS
+
+        while from_id is not None:
+            trades = await self.get("/api/v3/aggTrades", dict(symbol=symbol.upper(), fromId=from_id,
+                                                              limit=AGG_TRADES_LIMIT), AGG_TRADES_WEIGHT)
+            page = [t for t in trades if t["T"] < end_ms]
+            if page:
+                yield page
+            if len(page) < len(trades) or len(trades) < AGG_TRADES_LIMIT:
+                break
+            from_id = trades[-1]["a"] + 1
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from tc.core.db.timescaledb import TimesScaleDb
+from tc.core.types import SymbolStr, Tf
+from tc.core.utils.data import candles_to_data_frame
+from tc.core.utils.logs import add_traceback
+from services.metrics import histogram
+from services.tracing import TRACER, TraceContext
+
+CANDLE_WRITE_WINDOW = 1.0  # s, klines of all symbols close within ~1s
+CANDLE_WRITE_CONCURRENCY = 4  # save_candles calls of a burst in flight at once, well below the pool size
+
+DB_WRITE = histogram("db_write_seconds", "TimescaleDB write latency", ["op"])
+
+
+class CandleWriteCoalescer(object):
+    """
+    Collects closed candles for a short window and writes the whole burst at once: one save_candles per (symbol, tf),
+    each of a DataFrame of its own candles, at most concurrency of them in flight so an hourly close does not take
+    every pool connection. The candle tables and their upsert belong to TimesScaleDb.save_candles.
+    """
+
+    def __init__(self, db: TimesScaleDb, window: float = CANDLE_WRITE_WINDOW,
+                 concurrency: int = CANDLE_WRITE_CONCURRENCY):
+        self.db = db
+        self.window = window
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.pending: List[Tuple[SymbolStr, Tf, List[Any], Optional[TraceContext]]] = []
+        self.flush_task: Optional[asyncio.Task] = None
+        self.bursts = 0
+        self.last_burst_size = 0
+        self.last_flush_latency = 0.0
+        self.max_burst_size = 0
+
+    def add(self, symbol: SymbolStr, tf: Tf, candle_item: List[Any], trace: Optional[TraceContext] = None):
+        self.pending.append((symbol, tf, candle_item, trace))
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.window)
+        self.flush_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.error(add_traceback(e))
+
+    async def save(self, symbol: SymbolStr, tf: Tf, candle_items: List[List[Any]]):
+        async with self.semaphore:
+            await self.db.save_candles(symbol, tf, candles=candles_to_data_frame(candle_items))
+
+    async def flush(self):
+        items, self.pending = self.pending, []
+        if not items:
+            return
+
+        start = time.time()
+        items.sort(key=lambda i: (i[0], i[1], i[2][0]))  # time order within every group
+
+        groups: Dict[Tuple[SymbolStr, Tf], List[int]] = {}
+        for pos, (symbol, tf, _, _) in enumerate(items):
+            groups.setdefault((symbol, tf), []).append(pos)
+
+        results = await asyncio.gather(*[self.save(symbol, tf, [items[p][2] for p in pos])
+                                         for (symbol, tf), pos in groups.items()], return_exceptions=True)
+        end = time.time()
+        for ((symbol, tf), pos), r in zip(groups.items(), results):
+            if isinstance(r, Exception):
+                logging.error(f"Candles {symbol}_{tf} not saved: {add_traceback(r)}")
+                continue
+            for p in pos:
+                if items[p][3] is not None:
+                    TRACER.record("candle_stored", items[p][3], start=start, end=end)
+
+        self.bursts += 1
+        self.last_burst_size = len(items)
+        self.max_burst_size = max(self.max_burst_size, len(items))
+        self.last_flush_latency = time.time() - start
+        DB_WRITE.labels(op="save_candles_burst").observe(self.last_flush_latency)
+        logging.info(f"Candles burst: {len(items)} candles of {len(groups)} symbol/tfs "
+                     f"saved in {round(self.last_flush_latency, 3)}s")
@@ -1,13 +1,11 @@
 import asyncio
 import logging
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Any, Callable, Dict, List, Tuple, Union, Optional
 from tc.core.base import CoreBase
 import pandas as pd
 from tc.config import ZMQ_CLUSTERS_PORT, Config
-from tc.core.exchange.binance import PublicBinance, PublicFuturesBinance
-from tc.core.utils.data import candles_to_data_frame
 from tc.core.exchange.common.mappers import symbol_to_binance, binance_to_symbol
 
 from tc.core.types import SymbolStr, Symbol, Tf, Singleton, TaLevels
@@ -16,6 +14,17 @@ from tc.core.db.timescaledb import TimesScaleDb
 from tc.core.ta.clusters import get_clusters
 from tc.core.ta.ta import get_volume_levels, get_price_levels, get_sup_resist_peaks
 from tc.core.providers import TimescaleDataProvider
+from services.market_data import CandleCache, CachedDataProvider, MarketDataStore
+from services.market_data.candle_cache import to_timestamp_ms
+from services.collector.candle_writer import DB_WRITE, CandleWriteCoalescer
+from services.collector.ta_state import TaCandlesState, ZMQ_TA_RESYNC_PORT_SHIFT, LEVELS_HISTORY_SIZE
+from services.collector.shards import ConnectionShardPool, ProcessShardPool, ShardPool, get_shards_count
+from services.collector.resampler import CandleResampler, BASE_TF, get_bucket_end
+from services.collector.gaps import GapBackfiller, shift_time
+from services.collector.order_book import OrderBookManager, DepthHeatmapStore, DEPTH_HEATMAP_INTERVAL
+from services.metrics import REGISTRY, counter, histogram, start_http_exporter
+from services.loop_monitor import start_loop_monitor
+from services.tracing import TRACER, TraceContext, event_time
 from multiprocessing import get_logger
 # from loky import set_loky_pickler, Future
 # from loky import get_reusable_executor
@@ -24,7 +33,19 @@ import zmq
 import zmq.asyncio
 
 DATA_COLLECTOR_FEEDS = ["aggTrade", "kline_15m", "kline_1h", "kline_4h",  "kline_1d"]
+DATA_COLLECTOR_TFS = [Tf(feed.replace("kline_", "")) for feed in DATA_COLLECTOR_FEEDS if feed.startswith("kline_")]
+DATA_COLLECTOR_RESAMPLE_FEEDS = ["aggTrade", f"kline_{BASE_TF}"]  # DATA_COLLECTOR_TFS are built from kline_1m
 # DATA_COLLECTOR_FEEDS = ["aggTrade", "kline_1m"]
+
+TRADES = counter("collector_trades", "Trades received from the exchange streams")
+CLOSED_CANDLES = counter("collector_closed_candles", "Closed candles processed", ["tf"])
+DB_WRITE_TRADE = DB_WRITE.labels(op="add_trade")
+# TA queue depth = zmq_messages_sent_total - zmq_messages_received_total
+ZMQ_SENT = counter("zmq_messages_sent", "Messages pushed to the TA processor", ["topic"])
+ZMQ_RECEIVED = counter("zmq_messages_received", "Messages pulled by the TA processor", ["topic"])
+TA_QUEUE_WAIT = histogram("ta_queue_wait_seconds", "Time from push by the collector to pull by the TA processor",
+                          ["topic"])
+TA_JOB = histogram("ta_job_seconds", "TA processor job duration", ["topic"])
 # set_loky_pickler('pickle')
 
 
@@ -77,15 +98,23 @@ def store_clusters(symbol: SymbolStr, tf: Tf, symbol_tf_id: int, timestamp: date
         mp_logger.error(add_traceback(e))
 
 
-def ta_processor_client(config: Config):
+def ta_processor_client(config: Config, metrics_port: Optional[int] = None):
     mp_logger = get_logger()
+    TRACER.init("ta_processor")
+    if metrics_port is not None:
+        start_http_exporter(metrics_port)
     db = TimesScaleDb(**config.get_timescale_db_params(), use_pool=False)
     CoreBase.get_loop().run_until_complete(db.init(simple=True))
 
     context = zmq.Context()
     socket_pull = context.socket(zmq.PULL)
     socket_pull.connect("tcp://localhost:%s" % ZMQ_CLUSTERS_PORT)  # socket.setsockopt(zmq.SUBSCRIBE, b'camera_frame')
+    socket_resync = context.socket(zmq.PUSH)
+    socket_resync.connect("tcp://localhost:%s" % (ZMQ_CLUSTERS_PORT + ZMQ_TA_RESYNC_PORT_SHIFT))
     mp_logger.info("TA Processor connected to server with port %s" % ZMQ_CLUSTERS_PORT)
+    candles_state = TaCandlesState(cache=CandleCache())
+    heatmap_store = DepthHeatmapStore()
+    resync_requested = set()
     # Initialize poll set
     poller = zmq.Poller()
     poller.register(socket_pull, zmq.POLLIN)
@@ -96,6 +125,13 @@ def ta_processor_client(config: Config):
             if socket_pull in socks and socks[socket_pull] == zmq.POLLIN:
                 topic = socket_pull.recv_string()
                 frame = socket_pull.recv_pyobj()
+                sent = frame.pop('sent', None)
+                trace = frame.pop('trace', None)
+                if sent is not None:
+                    TA_QUEUE_WAIT.labels(topic).observe(time.time() - sent)
+                    if trace is not None:
+                        TRACER.record("ta_received", trace, start=sent, topic=topic)
+                ZMQ_RECEIVED.labels(topic).inc()
                 symbol = frame['symbol']
                 tf = frame['tf']
                 mp_logger.info(f"Recieved {topic} cmd for {symbol} {tf}")
@@ -104,14 +140,37 @@ def ta_processor_client(config: Config):
 
                 if topic == "clusters":
                     df = store_clusters(**frame)
-                    loop.run_until_complete(db.save_clusters(frame['symbol_tf_id'], frame['timestamp'],
-                                                             frame['step'], df))
-                if topic == "levels":
-                    levels = store_levels(**frame)
-                    timestamp = datetime.utcnow()
-                    for l in levels:
-                        loop.run_until_complete(db.save_levels(frame['symbol_tf_id'], timestamp, l[0], l[1]))
-
+                    with DB_WRITE.labels(op="save_clusters").time():
+                        loop.run_until_complete(db.save_clusters(frame['symbol_tf_id'], frame['timestamp'],
+                                                                 frame['step'], df))
+                    if trace is not None:
+                        TRACER.record("clusters_stored", trace, start=start)
+                if topic == "depth_heatmap":
+                    heatmap_store.append(symbol, frame['timestamp'], frame['heatmap'])
+
+                if topic in ("levels", "levels_seed"):
+                    key_ = (symbol, tf)
+                    if topic == "levels_seed":
+                        candles_state.seed(key_, frame['candles'], frame['seq'])
+                        candles = frame['candles']
+                        resync_requested.discard(key_)
+                    else:
+                        candles = candles_state.append(key_, frame['seq'], frame['candle'])
+                        if candles is None and candles_state.needs_resync(key_) and key_ not in resync_requested:
+                            mp_logger.info(f"Resync {symbol} {tf} requested at seq {frame['seq']}")
+                            socket_resync.send_pyobj(dict(symbol=symbol, tf=tf))
+                            resync_requested.add(key_)
+
+                    if candles is not None:
+                        levels = store_levels(symbol, tf, frame['symbol_tf_id'], candles)
+                        timestamp = datetime.utcnow()
+                        for l in levels:
+                            with DB_WRITE.labels(op="save_levels").time():
+                                loop.run_until_complete(db.save_levels(frame['symbol_tf_id'], timestamp, l[0], l[1]))
+                        if trace is not None:
+                            TRACER.record("levels_stored", trace, start=start)
+
+                TA_JOB.labels(topic).observe(time.time() - start)
                 mp_logger.info(f"{topic} for {symbol} {tf} DONE in {time.time() - start}s")
 
         except Exception as e:
@@ -119,70 +178,264 @@ def ta_processor_client(config: Config):
 
 
 class DataCollector(object, metaclass=Singleton):
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, market_store_name: Optional[str] = None, with_depth: bool = False,
+                 ws_shards: int = 1, ws_shard_processes: bool = False, resample: bool = False,
+                 backfill_gaps: bool = True):
         self.db = TimesScaleDb(**config.get_timescale_db_params())
-        self.api_client = PublicBinance(on_trade_callback=self.on_trade,
-                                        on_candle_callback=self.on_candle_callback,
-                                        data_provider=TimescaleDataProvider(db=self.db))
+        self.config = config
+        self.candle_cache = CandleCache()
+        self.candle_writer = CandleWriteCoalescer(self.db)
+        self.ws_shards_count = ws_shards
+        self.ws_shard_processes = ws_shard_processes
+        self.ws_shards: Optional[ShardPool] = None
+        self.data_provider = CachedDataProvider(TimescaleDataProvider(db=self.db), self.candle_cache)
+        self.gaps = GapBackfiller() if backfill_gaps else None
+        self.resampler = CandleResampler(DATA_COLLECTOR_TFS, self.on_candle_callback,
+                                         backfiller=self.gaps) if resample else None
+        self.feeds = DATA_COLLECTOR_RESAMPLE_FEEDS if resample else DATA_COLLECTOR_FEEDS
+        self.backfilling: Dict[Tuple[SymbolStr, Tf], List[Tuple[List[Any], datetime]]] = {}
         self.symbols: Dict[SymbolStr, Dict[str, Any]] = {}
         self.trades: Dict[SymbolStr, List[Any]] = {}
+        self.market_store_name = market_store_name
+        self.market_store: Optional[MarketDataStore] = None
         context = zmq.Context()
         self.socket = context.socket(zmq.PUSH)
         self.socket.bind("tcp://*:%s" % ZMQ_CLUSTERS_PORT)
+        self.levels_seq: Dict[Tuple[SymbolStr, Tf], int] = {}
+        self.with_depth = with_depth
+        self.order_books: Optional[OrderBookManager] = None
+        REGISTRY.register_collector(self.collect_metrics)
 
     async def init_symbols(self):
         symbol_status = await self.db.get_symbol_status(active=True)
         self.symbols = {r['symbol']: r for r in symbol_status}
         self.trades = {s: [] for s in self.symbols.keys()}
 
+    async def init_ws_shards(self):
+        shards = get_shards_count(self.ws_shards_count, len(self.symbols), len(self.feeds))
+        on_candle = self.resampler.on_base_candle if self.resampler is not None else self.on_candle_callback
+        if self.ws_shard_processes:
+            self.ws_shards = ProcessShardPool(shards, self.feeds, self.on_trade, on_candle, self.config,
+                                              self.candle_cache)
+        else:
+            self.ws_shards = ConnectionShardPool(shards, self.feeds, self.on_trade, on_candle, self.data_provider)
+        await self.ws_shards.async_init()
+
+    async def load_candles_history(self):
+        """
+        Resampled tfs are not subscribed, so their history is loaded into the candle cache here.
+        """
+        for symbol in self.symbols.keys():
+            for tf in DATA_COLLECTOR_TFS:
+                start_time = datetime.utcnow() - timedelta(milliseconds=get_bucket_end(0, tf) * LEVELS_HISTORY_SIZE)
+                await self.data_provider.load_candles(binance_to_symbol(symbol), tf, start_time=start_time)
+
+    def get_candles(self, symbol: SymbolStr, tf: Tf) -> Optional[pd.DataFrame]:
+        candles = self.ws_shards.get_candles(symbol, tf)
+        if candles is None:
+            candles = self.candle_cache.load(symbol, tf)
+        return candles if len(candles) > 0 else None
+
     async def init_ws_subscriptions(self):
         logging.info(f"Initialize  DATA COLLECTOR...")
-        symbols_to_subscribe = [binance_to_symbol(s) for s in self.symbols.keys()]
-        await self.api_client.subscribe(symbols_to_subscribe, DATA_COLLECTOR_FEEDS)
+        await self.ws_shards.start(list(self.symbols.keys()))
+        logging.info(f"Symbols split across {self.ws_shards.shards} ws shards")
+        if self.resampler is not None:  # start() returns once the shards loaded the kline_1m history
+            for symbol in self.symbols.keys():
+                self.resampler.seed(symbol, self.ws_shards.get_candles(symbol, BASE_TF))
+            logging.info(f"Resampling {DATA_COLLECTOR_TFS} from kline_{BASE_TF}")
+
+    def init_market_store(self):
+        tfs = DATA_COLLECTOR_TFS
+        self.market_store = MarketDataStore.create(list(self.symbols.keys()), tfs, name=self.market_store_name)
+        for symbol in self.symbols.keys():
+            for tf in tfs:
+                candles = self.get_candles(symbol, tf)
+                if candles is not None and len(candles) > 0:
+                    self.market_store.seed_candles(symbol, tf, candles)
+        logging.info(f"Market data store {self.market_store_name} created for {len(self.symbols)} symbols")
 
     async def init(self):
         try:
             await self.db.init()
             await self.init_symbols()
-            await self.api_client.async_init()
-            await self.api_client.wait_for_connection()
+            await self.init_ws_shards()
+            if self.resampler is not None:
+                await self.load_candles_history()
             await self.init_ws_subscriptions()
+            if self.market_store_name is not None:  # seeded from the history loaded by the shards
+                self.init_market_store()
+            asyncio.create_task(self.ws_shards.stats_loop())
+            start_loop_monitor("data_collector")
+            asyncio.create_task(self.ta_resync_loop())
+            if self.with_depth:
+                self.order_books = OrderBookManager(list(self.symbols.keys()))
+                self.order_books.start()
+                asyncio.create_task(self.depth_heatmap_loop())
             logging.info("DATA COLLECTOR INITIALIZED")
         except Exception as ex:
             logging.error(add_traceback(ex))
 
     async def on_trade(self, symbol: SymbolStr, price: float, volume: float, is_buyer: bool, timestamp: datetime):
         # logging.info(f"Trade: {timestamp} {symbol}-{price} {volume} {is_buyer}")
+        TRADES.inc()
+        trace = TRACER.new_context(event_time(timestamp))
+        TRACER.record("trade_received", trace)
         self.trades[symbol].append([timestamp, price, volume, is_buyer])
-        await self.db.add_trade(symbol, price, volume, is_buyer, timestamp)
+        if self.market_store is not None and self.market_store.has(symbol):
+            self.market_store.update_price(symbol, price, timestamp)
+        with DB_WRITE_TRADE.time(), TRACER.span("trade_stored", trace):
+            await self.db.add_trade(symbol, price, volume, is_buyer, timestamp)
 
     async def on_candle_callback(self, symbol: SymbolStr, tf: Tf, candle_closed: bool, candle_item: List[Any],
                                  close_time: datetime):
-        if candle_closed:
-            await self.db.save_candles(symbol, tf, candles=candles_to_data_frame([candle_item]))
+        if not candle_closed:
+            if self.market_store is not None and self.market_store.has(symbol, tf):
+                self.market_store.update_candle(symbol, tf, candle_item, candle_closed)
+            return
+
+        key_ = (symbol, tf)
+        if key_ in self.backfilling:  # keep candles in order while the missed ones are fetched
+            self.backfilling[key_].append((candle_item, close_time))
+            return
+
+        gap = self.gaps.check_candle(symbol, tf, candle_item) if self.gaps is not None else None
+        if gap is not None:
+            self.backfilling[key_] = [(candle_item, close_time)]
+            asyncio.create_task(self.backfill_candles(symbol, tf, gap, candle_item, close_time))
+            return
+
+        self.process_closed_candle(symbol, tf, candle_item, close_time)
 
-            if tf == Tf("15m"):
-                self.start_clusters_process(symbol, tf, candle_item, close_time)
+    def process_closed_candle(self, symbol: SymbolStr, tf: Tf, candle_item: List[Any], close_time: datetime):
+        CLOSED_CANDLES.labels(tf).inc()
+        trace = TRACER.new_context(event_time(close_time))
+        TRACER.record("candle_received", trace, tf=tf)
+        if self.market_store is not None and self.market_store.has(symbol, tf):
+            self.market_store.update_candle(symbol, tf, candle_item, True)
 
-            self.start_levels_process(symbol, tf)
+        self.candle_writer.add(symbol, tf, candle_item, trace)
+        self.candle_cache.append_item(symbol, tf, candle_item)
 
-            logging.info(f"Candle: {candle_item[0]} {symbol}_{tf} {candle_closed} done")
+        if tf == Tf("15m"):
+            self.start_clusters_process(symbol, tf, candle_item, close_time, trace)
 
-    def start_clusters_process(self, symbol: SymbolStr, tf: Tf, candle_item: List[Any], close_time: datetime):
+        self.start_levels_process(symbol, tf, candle_item, trace)
+
+        logging.info(f"Candle: {candle_item[0]} {symbol}_{tf} True done")
+
+    async def backfill_candles(self, symbol: SymbolStr, tf: Tf, gap: Tuple[int, int], candle_item: List[Any],
+                               close_time: datetime):
+        key_ = (symbol, tf)
+        try:
+            items = await self.gaps.fetch_candles(symbol, tf, gap[0], gap[1], template=candle_item)
+            close_ms = int(to_timestamp_ms(close_time))
+            for item in items:
+                item_close_ms = get_bucket_end(int(to_timestamp_ms(item[0])), tf) - 1
+                self.process_closed_candle(symbol, tf, item, shift_time(close_time, close_ms, item_close_ms))
+            logging.info(f"Backfilled {len(items)} candles {symbol}_{tf}")
+        except Exception as e:
+            self.gaps.metrics.backfill_errors += 1
+            logging.error(add_traceback(e))
+        finally:
+            for item, item_close_time in self.backfilling.pop(key_, []):
+                self.gaps.check_candle(symbol, tf, item)
+                self.process_closed_candle(symbol, tf, item, item_close_time)
+            self.gaps.log_metrics()
+
+    def start_clusters_process(self, symbol: SymbolStr, tf: Tf, candle_item: List[Any], close_time: datetime,
+                               trace: Optional[TraceContext] = None):
+        trades = [t for t in self.trades[symbol] if candle_item[0] <= t[0] <= close_time]
+        self.trades[symbol] = [t for t in self.trades[symbol] if t[0] > close_time]
+        if self.gaps is not None and self.gaps.check_trades(symbol, candle_item, trades):
+            asyncio.create_task(self.backfill_clusters(symbol, tf, candle_item, close_time, trace))
+            return
+        self.send_clusters(symbol, tf, candle_item, trades, trace)
+
+    def send_clusters(self, symbol: SymbolStr, tf: Tf, candle_item: List[Any], trades: List[Any],
+                      trace: Optional[TraceContext] = None):
         symbol_tf_id = self.db.symbol_tf[(symbol, tf)]
-        trades = [t for t in self.trades[symbol] if t[0] <= close_time]  # <= close_time
-        self.socket.send_string("clusters", zmq.SNDMORE)
-        self.socket.send_pyobj(dict(symbol=symbol, tf=tf, symbol_tf_id=symbol_tf_id, timestamp=candle_item[0],
-                                    h_price=candle_item[2], l_price=candle_item[3], trades=trades,
-                                    step=self.symbols[symbol]["cluster_size"]))
-        self.trades[symbol] = [t for t in self.trades[symbol] if candle_item[0] > t[0]]
-
-    def start_levels_process(self, symbol: SymbolStr, tf: Tf):
+        self.push("clusters", dict(symbol=symbol, tf=tf, symbol_tf_id=symbol_tf_id, timestamp=candle_item[0],
+                                   h_price=candle_item[2], l_price=candle_item[3], trades=trades,
+                                   step=self.symbols[symbol]["cluster_size"]), trace)
+
+    async def backfill_clusters(self, symbol: SymbolStr, tf: Tf, candle_item: List[Any], close_time: datetime,
+                                trace: Optional[TraceContext] = None):
+        open_ms = int(to_timestamp_ms(candle_item[0]))
+        try:
+            trades = await self.gaps.fetch_trades(symbol, candle_item[0], open_ms, get_bucket_end(open_ms, tf))
+            self.send_clusters(symbol, tf, candle_item, trades, trace)
+            logging.info(f"Clusters {symbol}_{tf} @ {candle_item[0]} recomputed from {len(trades)} REST trades")
+        except Exception as e:
+            self.gaps.metrics.backfill_errors += 1
+            logging.error(add_traceback(e))
+
+    def push(self, topic: str, frame: Dict[str, Any], trace: Optional[TraceContext] = None):
+        frame['sent'] = time.time()
+        if trace is not None:
+            frame['trace'] = trace
+        self.socket.send_string(topic, zmq.SNDMORE)
+        self.socket.send_pyobj(frame)
+        ZMQ_SENT.labels(topic).inc()
+
+    def start_levels_process(self, symbol: SymbolStr, tf: Tf, candle_item: List[Any],
+                             trace: Optional[TraceContext] = None):
+        symbol_tf_id = self.db.symbol_tf[(symbol, tf)]
+        seq = self.levels_seq[(symbol, tf)] = self.levels_seq.get((symbol, tf), 0) + 1
+        self.push("levels", dict(symbol=symbol, tf=tf, symbol_tf_id=symbol_tf_id, seq=seq, candle=candle_item), trace)
+
+    def send_levels_seed(self, symbol: SymbolStr, tf: Tf):
         symbol_tf_id = self.db.symbol_tf[(symbol, tf)]
-        symbol_ = binance_to_symbol(symbol)
-        self.socket.send_string("levels", zmq.SNDMORE)
-        self.socket.send_pyobj(dict(symbol=symbol, tf=tf, symbol_tf_id=symbol_tf_id,
-                                    candles=self.api_client.candles[symbol_][tf]))
+        candles = self.get_candles(symbol, tf)
+        if candles is None:
+            logging.warning(f"No candles to seed TA {symbol}_{tf}")
+            return
+        self.push("levels_seed", dict(symbol=symbol, tf=tf, symbol_tf_id=symbol_tf_id,
+                                      seq=self.levels_seq.get((symbol, tf), 0), candles=candles))
+
+    async def ta_resync_loop(self):
+        socket_pull = zmq.asyncio.Context.instance().socket(zmq.PULL)
+        socket_pull.bind("tcp://*:%s" % (ZMQ_CLUSTERS_PORT + ZMQ_TA_RESYNC_PORT_SHIFT))
+        while True:
+            try:
+                request = await socket_pull.recv_pyobj()
+                logging.info(f"TA resync {request['symbol']}_{request['tf']}")
+                self.send_levels_seed(request['symbol'], request['tf'])
+            except Exception as e:
+                logging.error(add_traceback(e))
+
+    def send_depth_heatmaps(self):
+        timestamp = time.time() * 1000
+        cluster_sizes = {s: v["cluster_size"] for s, v in self.symbols.items()}
+        for symbol, heatmap in self.order_books.get_heatmaps(cluster_sizes).items():
+            self.push("depth_heatmap", dict(symbol=symbol, tf=None, timestamp=timestamp,
+                                            step=cluster_sizes[symbol], heatmap=heatmap))
+
+    async def depth_heatmap_loop(self):
+        while True:
+            await asyncio.sleep(DEPTH_HEATMAP_INTERVAL)
+            try:
+                self.send_depth_heatmaps()
+            except Exception as e:
+                logging.error(add_traceback(e))
+
+    def collect_metrics(self):
+        if self.gaps is not None:
+            for name, value in self.gaps.metrics.as_dict().items():
+                yield f"collector_gaps_{name}", "gauge", "Websocket gap detection and REST backfill", (), value
+        if self.ws_shards is not None:
+            for m in self.ws_shards.metrics:
+                labels = (("shard", str(m["shard"])),)
+                for key in ("rate", "lag_avg", "lag_max", "symbols"):
+                    yield f"collector_ws_shard_{key}", "gauge", "Websocket shard stats of the last window", labels, m[key]
+        if self.resampler is not None:
+            yield ("collector_resampler_incomplete", "gauge", "Resampled candles stored without all base candles",
+                   (), self.resampler.incomplete)
+            yield ("collector_resampler_backfilled", "gauge", "Resampled candles rebuilt from REST base candles",
+                   (), self.resampler.backfilled)
+        writer = self.candle_writer
+        for key in ("bursts", "last_burst_size", "max_burst_size", "last_flush_latency"):
+            yield f"collector_candle_writer_{key}", "gauge", "Closed candles write coalescer", (), getattr(writer, key)
 
     async def update_loop(self):
         while True:
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from tc.core.types import SymbolStr, Tf
+from services.collector.binance_rest import BinanceRestClient
+from services.collector.resampler import ADDITIVE_FIELDS, get_bucket_end, fetch_klines
+from services.market_data.candle_cache import to_timestamp_ms
+
+GAP_BACKFILL_CONCURRENCY = 4
+TRADES_VOLUME_TOLERANCE = 0.001  # aggTrades of a candle sum up to the kline volume
+
+
+def shift_time(template: Any, template_ms: int, value_ms: int) -> Any:
+    """
+    Time value_ms of the same type (datetime/pd.Timestamp, tz) as a known template time.
+    """
+    return template + timedelta(milliseconds=value_ms - template_ms)
+
+
+def kline_to_item(kline: List[Any], template: List[Any]) -> List[Any]:
+    """
+    Candle item in the on_candle_callback layout of the live template item, filled from a REST kline.
+    """
+    template_ms = int(to_timestamp_ms(template[0]))
+    item = list(template)
+    item[0] = shift_time(template[0], template_ms, int(kline[0]))
+    item[1:6] = [float(v) for v in kline[1:6]]
+    if len(item) > 6 and isinstance(item[6], datetime):
+        item[6] = shift_time(template[0], template_ms, int(kline[6]))
+    for i in ADDITIVE_FIELDS:
+        if i < len(item):
+            item[i] = float(kline[i])
+    return item
+
+
+class GapMetrics(object):
+    def __init__(self):
+        self.candle_gaps = 0
+        self.missing_candles = 0
+        self.trade_gaps = 0
+        self.backfills = 0
+        self.backfill_errors = 0
+        self.last_backfill_latency = 0.0
+        self.max_backfill_latency = 0.0
+        self.total_backfill_latency = 0.0
+
+    def on_backfill(self, latency: float):
+        self.backfills += 1
+        self.last_backfill_latency = latency
+        self.max_backfill_latency = max(self.max_backfill_latency, latency)
+        self.total_backfill_latency += latency
+
+    def as_dict(self) -> Dict[str, float]:
+        return dict(self.__dict__)
+
+
+class GapBackfiller(object):
+    """
+    Detects missed data after websocket outages and fetches it with bounded concurrent REST calls:
+    - klines: the open time of every closed candle must follow the previous one of the (symbol, tf)
+    - trades: aggTrades received inside a closed candle must add up to the candle volume
+    """
+
+    def __init__(self, client: Optional[BinanceRestClient] = None, concurrency: int = GAP_BACKFILL_CONCURRENCY):
+        self.client = client or BinanceRestClient()
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.last_open: Dict[Tuple[SymbolStr, Tf], int] = {}
+        self.metrics = GapMetrics()
+
+    def check_candle(self, symbol: SymbolStr, tf: Tf, candle_item: List[Any]) -> Optional[Tuple[int, int]]:
+        """
+        :return: [from, to) open time range of the candles missed before this closed candle
+        """
+        open_ms = int(to_timestamp_ms(candle_item[0]))
+        last_open = self.last_open.get((symbol, tf), None)
+        if last_open is not None and open_ms <= last_open:
+            return None
+        self.last_open[(symbol, tf)] = open_ms
+        if last_open is None:
+            return None
+
+        expected = get_bucket_end(last_open, tf)
+        if open_ms <= expected:
+            return None
+        self.metrics.candle_gaps += 1
+        logging.warning(f"Candles gap {symbol}_{tf}: {expected} - {open_ms}")
+        return expected, open_ms
+
+    def check_trades(self, symbol: SymbolStr, candle_item: List[Any], trades: List[Any]) -> bool:
+        """
+        :param trades: [timestamp, price, volume, is_buyer] received within the candle
+        :return: True when trades of the candle were missed
+        """
+        volume = sum(t[2] for t in trades)
+        candle_volume = float(candle_item[5])
+        if volume >= candle_volume * (1 - TRADES_VOLUME_TOLERANCE):
+            return False
+        self.metrics.trade_gaps += 1
+        logging.warning(f"Trades gap {symbol} @ {candle_item[0]}: {volume} of {candle_volume} received")
+        return True
+
+    async def fetch_candles(self, symbol: SymbolStr, tf: Tf, start_ms: int, end_ms: int,
+                            template: List[Any], missing: bool = True) -> List[List[Any]]:
+        """
+        Candles with open time in [start_ms, end_ms), paginated over KLINES_LIMIT for long outages.
+        :param missing: the candles were missed, counted in missing_candles
+        """
+        started = time.time()
+        async with self.semaphore:
+            klines = await fetch_klines(self.client, symbol, tf, start_ms, end_ms)
+        items = [kline_to_item(k, template) for k in klines]
+        if missing:
+            self.metrics.missing_candles += len(items)
+        self.metrics.on_backfill(time.time() - started)
+        return items
+
+    async def fetch_trades(self, symbol: SymbolStr, open_time: Any, start_ms: int, end_ms: int) -> List[List[Any]]:
+        """
+        :param open_time: candle open time (start_ms) of the live type, trade timestamps are built from it
+        :return: [timestamp, price, volume, is_buyer] ordered as the live buffer
+        """
+        started = time.time()
+        trades = []
+        async with self.semaphore:
+            async for page in self.client.iter_agg_trades(symbol, start_ms, end_ms):
+                trades.extend([shift_time(open_time, start_ms, t["T"]), float(t["p"]), float(t["q"]), not t["m"]]
+                              for t in page)
+        self.metrics.on_backfill(time.time() - started)
+        return trades
+
+    def log_metrics(self):
+        m = self.metrics
+        logging.info(f"Gaps: candles {m.candle_gaps} ({m.missing_candles} backfilled), trades {m.trade_gaps}, "
+                     f"backfills {m.backfills} errors {m.backfill_errors}, latency last "
+                     f"{round(m.last_backfill_latency, 3)}s max {round(m.max_backfill_latency, 3)}s")
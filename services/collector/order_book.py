@@ -0,0 +1,367 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+import numpy as np
+
+from tc.core.types import SymbolStr
+from tc.core.utils.logs import add_traceback
+from services.collector.binance_rest import BinanceRestClient
+
+BINANCE_SPOT_WS = os.getenv("BINANCE_SPOT_WS", "wss://stream.binance.com:9443/stream")
+DEPTH_STREAM = "depth@100ms"
+DEPTH_STREAMS_PER_CONNECTION = 200
+DEPTH_SNAPSHOT_LIMIT = 1000
+DEPTH_SNAPSHOT_CONCURRENCY = 4
+DEPTH_HEATMAP_INTERVAL = 60  # s
+DEPTH_HEATMAP_RANGE = 0.05  # +/- part of the mid price aggregated into the heatmap
+DEPTH_HEATMAP_DIR = "./data/depth"
+HEATMAP_ROW_WIDTH = 4  # timestamp(ms), price_from, bid volume, ask volume
+
+
+def to_book_key(symbol: SymbolStr) -> SymbolStr:
+    return symbol.upper()  # the "s" field of the depth events
+
+
+def get_bucket(price, cluster_size: float):
+    return np.floor(price / cluster_size + 1e-9)  # 0.3 / 0.1 must fall into bucket 3
+
+
+class OrderBookSide(object):
+    """
+    Price levels kept as ascending price and quantity lists: bisect lookup, in-place update,
+    insert/delete only when a level appears or disappears.
+    """
+
+    def __init__(self):
+        self.prices: List[float] = []
+        self.quantities: List[float] = []
+
+    def clear(self):
+        self.prices = []
+        self.quantities = []
+
+    def update(self, price: float, quantity: float):
+        prices = self.prices
+        i = bisect_left(prices, price)
+        if i < len(prices) and prices[i] == price:
+            if quantity == 0:
+                del prices[i]
+                del self.quantities[i]
+            else:
+                self.quantities[i] = quantity
+        elif quantity != 0:
+            prices.insert(i, price)
+            self.quantities.insert(i, quantity)
+
+    def load(self, levels: List[Tuple[float, float]]):
+        levels = sorted((p, q) for p, q in levels if q != 0)
+        self.prices = [p for p, _ in levels]
+        self.quantities = [q for _, q in levels]
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    def to_arrays(self, price_from: float, price_to: float) -> Tuple[np.ndarray, np.ndarray]:
+        i_from = bisect_left(self.prices, price_from)
+        i_to = bisect_left(self.prices, price_to)
+        return (np.array(self.prices[i_from:i_to], dtype=np.float64),
+                np.array(self.quantities[i_from:i_to], dtype=np.float64))
+
+
+class OrderBook(object):
+    """
+    Local L2 book synced by the Binance rules: buffer diff events, apply a REST snapshot,
+    drop events with u <= lastUpdateId, then require every event to continue the previous one (U == u + 1).
+    A gap marks the book out of sync until the next snapshot.
+    """
+
+    def __init__(self, symbol: SymbolStr):
+        self.symbol = symbol
+        self.bids = OrderBookSide()
+        self.asks = OrderBookSide()
+        self.last_update_id: Optional[int] = None
+        self.synced = False
+        self.buffer: List[Dict[str, Any]] = []
+        self.updates = 0
+        self.gaps = 0
+        self.event_time = 0
+
+    def reset(self):
+        self.synced = False
+        self.last_update_id = None
+        self.buffer = []
+
+    def apply_snapshot(self, snapshot: Dict[str, Any]):
+        self.bids.load([(float(p), float(q)) for p, q in snapshot["bids"]])
+        self.asks.load([(float(p), float(q)) for p, q in snapshot["asks"]])
+        self.last_update_id = snapshot["lastUpdateId"]
+        self.synced = True
+        buffer, self.buffer = self.buffer, []
+        for event in buffer:
+            if not self.on_diff(event):
+                break
+
+    def apply_levels(self, event: Dict[str, Any]):
+        update_bid = self.bids.update
+        for p, q in event["b"]:
+            update_bid(float(p), float(q))
+        update_ask = self.asks.update
+        for p, q in event["a"]:
+            update_ask(float(p), float(q))
+        self.last_update_id = event["u"]
+        self.event_time = event.get("E", self.event_time)
+        self.updates += 1
+
+    def on_diff(self, event: Dict[str, Any]) -> bool:
+        """
+        :return: False when the book needs a new snapshot
+        """
+        if not self.synced:
+            self.buffer.append(event)
+            return False
+        if event["u"] <= self.last_update_id:
+            return True
+        if event["U"] > self.last_update_id + 1:
+            logging.warning(f"Order book {self.symbol} gap: {self.last_update_id} -> {event['U']}")
+            self.gaps += 1
+            self.reset()
+            self.buffer.append(event)
+            return False
+        self.apply_levels(event)
+        return True
+
+    def best_bid(self) -> Optional[float]:
+        return self.bids.prices[-1] if self.bids.prices else None
+
+    def best_ask(self) -> Optional[float]:
+        return self.asks.prices[0] if self.asks.prices else None
+
+    def mid_price(self) -> Optional[float]:
+        if not self.bids.prices or not self.asks.prices:
+            return None
+        return (self.bids.prices[-1] + self.asks.prices[0]) / 2
+
+    def heatmap(self, cluster_size: float, depth_range: float = DEPTH_HEATMAP_RANGE) -> Optional[np.ndarray]:
+        """
+        Resting liquidity per cluster_size bucket around the mid price.
+        :return: [price_from, bid volume, ask volume] rows, ascending by price
+        """
+        mid_price = self.mid_price()
+        if mid_price is None:
+            return None
+        price_from, price_to = mid_price * (1 - depth_range), mid_price * (1 + depth_range)
+        bid_prices, bid_qty = self.bids.to_arrays(price_from, price_to)
+        ask_prices, ask_qty = self.asks.to_arrays(price_from, price_to)
+
+        first_bucket = get_bucket(price_from, cluster_size)
+        n = int(get_bucket(price_to, cluster_size) - first_bucket) + 1
+        rows = np.zeros((n, 3), dtype=np.float64)
+        rows[:, 0] = (first_bucket + np.arange(n)) * cluster_size
+        np.add.at(rows[:, 1], (get_bucket(bid_prices, cluster_size) - first_bucket).astype(np.int64), bid_qty)
+        np.add.at(rows[:, 2], (get_bucket(ask_prices, cluster_size) - first_bucket).astype(np.int64), ask_qty)
+        return rows[(rows[:, 1] > 0) | (rows[:, 2] > 0)]
+
+
+class DepthHeatmapStore(object):
+    """
+    Depth heatmaps per symbol as append-only float64 files of [timestamp_ms, price_from, bid, ask] rows.
+    """
+
+    def __init__(self, path: str = DEPTH_HEATMAP_DIR):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def file_name(self, symbol: SymbolStr) -> str:
+        return os.path.join(self.path, f"{symbol.upper()}.f8")
+
+    def append(self, symbol: SymbolStr, timestamp_ms: float, rows: np.ndarray):
+        data = np.empty((len(rows), HEATMAP_ROW_WIDTH), dtype=np.float64)
+        data[:, 0] = timestamp_ms
+        data[:, 1:] = rows
+        with open(self.file_name(symbol), "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(data.tobytes())
+
+    def read(self, symbol: SymbolStr) -> np.ndarray:
+        file_name = self.file_name(symbol)
+        if not os.path.exists(file_name):
+            return np.empty((0, HEATMAP_ROW_WIDTH), dtype=np.float64)
+        data = np.fromfile(file_name, dtype=np.float64)
+        return data[:len(data) // HEATMAP_ROW_WIDTH * HEATMAP_ROW_WIDTH].reshape(-1, HEATMAP_ROW_WIDTH)
+
+
+class OrderBookManager(object):
+    """
+    Diff-depth websocket streams for a set of symbols (combined streams, DEPTH_STREAMS_PER_CONNECTION
+    per connection) with one local OrderBook each. Snapshots are loaded through the rate-limited REST client.
+    """
+
+    def __init__(self, symbols: List[SymbolStr], rest_client: Optional[BinanceRestClient] = None,
+                 ws_url: str = BINANCE_SPOT_WS, on_update: Optional[Callable[[OrderBook], None]] = None):
+        self.books: Dict[SymbolStr, OrderBook] = {to_book_key(s): OrderBook(to_book_key(s)) for s in symbols}
+        self.rest_client = rest_client or BinanceRestClient()
+        self.ws_url = ws_url
+        self.on_update = on_update
+        self.snapshot_semaphore = asyncio.Semaphore(DEPTH_SNAPSHOT_CONCURRENCY)
+        self.snapshot_pending: set = set()
+        self.tasks: List[asyncio.Task] = []
+
+    def start(self):
+        symbols = list(self.books.keys())
+        for i in range(0, len(symbols), DEPTH_STREAMS_PER_CONNECTION):
+            self.tasks.append(asyncio.create_task(self.stream_loop(symbols[i:i + DEPTH_STREAMS_PER_CONNECTION])))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await self.rest_client.close()
+
+    async def stream_loop(self, symbols: List[SymbolStr]):
+        streams = "/".join(f"{s.lower()}@{DEPTH_STREAM}" for s in symbols)
+        while True:
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.ws_connect(f"{self.ws_url}?streams={streams}", heartbeat=30) as ws:
+                        logging.info(f"Depth stream connected for {len(symbols)} symbols")
+                        for symbol in symbols:  # updates are lost while disconnected
+                            self.books[symbol].reset()
+                        async for msg in ws:
+                            if msg.type != aiohttp.WSMsgType.TEXT:
+                                break
+                            self.on_message(json.loads(msg.data)["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(add_traceback(e))
+            await asyncio.sleep(1)
+
+    def on_message(self, event: Dict[str, Any]):
+        book = self.books.get(event["s"], None)
+        if book is None:
+            return
+        if book.on_diff(event):
+            if self.on_update is not None:
+                self.on_update(book)
+        elif book.symbol not in self.snapshot_pending:
+            self.snapshot_pending.add(book.symbol)
+            asyncio.create_task(self.load_snapshot(book))
+
+    async def load_snapshot(self, book: OrderBook):
+        try:
+            async with self.snapshot_semaphore:
+                await asyncio.sleep(0.5)  # let the first events arrive before the snapshot is taken
+                snapshot = await self.rest_client.get_depth_snapshot(book.symbol, DEPTH_SNAPSHOT_LIMIT)
+            if book.buffer and snapshot["lastUpdateId"] < book.buffer[0]["U"] - 1:
+                logging.info(f"Order book {book.symbol} snapshot is older than buffered events, retry")
+            else:
+                book.apply_snapshot(snapshot)
+                logging.info(f"Order book {book.symbol} synced @ {book.last_update_id}")
+        except Exception as e:
+            logging.error(add_traceback(e))
+        finally:
+            self.snapshot_pending.discard(book.symbol)
+        if not book.synced:
+            await asyncio.sleep(1)
+            if book.symbol not in self.snapshot_pending:
+                self.snapshot_pending.add(book.symbol)
+                asyncio.create_task(self.load_snapshot(book))
+
+    def get_heatmaps(self, cluster_sizes: Dict[SymbolStr, float]) -> Dict[SymbolStr, np.ndarray]:
+        """
+        :return: heatmaps keyed as cluster_sizes, whatever the case of its symbols
+        """
+        heatmaps = {}
+        for symbol, cluster_size in cluster_sizes.items():
+            book = self.books.get(to_book_key(symbol), None)
+            if book is not None and book.synced and cluster_size:
+                rows = book.heatmap(cluster_size)
+                if rows is not None and len(rows) > 0:
+                    heatmaps[symbol] = rows
+        return heatmaps
+
+
+def generate_depth_events(symbols: int, events: int, levels: int = 20, seed: int = 0) \
+        -> Tuple[Dict[SymbolStr, Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Synthetic snapshots and diff events with a random walk mid price, for the replay benchmark.
+    """
+    rnd = np.random.default_rng(seed)
+    tick = 0.01
+    snapshots, mids, update_ids = {}, {}, {}
+    for n in range(symbols):
+        symbol = f"S{n}USDT"
+        mid = 100.0
+        snapshots[symbol] = dict(lastUpdateId=1000,
+                                 bids=[[f"{mid - tick * i:.2f}", f"{rnd.random() * 10:.3f}"] for i in range(1, 1000)],
+                                 asks=[[f"{mid + tick * i:.2f}", f"{rnd.random() * 10:.3f}"] for i in range(1, 1000)])
+        mids[symbol] = mid
+        update_ids[symbol] = 1000
+
+    result = []
+    names = list(snapshots.keys())
+    for symbol in rnd.choice(names, size=events):
+        mids[symbol] += tick * rnd.integers(-2, 3)
+        mid = mids[symbol]
+        offsets = rnd.integers(1, 300, size=(2, levels))
+        qty = np.where(rnd.random((2, levels)) < 0.3, 0, rnd.random((2, levels)) * 10)
+        first_id = update_ids[symbol] + 1
+        update_ids[symbol] += levels
+        result.append(dict(e="depthUpdate", E=0, s=symbol, U=first_id, u=update_ids[symbol],
+                           b=[[f"{mid - tick * o:.2f}", f"{q:.3f}"] for o, q in zip(offsets[0], qty[0])],
+                           a=[[f"{mid + tick * o:.2f}", f"{q:.3f}"] for o, q in zip(offsets[1], qty[1])]))
+    return snapshots, result
+
+
+def replay_benchmark(snapshots: Dict[SymbolStr, Dict[str, Any]], events: List[Dict[str, Any]],
+                     cluster_size: float = 0.1) -> Dict[str, float]:
+    books = {symbol: OrderBook(symbol) for symbol in snapshots.keys()}
+    for symbol, snapshot in snapshots.items():
+        books[symbol].apply_snapshot(snapshot)
+
+    start = time.perf_counter()
+    for event in events:
+        books[event["s"]].on_diff(event)
+    replay_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for book in books.values():
+        book.heatmap(cluster_size)
+    heatmap_time = time.perf_counter() - start
+
+    level_updates = sum(len(e["b"]) + len(e["a"]) for e in events)
+    return dict(symbols=len(books), events=len(events), events_per_s=len(events) / replay_time,
+                level_updates_per_s=level_updates / replay_time, heatmaps_s=heatmap_time,
+                gaps=sum(b.gaps for b in books.values()))
+
+
+if __name__ == "__main__":
+    import argparse
+    import gzip
+
+    parser = argparse.ArgumentParser(description="Order book replay benchmark")
+    parser.add_argument("--symbols", type=int, default=150)
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--levels", type=int, default=20, help="price levels per side in a diff event")
+    parser.add_argument("--replay", help="recorded combined-stream depth messages, JSON lines (.gz)")
+    parser.add_argument("--snapshots", help="JSON {symbol: snapshot} matching the --replay recording")
+    args = parser.parse_args()
+
+    if args.replay:
+        with (gzip.open if args.replay.endswith(".gz") else open)(args.replay, "rt") as f:
+            events_ = [msg.get("data", msg) for msg in map(json.loads, f)]
+        with open(args.snapshots) as f:
+            snapshots_ = json.load(f)
+    else:
+        snapshots_, events_ = generate_depth_events(args.symbols, args.events, args.levels)
+
+    # 100 symbols at 10 depth events/s each is 1000 events/s for a single core
+    print(json.dumps(replay_benchmark(snapshots_, events_), indent=2))
@@ -0,0 +1,379 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from tc.core.types import SymbolStr, Tf
+from tc.core.utils.logs import add_traceback
+from services.market_data.candle_cache import to_timestamp_ms, data_frame_to_rows, rows_to_data_frame
+
+BASE_TF = Tf("1m")
+TF_UNITS_MS = {"m": 60 * 1000, "h": 60 * 60 * 1000, "d": 24 * 60 * 60 * 1000, "w": 7 * 24 * 60 * 60 * 1000}
+WEEK_OFFSET_MS = 4 * TF_UNITS_MS["d"]  # epoch is Thursday, binance weeks start on Monday
+ADDITIVE_FIELDS = (7, 8, 9, 10)  # binance kline layout: quote volume, trades, taker base/quote volume
+KLINE_EXTRA_COLUMNS = ["q", "n", "taker_v", "taker_q"]  # data frame columns of the ADDITIVE_FIELDS
+
+CandleCallback = Callable[[SymbolStr, Tf, bool, List[Any], datetime], Awaitable[None]]
+
+
+def get_bucket_start(ts_ms: int, tf: Tf) -> int:
+    """
+    UTC aligned open time of the tf candle containing ts_ms, binance alignment.
+    """
+    n, unit = int(tf[:-1]), tf[-1]
+    if unit == "M":
+        dt = datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc)
+        months = (dt.year * 12 + dt.month - 1) // n * n
+        return int(datetime(months // 12, months % 12 + 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+    size = n * TF_UNITS_MS[unit]
+    offset = WEEK_OFFSET_MS if unit == "w" else 0
+    return (ts_ms - offset) // size * size + offset
+
+
+def get_bucket_end(start_ms: int, tf: Tf) -> int:
+    n, unit = int(tf[:-1]), tf[-1]
+    if unit == "M":
+        dt = datetime.fromtimestamp(start_ms / 1000, tz=timezone.utc)
+        months = dt.year * 12 + dt.month - 1 + n
+        return int(datetime(months // 12, months % 12 + 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+    return start_ms + n * TF_UNITS_MS[unit]
+
+
+class ResampledCandle(object):
+    __slots__ = ("start", "end", "first", "last", "count", "o", "h", "l", "c", "v", "extra", "base_item")
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.first: Optional[int] = None  # open time of the first and the last folded base candle
+        self.last: Optional[int] = None
+        self.count = 0
+        self.o = self.h = self.l = self.c = self.v = 0.0
+        self.extra: Dict[int, float] = {}
+        self.base_item: Optional[List[Any]] = None
+
+    def fold(self, ts_ms: int, candle_item: List[Any]):
+        o, h, l, c, v = (float(x) for x in candle_item[1:6])
+        self.count += 1
+        if self.first is None:
+            self.first, self.last = ts_ms, ts_ms
+            self.o, self.h, self.l, self.c, self.v = o, h, l, c, v
+        else:
+            if ts_ms < self.first:  # history folded in front of live candles
+                self.first, self.o = ts_ms, o
+            else:
+                self.last, self.c = ts_ms, c
+            self.h = max(self.h, h)
+            self.l = min(self.l, l)
+            self.v += v
+        for i in ADDITIVE_FIELDS:
+            if i < len(candle_item):
+                self.extra[i] = self.extra.get(i, 0.0) + float(candle_item[i])
+        if ts_ms >= self.last:
+            self.base_item = candle_item
+
+    def with_open(self, ts_ms: int, candle_item: List[Any]) -> "ResampledCandle":
+        candle = ResampledCandle(self.start, self.end)
+        candle.first, candle.last, candle.count = self.first, self.last, self.count
+        candle.o, candle.h, candle.l, candle.c, candle.v = self.o, self.h, self.l, self.c, self.v
+        candle.extra = dict(self.extra)
+        candle.base_item = self.base_item
+        candle.fold(ts_ms, candle_item)
+        return candle
+
+    def is_complete(self, base_ms: int) -> bool:
+        return self.first == self.start and self.count * base_ms == self.end - self.start
+
+    def to_item(self, base_ts: Any, base_ts_ms: int) -> List[Any]:
+        """
+        :param base_ts: open time of a base candle, the result keeps its type (datetime, tz)
+        """
+        item = list(self.base_item)
+        item[0] = base_ts - timedelta(milliseconds=base_ts_ms - self.start)
+        item[1:6] = [self.o, self.h, self.l, self.c, self.v]
+        if len(item) > 6 and isinstance(item[6], datetime):  # close time of the base candle
+            item[6] = base_ts + timedelta(milliseconds=self.end - 1 - base_ts_ms)
+        for i in ADDITIVE_FIELDS:
+            if i < len(item):
+                item[i] = self.extra.get(i, 0.0)
+        return item
+
+
+class CandleResampler(object):
+    """
+    Builds higher tf candles from one base kline stream (kline_1m) and fires them with the
+    on_candle_callback(symbol, tf, candle_closed, candle_item, close_time) contract of PublicBinance.
+    A candle is closed when the base candle that ends its period closes. A period that was not fully covered
+    by base candles (start-up without seed, candles missed over a reconnect) is rebuilt from the base klines
+    fetched by the gap backfiller; without backfiller, or when the fetch fails, it is stored as it is and
+    counted in incomplete.
+    """
+
+    def __init__(self, tfs: List[Tf], on_candle_callback: CandleCallback, base_tf: Tf = BASE_TF,
+                 backfiller: Optional[Any] = None):
+        """
+        :param backfiller: GapBackfiller, fetches the base candles of incomplete periods
+        """
+        self.tfs = tfs
+        self.base_tf = base_tf
+        self.base_ms = get_bucket_end(0, base_tf)
+        self.on_candle_callback = on_candle_callback
+        self.backfiller = backfiller
+        self.candles: Dict[Tuple[SymbolStr, Tf], ResampledCandle] = {}
+        self.tasks: Set[asyncio.Task] = set()
+        self.incomplete = 0  # stored without all their base candles
+        self.backfilled = 0  # rebuilt from fetched base candles
+
+    def seed(self, symbol: SymbolStr, candles: pd.DataFrame):
+        """
+        Fold closed base candles of the current periods, e.g. history loaded after subscribe.
+        Seeded candles have ohlcv only, additive extra fields cover the live part of the period.
+        """
+        if candles is None or len(candles) == 0:
+            return
+        rows = data_frame_to_rows(candles.sort_index())
+        rows = rows[rows[:, 0] + self.base_ms <= time.time() * 1000]  # the last candle can be still open
+        if len(rows) == 0:
+            return
+        last_ms = int(rows[-1, 0])
+        for tf in self.tfs:
+            start = get_bucket_start(last_ms, tf)
+            candle = self.candles.get((symbol, tf), None)
+            if candle is None or candle.start != start:
+                candle = self.candles[(symbol, tf)] = ResampledCandle(start, get_bucket_end(start, tf))
+            live_first = candle.first
+            for row in rows[rows[:, 0] >= start][::-1]:  # newest first, every fold goes in front
+                ts_ms = int(row[0])
+                if live_first is None or ts_ms < live_first:
+                    candle.fold(ts_ms, [None] + row[1:].tolist())
+            if candle.base_item is not None and candle.base_item[0] is None:
+                candle.base_item = None  # only live items are used as the output template
+
+    async def on_base_candle(self, symbol: SymbolStr, tf: Tf, candle_closed: bool, candle_item: List[Any],
+                             close_time: datetime):
+        if tf != self.base_tf:
+            return
+        ts_ms = int(to_timestamp_ms(candle_item[0]))
+        for tf_ in self.tfs:
+            key_ = (symbol, tf_)
+            candle = self.candles.get(key_, None)
+            if candle is not None and ts_ms >= candle.end:  # base candle closing the period was missed
+                del self.candles[key_]
+                await self.close_incomplete(symbol, tf_, candle, candle_item, ts_ms)
+                candle = None
+            if candle is None:
+                start = get_bucket_start(ts_ms, tf_)
+                candle = self.candles[key_] = ResampledCandle(start, get_bucket_end(start, tf_))
+
+            if not candle_closed:
+                current = candle.with_open(ts_ms, candle_item)
+                await self.on_candle_callback(symbol, tf_, False, current.to_item(candle_item[0], ts_ms),
+                                              self.get_close_time(candle_item[0], ts_ms, candle.end))
+                continue
+
+            if candle.last is None or ts_ms > candle.last:
+                candle.fold(ts_ms, candle_item)
+            if ts_ms + self.base_ms >= candle.end:
+                del self.candles[key_]
+                if candle.is_complete(self.base_ms):
+                    await self.emit(symbol, tf_, candle, candle_item, ts_ms)
+                else:
+                    await self.close_incomplete(symbol, tf_, candle, candle_item, ts_ms)
+
+    @staticmethod
+    def get_close_time(base_ts: Any, base_ts_ms: int, end_ms: int) -> Any:
+        return base_ts + timedelta(milliseconds=end_ms - 1 - base_ts_ms)
+
+    async def emit(self, symbol: SymbolStr, tf: Tf, candle: ResampledCandle, base_item: List[Any], base_ts_ms: int):
+        """
+        :param base_item: a live base candle item, the template of the output item and its time type
+        """
+        if candle.base_item is None:  # seeded candles only
+            candle.base_item = base_item
+        await self.on_candle_callback(symbol, tf, True, candle.to_item(base_item[0], base_ts_ms),
+                                      self.get_close_time(base_item[0], base_ts_ms, candle.end))
+
+    async def close_incomplete(self, symbol: SymbolStr, tf: Tf, candle: ResampledCandle, base_item: List[Any],
+                               base_ts_ms: int):
+        logging.warning(f"Resampled candle {symbol}_{tf} @ {candle.start} is incomplete "
+                        f"({candle.count} base candles {candle.first} - {candle.last})")
+        if self.backfiller is None:
+            if candle.count > 0:
+                self.incomplete += 1
+                await self.emit(symbol, tf, candle, base_item, base_ts_ms)
+            return
+        task = asyncio.create_task(self.backfill(symbol, tf, candle, base_item, base_ts_ms))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def backfill(self, symbol: SymbolStr, tf: Tf, candle: ResampledCandle, base_item: List[Any],
+                       base_ts_ms: int):
+        """
+        Rebuilds the period from the base candles of the REST API, the live candle is stored when they don't cover it.
+        """
+        try:
+            items = await self.backfiller.fetch_candles(symbol, self.base_tf, candle.start, candle.end,
+                                                        template=base_item, missing=False)
+            filled = ResampledCandle(candle.start, candle.end)
+            for item in items:
+                filled.fold(int(to_timestamp_ms(item[0])), item)
+            if filled.is_complete(self.base_ms):
+                candle = filled
+        except Exception as e:
+            logging.error(add_traceback(e))
+        if candle.is_complete(self.base_ms):
+            self.backfilled += 1
+            logging.info(f"Resampled candle {symbol}_{tf} @ {candle.start} backfilled")
+        elif candle.count == 0:
+            return
+        else:
+            self.incomplete += 1
+            logging.warning(f"Resampled candle {symbol}_{tf} @ {candle.start} stored incomplete")
+        await self.emit(symbol, tf, candle, base_item, base_ts_ms)
+
+
+def resample_candles(candles: pd.DataFrame, tf: Tf, base_tf: Tf = BASE_TF) -> pd.DataFrame:
+    """
+    Offline resampling of a base candles DataFrame (o, h, l, c, v and the optional KLINE_EXTRA_COLUMNS),
+    full periods only.
+    """
+    candles = candles.sort_index()
+    rows = data_frame_to_rows(candles)
+    extra_columns = [c for c in KLINE_EXTRA_COLUMNS if c in candles.columns]
+    extra = candles[extra_columns].to_numpy(dtype=np.float64)
+    starts = np.array([get_bucket_start(int(ts), tf) for ts in rows[:, 0]], dtype=np.int64)
+    base_ms = get_bucket_end(0, base_tf)
+    result = []
+    for start in np.unique(starts):
+        in_period = starts == start
+        part = rows[in_period]
+        if int(part[0, 0]) != start or len(part) * base_ms != get_bucket_end(int(start), tf) - start:
+            continue
+        result.append([start, part[0, 1], part[:, 2].max(), part[:, 3].min(), part[-1, 4], part[:, 5].sum()] +
+                      extra[in_period].sum(axis=0).tolist())
+    result = np.array(result, dtype=np.float64).reshape(-1, 6 + len(extra_columns))
+    resampled = rows_to_data_frame(result[:, :6])
+    for i, column in enumerate(extra_columns):
+        resampled[column] = result[:, 6 + i]
+    return resampled
+
+
+def compare_candles(resampled: pd.DataFrame, exchange: pd.DataFrame, rtol: float = 1e-9) -> pd.DataFrame:
+    """
+    :return: rows of the common timestamps that differ between resampled and exchange candles,
+        ohlcv and the KLINE_EXTRA_COLUMNS present on both sides are compared
+    """
+    columns = ["o", "h", "l", "c", "v"] + [c for c in KLINE_EXTRA_COLUMNS
+                                           if c in resampled.columns and c in exchange.columns]
+    index = resampled.index.intersection(exchange.index)
+    left = resampled.loc[index, columns].astype(float)
+    right = exchange.loc[index, columns].astype(float)
+    diff = ~np.isclose(left.to_numpy(), right.to_numpy(), rtol=rtol, atol=0)
+    return pd.concat([left[diff.any(axis=1)], right[diff.any(axis=1)]], axis=1, keys=["resampled", "exchange"])
+
+
+def klines_to_data_frame(klines: List[List[Any]]) -> pd.DataFrame:
+    """
+    :param klines: raw REST klines, the additive fields become KLINE_EXTRA_COLUMNS
+    """
+    candles = rows_to_data_frame(np.array([k[:6] for k in klines], dtype=np.float64).reshape(-1, 6))
+    if klines and len(klines[0]) > max(ADDITIVE_FIELDS):
+        extra = np.array([[k[i] for i in ADDITIVE_FIELDS] for k in klines], dtype=np.float64)
+        for i, column in enumerate(KLINE_EXTRA_COLUMNS):
+            candles[column] = extra[:, i]
+    return candles
+
+
+def kline_to_base_item(kline: List[Any]) -> List[Any]:
+    """
+    REST kline as a closed kline_1m on_candle_callback item: [open time, o, h, l, c, v, close time, additive fields]
+    """
+    item = [pd.Timestamp(int(kline[0]), unit="ms").to_pydatetime()] + [float(v) for v in kline[1:6]]
+    item.append(pd.Timestamp(int(kline[6]), unit="ms").to_pydatetime())
+    return item + [float(kline[i]) for i in ADDITIVE_FIELDS]
+
+
+async def fetch_klines(client: Any, symbol: str, tf: Tf, start_ms: int, end_ms: int) -> List[List[Any]]:
+    """
+    Raw REST klines with open time in [start_ms, end_ms), paginated by KLINES_LIMIT.
+    """
+    from services.collector.binance_rest import KLINES_LIMIT
+
+    klines = []
+    while start_ms < end_ms:
+        page = await client.get_klines(symbol, tf, start_time=start_ms, end_time=end_ms - 1)
+        page = [k for k in page if start_ms <= k[0] < end_ms]
+        if not page:
+            break
+        klines.extend(page)
+        start_ms = get_bucket_end(int(page[-1][0]), tf)
+        if len(page) < KLINES_LIMIT:
+            break
+    return klines
+
+
+async def record_klines(symbol: str, tfs: List[Tf], periods: int = 1) -> Dict[str, Any]:
+    """
+    Exchange klines of the last `periods` closed candles of the largest tf, with the BASE_TF klines they cover:
+    a bar-for-bar fixture of the resampler tests (tests/fixtures).
+    """
+    from services.collector.binance_rest import BinanceRestClient
+
+    largest = max(tfs, key=lambda tf_: get_bucket_end(0, tf_))
+    end_ms = get_bucket_start(int(time.time() * 1000), largest)
+    start_ms = end_ms
+    for _ in range(periods):
+        start_ms = get_bucket_start(start_ms - 1, largest)
+    client = BinanceRestClient()
+    try:
+        klines = {tf_: await fetch_klines(client, symbol, tf_, start_ms, end_ms) for tf_ in [BASE_TF] + tfs}
+    finally:
+        await client.close()
+    return dict(symbol=symbol, source="binance", klines=klines)
+
+
+async def verify_with_exchange(symbol: str, tf: Tf, periods: int = 100) -> pd.DataFrame:
+    """
+    Resample REST kline_1m history and compare it bar-for-bar with the exchange tf klines.
+    """
+    from services.collector.binance_rest import BinanceRestClient
+
+    client = BinanceRestClient()
+    try:
+        end_ms = get_bucket_start(int(time.time() * 1000), tf)
+        start_ms = end_ms - periods * get_bucket_end(0, tf) if tf[-1] != "M" else end_ms - periods * 31 * 86400000
+        base = await fetch_klines(client, symbol, BASE_TF, start_ms, end_ms)
+        exchange = await fetch_klines(client, symbol, tf, int(base[0][0]), end_ms)
+    finally:
+        await client.close()
+
+    resampled = resample_candles(klines_to_data_frame(base), tf)
+    diff = compare_candles(resampled, klines_to_data_frame(exchange))
+    logging.info(f"{symbol}_{tf}: {len(resampled)} resampled candles, {len(diff)} differ from exchange klines")
+    return diff
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+    import json
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Compare resampled kline_1m candles with exchange klines, "
+                                                 "or record them as a test fixture")
+    parser.add_argument("symbol")
+    parser.add_argument("tfs", nargs="+")
+    parser.add_argument("--periods", type=int, default=100)
+    parser.add_argument("--record", help="fixture file, e.g. tests/fixtures/klines_btcusdt.json")
+    args = parser.parse_args()
+    if args.record:
+        fixture = asyncio.run(record_klines(args.symbol, [Tf(tf_) for tf_ in args.tfs], args.periods))
+        with open(args.record, "w") as f:
+            json.dump(fixture, f)
+    else:
+        for tf_ in args.tfs:
+            print(asyncio.run(verify_with_exchange(args.symbol, Tf(tf_), args.periods)))
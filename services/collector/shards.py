@@ -0,0 +1,439 @@
+import asyncio
+import logging
+import math
+import pickle
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from multiprocessing import Process
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+import zmq
+import zmq.asyncio
+
+from tc.config import ZMQ_CLUSTERS_PORT, Config
+from tc.core.base import CoreBase
+from tc.core.db.timescaledb import TimesScaleDb
+from tc.core.exchange.binance import PublicBinance
+from tc.core.exchange.common.mappers import binance_to_symbol
+from tc.core.providers import TimescaleDataProvider
+from tc.core.types import SymbolStr, Tf
+from tc.core.utils.logs import add_traceback
+from services.market_data import CandleCache, CachedDataProvider
+
+ZMQ_SHARD_EVENTS_PORT_SHIFT = 2  # shard processes push events to ZMQ_CLUSTERS_PORT + shift
+ZMQ_SHARD_CONTROL_PORT_SHIFT = 3  # and receive (un)subscribe commands from ZMQ_CLUSTERS_PORT + shift
+MAX_STREAMS_PER_CONNECTION = 1024
+SHARD_STATS_INTERVAL = 60  # s
+SYMBOL_RATE_SMOOTHING = 0.3  # EWMA weight of the last stats window
+REBALANCE_IMBALANCE = 1.3  # rebalance when the busiest shard gets more than x mean shard rate
+
+SHARD_SUBSCRIBE_TIMEOUT = 30  # s
+SHARD_HANDOFF_TIMEOUT = 30  # s the old shard stays the owner of a moved symbol, waiting for the new shard events
+SHARD_READY_TIMEOUT = 600  # s a shard process may take to load the history of its symbols
+TRADE_EVENT = "trade"
+CANDLE_EVENT = "candle"
+SUBSCRIBED_EVENT = "subscribed"
+READY_EVENT = "ready"
+
+
+def to_epoch(timestamp: datetime) -> float:
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+def get_shards_count(shards: int, symbols: int, feeds: int) -> int:
+    return max(shards, math.ceil(symbols * feeds / MAX_STREAMS_PER_CONNECTION), 1)
+
+
+def assign_symbols(rates: Dict[SymbolStr, float], shards: int) -> List[List[SymbolStr]]:
+    """
+    Greedy balancing by message rate: the busiest symbol goes to the least loaded shard.
+    """
+    loads = [0.0] * shards
+    assignment: List[List[SymbolStr]] = [[] for _ in range(shards)]
+    for symbol in sorted(rates.keys(), key=lambda s: -rates[s]):
+        i = min(range(shards), key=lambda i_: (loads[i_], len(assignment[i_])))
+        assignment[i].append(symbol)
+        loads[i] += rates[symbol]
+    return assignment
+
+
+def plan_rebalance(assignment: List[List[SymbolStr]], rates: Dict[SymbolStr, float],
+                   imbalance: float = REBALANCE_IMBALANCE) -> List[Tuple[SymbolStr, int, int]]:
+    """
+    :return: (symbol, from shard, to shard) moves, each one reduces the busiest shard load
+    """
+    shards = [list(symbols) for symbols in assignment]
+    loads = [sum(rates.get(s, 0) for s in symbols) for symbols in shards]
+    mean_load = sum(loads) / len(loads) if loads else 0
+    moves = []
+    while mean_load > 0:
+        i_max = max(range(len(loads)), key=lambda i_: loads[i_])
+        i_min = min(range(len(loads)), key=lambda i_: loads[i_])
+        diff = loads[i_max] - loads[i_min]
+        if loads[i_max] <= mean_load * imbalance or i_max == i_min:
+            break
+        candidates = [s for s in shards[i_max] if 0 < rates.get(s, 0) < diff]
+        if not candidates:
+            break
+        symbol = min(candidates, key=lambda s: abs(rates[s] - diff / 2))
+        shards[i_max].remove(symbol)
+        shards[i_min].append(symbol)
+        loads[i_max] -= rates[symbol]
+        loads[i_min] += rates[symbol]
+        moves.append((symbol, i_max, i_min))
+    return moves
+
+
+def get_shard_topic(shard: int) -> bytes:
+    return f"shard_{shard}:".encode()  # the delimiter keeps shard 1 from receiving shard 10 commands
+
+
+def get_streams(symbol: SymbolStr, feeds: List[str]) -> List[str]:
+    return [f"{symbol.lower()}@{feed}" for feed in feeds]
+
+
+class ShardStats(object):
+    """
+    Message counters and trade lag (exchange trade time -> callback) of one shard for the current window.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.symbol_messages: Dict[SymbolStr, int] = {}
+        self.lag_sum = 0.0
+        self.lag_count = 0
+        self.lag_max = 0.0
+        self.window_start = time.time()
+
+    def on_message(self, symbol: SymbolStr, timestamp: Optional[datetime] = None):
+        self.messages += 1
+        self.symbol_messages[symbol] = self.symbol_messages.get(symbol, 0) + 1
+        if timestamp is not None:
+            lag = time.time() - to_epoch(timestamp)
+            self.lag_sum += lag
+            self.lag_count += 1
+            self.lag_max = max(self.lag_max, lag)
+
+    def collect(self) -> Tuple[Dict[str, float], Dict[SymbolStr, float]]:
+        """
+        :return: shard metrics and per-symbol message rates of the window, counters are reset
+        """
+        elapsed = max(time.time() - self.window_start, 1e-6)
+        metrics = dict(rate=self.messages / elapsed, messages=self.messages,
+                       lag_avg=self.lag_sum / self.lag_count if self.lag_count else 0.0, lag_max=self.lag_max)
+        symbol_rates = {s: n / elapsed for s, n in self.symbol_messages.items()}
+        self.__init__()
+        return metrics, symbol_rates
+
+
+class ShardPool(ABC):
+    """
+    Splits collector symbols across websocket connections, balanced by the observed message rate.
+    Subclasses own the connections; callbacks keep the PublicBinance contract.
+    """
+
+    def __init__(self, shards: int, feeds: List[str], on_trade: Callable, on_candle: Callable):
+        self.shards = shards
+        self.feeds = feeds
+        self.on_trade = on_trade
+        self.on_candle = on_candle
+        self.assignment: List[List[SymbolStr]] = [[] for _ in range(shards)]
+        self.stats = [ShardStats() for _ in range(shards)]
+        self.symbol_rates: Dict[SymbolStr, float] = {}
+        self.metrics: List[Dict[str, float]] = []
+        self.owner: Dict[SymbolStr, int] = {}  # only the owner shard events are passed while a symbol moves
+        self.handoffs: Dict[SymbolStr, Tuple[int, asyncio.Future]] = {}  # moving symbol -> (new shard, first event)
+        self.dropped = 0
+
+    def shard_of(self, symbol: SymbolStr) -> int:
+        return self.owner[symbol]
+
+    def plan(self, symbols: List[SymbolStr]):
+        self.symbol_rates = {s: self.symbol_rates.get(s, 1.0) for s in symbols}
+        self.assignment = assign_symbols(self.symbol_rates, self.shards)
+        self.owner = {s: i for i, shard_symbols in enumerate(self.assignment) for s in shard_symbols}
+
+    def is_owner(self, shard: int, symbol: SymbolStr) -> bool:
+        """
+        The first event of a moving symbol from its new shard hands the symbol over, from that event on.
+        """
+        handoff = self.handoffs.get(symbol, None)
+        if handoff is not None and handoff[0] == shard:
+            self.owner[symbol] = shard
+            if not handoff[1].done():
+                handoff[1].set_result(True)
+        if self.owner.get(symbol, shard) != shard:
+            self.dropped += 1
+            return False
+        return True
+
+    async def handle_trade(self, shard: int, symbol: SymbolStr, price: float, volume: float, is_buyer: bool,
+                           timestamp: datetime):
+        if not self.is_owner(shard, symbol):
+            return
+        self.stats[shard].on_message(symbol, timestamp)
+        await self.on_trade(symbol, price, volume, is_buyer, timestamp)
+
+    async def handle_candle(self, shard: int, symbol: SymbolStr, tf: Tf, candle_closed: bool,
+                            candle_item: List[Any], close_time: datetime):
+        if not self.is_owner(shard, symbol):
+            return
+        self.stats[shard].on_message(symbol)
+        await self.on_candle(symbol, tf, candle_closed, candle_item, close_time)
+
+    def collect_stats(self) -> List[Dict[str, float]]:
+        self.metrics = []
+        for i, stats in enumerate(self.stats):
+            metrics, rates = stats.collect()
+            for symbol, rate in rates.items():
+                prev = self.symbol_rates.get(symbol, rate)
+                self.symbol_rates[symbol] = prev + SYMBOL_RATE_SMOOTHING * (rate - prev)
+            for symbol in self.assignment[i]:
+                if symbol not in rates:  # no messages in the window
+                    self.symbol_rates[symbol] *= 1 - SYMBOL_RATE_SMOOTHING
+            metrics.update(shard=i, symbols=len(self.assignment[i]))
+            self.metrics.append(metrics)
+        return self.metrics
+
+    async def move(self, symbol: SymbolStr, shard_from: int, shard_to: int,
+                   timeout: float = SHARD_HANDOFF_TIMEOUT):
+        """
+        The old shard passes the symbol events until the new one delivers its first (or the timeout passes),
+        only then it is unsubscribed, so no trade or kline update falls between the two subscriptions.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.handoffs[symbol] = (shard_to, future)
+        try:
+            await self.subscribe(shard_to, symbol)
+            try:
+                await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"Shard rebalance: no {symbol} events from shard {shard_to} in {timeout}s, moved")
+        finally:
+            del self.handoffs[symbol]
+        self.owner[symbol] = shard_to
+        await self.unsubscribe(shard_from, symbol)
+        self.assignment[shard_from].remove(symbol)
+        self.assignment[shard_to].append(symbol)
+        logging.info(f"Shard rebalance: {symbol} {shard_from} -> {shard_to}")
+
+    async def rebalance(self, imbalance: float = REBALANCE_IMBALANCE) -> List[Tuple[SymbolStr, int, int]]:
+        moves = plan_rebalance(self.assignment, self.symbol_rates, imbalance)
+        for symbol, shard_from, shard_to in moves:
+            await self.move(symbol, shard_from, shard_to)
+        return moves
+
+    async def stats_loop(self, interval: int = SHARD_STATS_INTERVAL, auto_rebalance: bool = True):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                for m in self.collect_stats():
+                    logging.info(f"WS shard {m['shard']}: {m['symbols']} symbols {round(m['rate'], 1)} msg/s "
+                                 f"lag avg {round(m['lag_avg'], 3)}s max {round(m['lag_max'], 3)}s")
+                if auto_rebalance:
+                    await self.rebalance()
+            except Exception as e:
+                logging.error(add_traceback(e))
+
+    @abstractmethod
+    async def async_init(self):
+        pass
+
+    @abstractmethod
+    async def start(self, symbols: List[SymbolStr]):
+        """
+        Subscribes the symbols, returns once their candle history is loaded.
+        """
+
+    @abstractmethod
+    async def subscribe(self, shard: int, symbol: SymbolStr):
+        pass
+
+    @abstractmethod
+    async def unsubscribe(self, shard: int, symbol: SymbolStr):
+        pass
+
+    @abstractmethod
+    def get_candles(self, symbol: SymbolStr, tf: Tf) -> Optional[pd.DataFrame]:
+        pass
+
+
+class ConnectionShardPool(ShardPool):
+    """
+    K PublicBinance connections in the collector process.
+    """
+
+    def __init__(self, shards: int, feeds: List[str], on_trade: Callable, on_candle: Callable, data_provider: Any):
+        super().__init__(shards, feeds, on_trade, on_candle)
+        self.clients = [self.create_client(i, data_provider) for i in range(shards)]
+
+    def create_client(self, shard: int, data_provider: Any) -> PublicBinance:
+        async def on_trade(*args):
+            await self.handle_trade(shard, *args)
+
+        async def on_candle(*args):
+            await self.handle_candle(shard, *args)
+
+        return PublicBinance(on_trade_callback=on_trade, on_candle_callback=on_candle, data_provider=data_provider)
+
+    async def async_init(self):
+        for client in self.clients:
+            await client.async_init()
+
+    async def start(self, symbols: List[SymbolStr]):
+        self.plan(symbols)
+        for client, shard_symbols in zip(self.clients, self.assignment):
+            if not shard_symbols:
+                continue
+            await client.wait_for_connection()
+            await client.subscribe([binance_to_symbol(s) for s in shard_symbols], self.feeds)
+
+    async def subscribe(self, shard: int, symbol: SymbolStr):
+        await self.clients[shard].wait_for_connection()
+        await self.clients[shard].subscribe([binance_to_symbol(symbol)], self.feeds)
+
+    async def unsubscribe(self, shard: int, symbol: SymbolStr):
+        await self.clients[shard].send_message(global_feeds=get_streams(symbol, self.feeds), method="UNSUBSCRIBE")
+
+    def get_candles(self, symbol: SymbolStr, tf: Tf) -> Optional[pd.DataFrame]:
+        for i in (self.shard_of(symbol), *range(self.shards)):  # a moved symbol keeps history in the old shard
+            candles = self.clients[i].candles.get(binance_to_symbol(symbol), {}).get(tf, None)
+            if candles is not None:
+                return candles
+        return None
+
+
+def shard_process_client(config: Config, shard: int, symbols: List[SymbolStr], feeds: List[str]):
+    """
+    Shard worker process: parses the websocket stream and pushes trade/candle events to the collector.
+    """
+    db = TimesScaleDb(**config.get_timescale_db_params(), use_pool=False)
+    context = zmq.asyncio.Context.instance()
+    socket_push = context.socket(zmq.PUSH)
+    socket_push.connect("tcp://localhost:%s" % (ZMQ_CLUSTERS_PORT + ZMQ_SHARD_EVENTS_PORT_SHIFT))
+    socket_control = context.socket(zmq.SUB)
+    socket_control.setsockopt(zmq.SUBSCRIBE, get_shard_topic(shard))
+    socket_control.connect("tcp://localhost:%s" % (ZMQ_CLUSTERS_PORT + ZMQ_SHARD_CONTROL_PORT_SHIFT))
+
+    async def on_trade(*args):
+        await socket_push.send(pickle.dumps((TRADE_EVENT, shard, args), protocol=-1))
+
+    async def on_candle(*args):
+        await socket_push.send(pickle.dumps((CANDLE_EVENT, shard, args), protocol=-1))
+
+    api_client = PublicBinance(on_trade_callback=on_trade, on_candle_callback=on_candle,
+                               data_provider=CachedDataProvider(TimescaleDataProvider(db=db), CandleCache()))
+
+    async def main():
+        await db.init(simple=True)
+        await api_client.async_init()
+        await api_client.wait_for_connection()
+        await api_client.subscribe([binance_to_symbol(s) for s in symbols], feeds)
+        await socket_push.send(pickle.dumps((READY_EVENT, shard, ()), protocol=-1))  # history is in the CandleCache
+        logging.info(f"WS shard {shard} subscribed to {len(symbols)} symbols")
+        while True:
+            try:
+                _, data = await socket_control.recv_multipart()
+                command = pickle.loads(data)
+                if command["cmd"] == "subscribe":
+                    await api_client.subscribe([binance_to_symbol(command["symbol"])], feeds)
+                    await socket_push.send(pickle.dumps((SUBSCRIBED_EVENT, shard, (command["symbol"],)), protocol=-1))
+                else:
+                    await api_client.send_message(global_feeds=get_streams(command["symbol"], feeds),
+                                                  method="UNSUBSCRIBE")
+            except Exception as e:
+                logging.error(add_traceback(e))
+
+    CoreBase.get_loop().run_until_complete(main())
+
+
+class ProcessShardPool(ShardPool):
+    """
+    K shard worker processes: JSON parsing moves out of the collector event loop, events arrive over ZMQ.
+    Candle history lives in the workers, so the collector reads it from the shared CandleCache.
+    """
+
+    def __init__(self, shards: int, feeds: List[str], on_trade: Callable, on_candle: Callable, config: Config,
+                 candle_cache: CandleCache):
+        super().__init__(shards, feeds, on_trade, on_candle)
+        self.config = config
+        self.candle_cache = candle_cache
+        self.processes = []
+        self.subscribed: Dict[Tuple[int, SymbolStr], asyncio.Future] = {}
+        self.ready: Dict[int, asyncio.Future] = {}
+        self.events_task: Optional[asyncio.Task] = None
+        context = zmq.asyncio.Context.instance()
+        self.socket_events = context.socket(zmq.PULL)
+        self.socket_events.bind("tcp://*:%s" % (ZMQ_CLUSTERS_PORT + ZMQ_SHARD_EVENTS_PORT_SHIFT))
+        self.socket_control = context.socket(zmq.PUB)
+        self.socket_control.bind("tcp://*:%s" % (ZMQ_CLUSTERS_PORT + ZMQ_SHARD_CONTROL_PORT_SHIFT))
+
+    async def async_init(self):
+        pass
+
+    async def start(self, symbols: List[SymbolStr]):
+        """
+        Returns once every shard process loaded the history of its symbols into the CandleCache and subscribed.
+        """
+        self.plan(symbols)
+        loop = asyncio.get_running_loop()
+        self.ready = {i: loop.create_future() for i in range(self.shards)}
+        self.events_task = asyncio.create_task(self.events_loop())
+        for i, shard_symbols in enumerate(self.assignment):
+            process = Process(target=shard_process_client, args=(self.config, i, shard_symbols, self.feeds),
+                              daemon=True)
+            process.start()
+            self.processes.append(process)
+        try:
+            await asyncio.wait_for(asyncio.gather(*self.ready.values()), SHARD_READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            waiting = [i for i, future in self.ready.items() if not future.done()]
+            logging.warning(f"WS shards {waiting} not ready after {SHARD_READY_TIMEOUT}s, their history is partial")
+
+    async def events_loop(self):
+        while True:
+            try:
+                event, shard, args = pickle.loads(await self.socket_events.recv())
+                if event == TRADE_EVENT:
+                    await self.handle_trade(shard, *args)
+                elif event == CANDLE_EVENT:
+                    await self.handle_candle(shard, *args)
+                elif event == READY_EVENT:
+                    future = self.ready.get(shard, None)
+                    if future is not None and not future.done():
+                        future.set_result(True)
+                else:
+                    future = self.subscribed.pop((shard, args[0]), None)
+                    if future is not None and not future.done():
+                        future.set_result(True)
+            except Exception as e:
+                logging.error(add_traceback(e))
+
+    async def send_command(self, shard: int, cmd: str, symbol: SymbolStr):
+        await self.socket_control.send_multipart([get_shard_topic(shard),
+                                                  pickle.dumps(dict(cmd=cmd, symbol=symbol), protocol=-1)])
+
+    async def subscribe(self, shard: int, symbol: SymbolStr):
+        future = self.subscribed[(shard, symbol)] = asyncio.get_running_loop().create_future()
+        await self.send_command(shard, "subscribe", symbol)
+        try:
+            await asyncio.wait_for(future, SHARD_SUBSCRIBE_TIMEOUT)
+        finally:
+            self.subscribed.pop((shard, symbol), None)
+
+    async def unsubscribe(self, shard: int, symbol: SymbolStr):
+        await self.send_command(shard, "unsubscribe", symbol)
+
+    def get_candles(self, symbol: SymbolStr, tf: Tf) -> Optional[pd.DataFrame]:
+        candles = self.candle_cache.load(symbol, tf)
+        return candles if len(candles) > 0 else None
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+            process.join()
+        self.processes = []
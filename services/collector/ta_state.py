@@ -0,0 +1,68 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from tc.core.types import SymbolStr, Tf
+from tc.core.utils.data import candles_to_data_frame
+from services.market_data import CandleCache
+
+ZMQ_TA_RESYNC_PORT_SHIFT = 1  # resync requests go to ZMQ_CLUSTERS_PORT + shift
+LEVELS_HISTORY_SIZE = 1000
+
+SymbolTfKey = Tuple[SymbolStr, Tf]
+
+
+class TaCandlesState(object):
+    """
+    Candle history kept by a TA worker per (symbol, tf). The collector sends only the closed candle
+    with a per-(symbol, tf) sequence number; a missing history or a sequence gap requires a resync.
+    """
+
+    def __init__(self, cache: Optional[CandleCache] = None, size: int = LEVELS_HISTORY_SIZE):
+        self.cache = cache
+        self.size = size
+        self.candles: Dict[SymbolTfKey, pd.DataFrame] = {}
+        self.seqs: Dict[SymbolTfKey, int] = {}
+        self.resyncs = 0
+
+    def seed(self, key: SymbolTfKey, candles: pd.DataFrame, seq: int):
+        self.candles[key] = candles.iloc[-self.size:].copy()
+        self.seqs[key] = seq
+
+    def seed_from_cache(self, key: SymbolTfKey, candle: pd.DataFrame, seq: int) -> bool:
+        if self.cache is None:
+            return False
+        cached = self.cache.load(*key)
+        cached = cached[cached.index < candle.index[0]]
+        if len(cached) == 0:
+            return False
+        self.seed(key, pd.concat([cached, candle[cached.columns]]), seq)
+        return True
+
+    def needs_resync(self, key: SymbolTfKey) -> bool:
+        return key not in self.seqs
+
+    def append(self, key: SymbolTfKey, seq: int, candle_item: List[Any]) -> Optional[pd.DataFrame]:
+        """
+        :return: updated history, None for duplicates or when resync from the collector is required
+        """
+        candle = candles_to_data_frame([candle_item])
+        last_seq = self.seqs.get(key, None)
+        if last_seq is None:
+            if self.seed_from_cache(key, candle, seq):
+                return self.candles[key]
+        elif seq == last_seq + 1:
+            history = self.candles[key]
+            candle = candle[history.columns]
+            if len(history) > 0 and candle.index[0] <= history.index[-1]:
+                history = history[history.index < candle.index[0]]
+            self.candles[key] = pd.concat([history, candle]).iloc[-self.size:]
+            self.seqs[key] = seq
+            return self.candles[key]
+        elif seq <= last_seq:  # duplicate
+            return None
+
+        self.candles.pop(key, None)
+        self.seqs.pop(key, None)
+        self.resyncs += 1
+        return None
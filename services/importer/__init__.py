@@ -0,0 +1,2 @@
+from .sources import RestSource, ArchiveSource
+from .candles_importer import CandlesImporter, ImportCheckpoints
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Union
+
+from tc.core.db.timescaledb import TimesScaleDb
+from tc.core.types import SymbolStr, Tf
+from tc.core.utils.data import candles_to_data_frame
+from tc.core.utils.logs import add_traceback
+from services.collector.resampler import get_bucket_end
+from services.market_data.candle_cache import to_timestamp_ms
+from services.importer.sources import ArchiveSource, RestSource, CandleRow, TradeRow, prefetched
+
+IMPORT_CHECKPOINTS_DIR = "./data/import_checkpoints"
+IMPORT_CONCURRENCY = 4
+# the table of TimesScaleDb.add_trade, its columns are checked against the catalog before the first COPY
+TRADES_TABLE = "trades"
+TRADES_COLUMNS = ("symbol", "timestamp", "price", "volume", "is_buyer")
+
+
+def from_ms(value: int) -> datetime:
+    return datetime.utcfromtimestamp(value / 1000)
+
+
+class ImportCheckpoints(object):
+    """
+    One JSON file per (kind, symbol, tf) with the last imported position, rewritten atomically after every page.
+    """
+
+    def __init__(self, path: str = IMPORT_CHECKPOINTS_DIR):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def file_name(self, kind: str, symbol: SymbolStr, tf: Optional[Tf] = None) -> str:
+        return os.path.join(self.path, f"{kind}_{symbol.upper()}{'_' + tf if tf else ''}.json")
+
+    def get(self, kind: str, symbol: SymbolStr, tf: Optional[Tf] = None) -> Optional[Dict[str, Any]]:
+        file_name = self.file_name(kind, symbol, tf)
+        if not os.path.exists(file_name):
+            return None
+        with open(file_name) as f:
+            return json.load(f)
+
+    def set(self, kind: str, symbol: SymbolStr, tf: Optional[Tf], value: Dict[str, Any]):
+        fd, tmp_name = tempfile.mkstemp(dir=self.path, prefix=".checkpoint-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp_name, self.file_name(kind, symbol, tf))
+
+
+class CandlesImporter(object):
+    """
+    Backfills candles (and optionally aggTrades) for many (symbol, tf) at once: jobs run concurrently,
+    pages of one job are downloaded one ahead of the write of the previous page.
+    Candle pages are written by TimesScaleDb.save_candles, as the collector writes them. Trades have no unique key,
+    so every COPY ends on a whole millisecond and a rerun resumes strictly after the last committed trade timestamp.
+    """
+
+    def __init__(self, db: TimesScaleDb, source: Union[RestSource, ArchiveSource],
+                 checkpoints: Optional[ImportCheckpoints] = None, concurrency: int = IMPORT_CONCURRENCY):
+        self.db = db
+        self.source = source
+        self.checkpoints = checkpoints or ImportCheckpoints()
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.rows = 0
+        self.pages = 0
+        self.failed: List[str] = []
+        self.trades_schema_checked = False
+
+    async def check_trades_schema(self):
+        if self.trades_schema_checked:
+            return
+        async with self.db.pool.acquire() as conn:
+            rows = await conn.fetch("SELECT column_name FROM information_schema.columns WHERE table_name = $1",
+                                    TRADES_TABLE)
+        missing = set(TRADES_COLUMNS) - {r["column_name"] for r in rows}
+        if missing:
+            raise RuntimeError(f"Table {TRADES_TABLE} has no columns {sorted(missing)}, "
+                               f"check it against TimesScaleDb.add_trade")
+        self.trades_schema_checked = True
+
+    async def get_last_trade_ms(self, symbol: SymbolStr, start_ms: int, end_ms: int) -> Optional[int]:
+        async with self.db.pool.acquire() as conn:
+            last_time = await conn.fetchval(f"SELECT max(timestamp) FROM {TRADES_TABLE} "
+                                            f"WHERE symbol = $1 AND timestamp >= $2 AND timestamp < $3",
+                                            symbol, from_ms(start_ms), from_ms(end_ms))
+        return int(to_timestamp_ms(last_time)) if last_time is not None else None
+
+    async def copy_trades(self, symbol: SymbolStr, rows: List[TradeRow]):
+        async with self.db.pool.acquire() as conn:
+            await conn.copy_records_to_table(TRADES_TABLE, columns=list(TRADES_COLUMNS),
+                                             records=[(symbol, from_ms(r[1]), r[2], r[3], r[4]) for r in rows])
+        self.rows += len(rows)
+        self.pages += 1
+
+    async def import_candles(self, symbol: SymbolStr, tf: Tf, start_ms: int, end_ms: int):
+        checkpoint = self.checkpoints.get("candles", symbol, tf)
+        if checkpoint is not None:
+            start_ms = max(start_ms, checkpoint["last_open_time"] + get_bucket_end(0, tf))
+
+        rows_count = 0
+        page: List[CandleRow]
+        async for page in prefetched(self.source.candles(symbol, tf, start_ms, end_ms)):
+            await self.db.save_candles(symbol, tf, candles=candles_to_data_frame([[from_ms(r[0]), *r[1:]]
+                                                                                  for r in page]))
+            self.rows += len(page)
+            self.pages += 1
+            rows_count += len(page)
+            self.checkpoints.set("candles", symbol, tf, dict(last_open_time=page[-1][0],
+                                                             rows=(checkpoint or {}).get("rows", 0) + rows_count))
+        logging.info(f"Imported {rows_count} candles {symbol}_{tf}")
+
+    async def import_trades(self, symbol: SymbolStr, start_ms: int, end_ms: int):
+        await self.check_trades_schema()
+        last_ms = await self.get_last_trade_ms(symbol, start_ms, end_ms)
+        if last_ms is not None:
+            start_ms = last_ms + 1  # the committed pages end on a whole millisecond
+
+        rows_count = 0
+        held: List[TradeRow] = []  # trades of the last millisecond of a page, the next page can have more
+        page: List[TradeRow]
+        async for page in prefetched(self.source.trades(symbol, start_ms, end_ms)):
+            rows = held + page
+            cut = len(rows)
+            while cut > 0 and rows[cut - 1][1] == rows[-1][1]:
+                cut -= 1
+            rows, held = rows[:cut], rows[cut:]
+            if rows:
+                await self.copy_trades(symbol, rows)
+                rows_count += len(rows)
+        if held:
+            await self.copy_trades(symbol, held)
+            rows_count += len(held)
+        logging.info(f"Imported {rows_count} trades {symbol}")
+
+    async def run_job(self, name: str, coro):
+        async with self.semaphore:
+            try:
+                await coro
+            except Exception as e:
+                self.failed.append(name)
+                logging.error(f"Import {name} failed, rerun to resume: {add_traceback(e)}")
+
+    async def run(self, symbols: List[SymbolStr], tfs: List[Tf], start_time: datetime,
+                  end_time: Optional[datetime] = None, with_trades: bool = False):
+        start_ms = int(to_timestamp_ms(start_time))
+        end_ms = int(time.time() * 1000) if end_time is None else int(to_timestamp_ms(end_time))
+
+        started = time.time()
+        jobs = [self.run_job(f"{s}_{tf}", self.import_candles(s, tf, start_ms, end_ms)) for s in symbols for tf in tfs]
+        if with_trades:
+            jobs += [self.run_job(f"{s}_trades", self.import_trades(s, start_ms, end_ms)) for s in symbols]
+        await asyncio.gather(*jobs)
+
+        elapsed = time.time() - started
+        logging.info(f"Import done: {self.rows} rows in {self.pages} pages, {round(elapsed, 1)}s "
+                     f"({round(self.rows / max(elapsed, 1e-6))} rows/s), failed: {self.failed}")
@@ -0,0 +1,146 @@
+import asyncio
+import csv
+import glob
+import io
+import os
+import zipfile
+from typing import Any, AsyncIterator, Iterator, List, Optional, Tuple
+
+from tc.core.types import SymbolStr, Tf
+from services.collector.binance_rest import BinanceRestClient, KLINES_LIMIT
+from services.collector.resampler import get_bucket_end
+
+ARCHIVE_PAGE_SIZE = 10000
+
+CandleRow = Tuple[int, float, float, float, float, float]  # open time ms, o, h, l, c, v
+TradeRow = Tuple[int, int, float, float, bool]  # agg trade id, time ms, price, volume, is_buyer
+
+
+def to_ms(value: Any) -> int:
+    value = int(value)
+    return value // 1000 if value > 10 ** 14 else value  # archives switched to microseconds in 2025
+
+
+def kline_to_row(kline: List[Any]) -> CandleRow:
+    return to_ms(kline[0]), float(kline[1]), float(kline[2]), float(kline[3]), float(kline[4]), float(kline[5])
+
+
+def agg_trade_to_row(trade_id: Any, timestamp: Any, price: Any, volume: Any, is_buyer_maker: Any) -> TradeRow:
+    is_buyer_maker = is_buyer_maker if isinstance(is_buyer_maker, bool) else str(is_buyer_maker).lower() == "true"
+    return int(trade_id), to_ms(timestamp), float(price), float(volume), not is_buyer_maker  # taker is the buyer
+
+
+async def prefetched(pages: AsyncIterator[List[Any]], size: int = 2) -> AsyncIterator[List[Any]]:
+    """
+    Download the next pages while the current one is written.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+
+    async def produce():
+        try:
+            async for page in pages:
+                await queue.put(page)
+            await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+
+    task = asyncio.create_task(produce())
+    try:
+        while True:
+            page = await queue.get()
+            if page is None:
+                break
+            if isinstance(page, Exception):
+                raise page
+            yield page
+    finally:
+        task.cancel()
+
+
+class RestSource(object):
+    """
+    Paginated Binance REST history, every request goes through the client weight budget.
+    """
+
+    def __init__(self, client: Optional[BinanceRestClient] = None):
+        self.client = client or BinanceRestClient()
+
+    async def candles(self, symbol: SymbolStr, tf: Tf, start_ms: int, end_ms: int) -> AsyncIterator[List[CandleRow]]:
+        tf_ms = get_bucket_end(0, tf)
+        while start_ms < end_ms:
+            klines = await self.client.get_klines(symbol, tf, start_time=start_ms, end_time=end_ms - 1)
+            rows = [kline_to_row(k) for k in klines if k[0] + tf_ms <= end_ms]  # closed candles only
+            if rows:
+                yield rows
+            if len(klines) < KLINES_LIMIT:
+                break
+            start_ms = klines[-1][0] + tf_ms
+
+    async def trades(self, symbol: SymbolStr, start_ms: int, end_ms: int,
+                     from_id: Optional[int] = None) -> AsyncIterator[List[TradeRow]]:
+        async for trades in self.client.iter_agg_trades(symbol, start_ms, end_ms, from_id):
+            yield [agg_trade_to_row(t["a"], t["T"], t["p"], t["q"], t["m"]) for t in trades]
+
+    async def close(self):
+        await self.client.close()
+
+
+class ArchiveSource(object):
+    """
+    Local data.binance.vision style archives: {SYMBOL}-{tf}-*.zip|csv klines and {SYMBOL}-aggTrades-*.zip|csv.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def files(self, prefix: str) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.path, f"{prefix}-*.zip")) +
+                      glob.glob(os.path.join(self.path, f"{prefix}-*.csv")))
+
+    @staticmethod
+    def read_rows(file_name: str) -> Iterator[List[str]]:
+        if file_name.endswith(".zip"):
+            with zipfile.ZipFile(file_name) as z:
+                for name in z.namelist():
+                    with z.open(name) as f:
+                        for row in csv.reader(io.TextIOWrapper(f)):
+                            if row and row[0].isdigit():  # skip headers
+                                yield row
+        else:
+            with open(file_name, newline="") as f:
+                for row in csv.reader(f):
+                    if row and row[0].isdigit():
+                        yield row
+
+    def pages(self, prefix: str, to_row, start_ms: int, end_ms: int, time_index: int) -> Iterator[List[Any]]:
+        page = []
+        for file_name in self.files(prefix):
+            for row in self.read_rows(file_name):
+                row = to_row(row)
+                if start_ms <= row[time_index] < end_ms:
+                    page.append(row)
+                    if len(page) >= ARCHIVE_PAGE_SIZE:
+                        yield page
+                        page = []
+        if page:
+            yield page
+
+    async def candles(self, symbol: SymbolStr, tf: Tf, start_ms: int, end_ms: int) -> AsyncIterator[List[CandleRow]]:
+        for page in self.pages(f"{symbol.upper()}-{tf}", kline_to_row, start_ms, end_ms, 0):
+            yield page
+            await asyncio.sleep(0)
+
+    async def trades(self, symbol: SymbolStr, start_ms: int, end_ms: int,
+                     from_id: Optional[int] = None) -> AsyncIterator[List[TradeRow]]:
+        def to_row(row: List[str]) -> TradeRow:
+            return agg_trade_to_row(row[0], row[5], row[1], row[2], row[6])
+
+        for page in self.pages(f"{symbol.upper()}-aggTrades", to_row, start_ms, end_ms, 1):
+            if from_id is not None:
+                page = [r for r in page if r[0] >= from_id]
+            if page:
+                yield page
+            await asyncio.sleep(0)
+
+    async def close(self):
+        pass
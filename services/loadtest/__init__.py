@@ -0,0 +1,4 @@
+from .capture import FrameWriter, read_frames, read_manifest, capture_streams
+from .replay import ReplayDriver, StubDb, decode_frame
+from .synthetic import SyntheticMarket
+from .fake_exchange import FakeExchange
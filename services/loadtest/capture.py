@@ -0,0 +1,106 @@
+import asyncio
+import glob
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import aiohttp
+
+from tc.core.utils.logs import add_traceback
+
+BINANCE_SPOT_STREAM = "wss://stream.binance.com:9443/stream"
+BINANCE_FUTURES_STREAM = "wss://fstream.binance.com/stream"
+CAPTURE_CHUNK_FRAMES = 200000
+CAPTURE_CHUNK_SECONDS = 600
+SUBSCRIBE_BATCH = 200  # streams per SUBSCRIBE message
+MANIFEST_FILE = "manifest.json"
+
+Frame = Tuple[float, str, Dict[str, Any]]  # receive time, source (spot/futures), combined stream message
+
+
+class FrameWriter(object):
+    """
+    Raw websocket frames with receive timestamps as gzip JSON lines, rotated by frame count and time:
+    {"t": 1700000000.123456, "src": "spot", "msg": <frame text as received>}
+    """
+
+    def __init__(self, path: str, chunk_frames: int = CAPTURE_CHUNK_FRAMES, chunk_seconds: int = CAPTURE_CHUNK_SECONDS):
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.chunk_seconds = chunk_seconds
+        os.makedirs(path, exist_ok=True)
+        self.chunk = len(glob.glob(os.path.join(path, "frames-*.jsonl.gz")))
+        self.file = None
+        self.chunk_started = 0.0
+        self.chunk_count = 0
+        self.frames = 0
+
+    def rotate(self):
+        self.close()
+        file_name = os.path.join(self.path, f"frames-{self.chunk:06d}.jsonl.gz")
+        self.file = gzip.open(file_name, "wt", compresslevel=6)
+        self.chunk += 1
+        self.chunk_started = time.time()
+        self.chunk_count = 0
+
+    def write(self, source: str, raw: str, received: Optional[float] = None):
+        received = time.time() if received is None else received
+        if self.file is None or self.chunk_count >= self.chunk_frames or \
+                received - self.chunk_started >= self.chunk_seconds:
+            self.rotate()
+        self.file.write(f'{{"t":{received:.6f},"src":"{source}","msg":{raw}}}\n')
+        self.chunk_count += 1
+        self.frames += 1
+
+    def write_manifest(self, manifest: Dict[str, Any]):
+        with open(os.path.join(self.path, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def read_frames(path: str) -> Iterator[Frame]:
+    for file_name in sorted(glob.glob(os.path.join(path, "frames-*.jsonl.gz"))):
+        with gzip.open(file_name, "rt") as f:
+            for line in f:
+                frame = json.loads(line)
+                yield frame["t"], frame["src"], frame["msg"]
+
+
+async def capture_streams(url: str, streams: List[str], writer: FrameWriter, source: str,
+                          duration: Optional[float] = None):
+    """
+    Subscribe to streams on one combined-stream connection and write every data frame until duration ends.
+    """
+    deadline = None if duration is None else time.time() + duration
+    while deadline is None or time.time() < deadline:
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.ws_connect(url, heartbeat=30) as ws:
+                    for i in range(0, len(streams), SUBSCRIBE_BATCH):
+                        await ws.send_json(dict(method="SUBSCRIBE", params=streams[i:i + SUBSCRIBE_BATCH], id=i + 1))
+                    logging.info(f"Capture {source}: {len(streams)} streams subscribed")
+                    while deadline is None or time.time() < deadline:
+                        timeout = None if deadline is None else max(deadline - time.time(), 0.001)
+                        try:
+                            msg = await ws.receive(timeout=timeout)
+                        except asyncio.TimeoutError:
+                            break
+                        if msg.type != aiohttp.WSMsgType.TEXT:
+                            break
+                        if msg.data.startswith('{"stream"'):  # skip subscription responses
+                            writer.write(source, msg.data)
+        except Exception as e:
+            logging.error(add_traceback(e))
+            await asyncio.sleep(1)
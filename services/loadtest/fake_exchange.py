@@ -0,0 +1,161 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, List, Set
+
+from aiohttp import web, WSMsgType
+
+from tc.core.utils.logs import add_traceback
+from services.collector.binance_rest import KLINES_LIMIT
+from services.collector.resampler import get_bucket_start, get_bucket_end
+from services.loadtest.synthetic import SyntheticMarket, SYNTHETIC_TICK, fmt
+
+FAKE_EXCHANGE_PORT = 9443
+FAKE_EXCHANGE_QUEUE = 10000  # frames buffered per connection before it is dropped as a slow consumer
+SPOT_STREAM_PATH = "/stream"
+FUTURES_STREAM_PATH = "/futures/stream"
+
+
+class StreamConnection(object):
+    def __init__(self, ws: web.WebSocketResponse, source: str):
+        self.ws = ws
+        self.source = source
+        self.streams: Set[str] = set()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=FAKE_EXCHANGE_QUEUE)
+        self.dropped = False
+
+    def push(self, raw: str):
+        try:
+            self.queue.put_nowait(raw)
+        except asyncio.QueueFull:
+            self.dropped = True
+
+    async def sender(self):
+        while not self.dropped:
+            raw = await self.queue.get()
+            await self.ws.send_str(raw)
+        logging.warning(f"Fake exchange: slow {self.source} consumer dropped")
+        await self.ws.close()
+
+
+class FakeExchange(object):
+    """
+    Local websocket/REST server with the binance combined-stream protocol (SUBSCRIBE/UNSUBSCRIBE/LIST_SUBSCRIPTIONS
+    and ?streams=) backed by SyntheticMarket in real time. Spot streams are served on SPOT_STREAM_PATH,
+    futures on FUTURES_STREAM_PATH, and exchangeInfo/klines/depth REST calls are answered from the same market.
+
+    Only the clients of this repo take its endpoints: BinanceRestClient (BINANCE_SPOT_API), the order books
+    (BINANCE_SPOT_WS) and loadtest.py capture (--spot-url/--futures-url). The tc websocket clients of the collector,
+    oracle and arbitrage bot have their endpoints built in, those services are driven by the replay driver
+    with a capture of this server or a generated one.
+    """
+
+    def __init__(self, market: SyntheticMarket, speed: float = 1.0):
+        self.market = market
+        self.speed = speed
+        self.connections: List[StreamConnection] = []
+        self.frames = 0
+        self.app = web.Application()
+        self.app.add_routes([web.get(SPOT_STREAM_PATH, self.spot_stream),
+                             web.get(FUTURES_STREAM_PATH, self.futures_stream),
+                             web.get("/api/v3/exchangeInfo", self.exchange_info),
+                             web.get("/fapi/v1/exchangeInfo", self.exchange_info),
+                             web.get("/api/v3/klines", self.klines),
+                             web.get("/api/v3/depth", self.depth)])
+
+    async def stream(self, request: web.Request, source: str) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        connection = StreamConnection(ws, source)
+        connection.streams.update(s for s in request.query.get("streams", "").split("/") if s)
+        self.connections.append(connection)
+        sender = asyncio.create_task(connection.sender())
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    break
+                command = json.loads(msg.data)
+                method, params = command.get("method"), command.get("params", [])
+                result = None
+                if method == "SUBSCRIBE":
+                    connection.streams.update(params)
+                elif method == "UNSUBSCRIBE":
+                    connection.streams.difference_update(params)
+                elif method == "LIST_SUBSCRIPTIONS":
+                    result = sorted(connection.streams)
+                connection.push(json.dumps(dict(result=result, id=command.get("id"))))
+        except Exception as e:
+            logging.error(add_traceback(e))
+        finally:
+            sender.cancel()
+            self.connections.remove(connection)
+        return ws
+
+    async def spot_stream(self, request: web.Request) -> web.WebSocketResponse:
+        return await self.stream(request, "spot")
+
+    async def futures_stream(self, request: web.Request) -> web.WebSocketResponse:
+        return await self.stream(request, "futures")
+
+    async def exchange_info(self, request: web.Request) -> web.Response:
+        cluster_sizes = self.market.get_cluster_sizes()
+        return web.json_response(dict(timezone="UTC", serverTime=self.market.now_ms, symbols=[
+            dict(symbol=s, status="TRADING", baseAsset=s[:-4], quoteAsset="USDT", underlyingType="COIN",
+                 contractType="PERPETUAL",
+                 filters=[dict(filterType="PRICE_FILTER", tickSize=fmt(cluster_sizes[s] / 10)),
+                          dict(filterType="LOT_SIZE", stepSize="0.00001000", minQty="0.00001000")])
+            for s in self.market.symbols]))
+
+    async def klines(self, request: web.Request) -> web.Response:
+        """
+        Flat history candles at the current price: enough for clients which seed their candles on start.
+        """
+        symbol, tf = request.query["symbol"], request.query["interval"]
+        limit = min(int(request.query.get("limit", 500)), KLINES_LIMIT)
+        price = fmt(self.market.prices[self.market.symbols.index(symbol)])
+        end = get_bucket_start(int(request.query.get("endTime", self.market.now_ms)), tf)
+        start = int(request.query.get("startTime", 0))
+        opens = [end]
+        while len(opens) < limit and opens[-1] > start:
+            opens.append(get_bucket_start(opens[-1] - 1, tf))
+        return web.json_response([[t, price, price, price, price, "0", get_bucket_end(t, tf) - 1, "0", 0, "0", "0", "0"]
+                                  for t in sorted(t for t in opens if t >= start)])
+
+    async def depth(self, request: web.Request) -> web.Response:
+        symbol = request.query["symbol"]
+        limit = int(request.query.get("limit", 100))
+        snapshot = self.market.depth_snapshot(symbol, limit)
+        if snapshot is not None:  # consistent with the @depth diffs
+            return web.json_response(snapshot)
+        price = self.market.prices[self.market.symbols.index(symbol)]
+        tick = self.market.get_cluster_sizes()[symbol] / 10
+        return web.json_response(dict(lastUpdateId=self.market.trade_id,
+                                      bids=[[fmt(price - tick * i), "1.00000000"] for i in range(1, limit + 1)],
+                                      asks=[[fmt(price + tick * i), "1.00000000"] for i in range(1, limit + 1)]))
+
+    def publish(self, frames: List[Any]):
+        for _, source, msg in frames:
+            raw = None
+            for connection in self.connections:
+                if connection.source == source and msg["stream"] in connection.streams:
+                    raw = raw or json.dumps(msg)
+                    connection.push(raw)
+            self.frames += 1
+
+    async def market_loop(self):
+        started = time.perf_counter()
+        steps = 0
+        while True:
+            self.publish(self.market.step(SYNTHETIC_TICK))
+            steps += 1
+            delay = started + steps * SYNTHETIC_TICK / self.speed - time.perf_counter()
+            await asyncio.sleep(max(delay, 0))
+
+    async def run(self, host: str = "0.0.0.0", port: int = FAKE_EXCHANGE_PORT):
+        runner = web.AppRunner(self.app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logging.info(f"Fake exchange with {len(self.market.symbols)} symbols on ws://{host}:{port}{SPOT_STREAM_PATH} "
+                     f"and ws://{host}:{port}{FUTURES_STREAM_PATH}")
+        await self.market_loop()
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from tc.core.types import SymbolStr, Tf
+from tc.core.utils.logs import add_traceback
+from services.loadtest.capture import Frame
+
+TRADE_EVENT = "trade"
+CANDLE_EVENT = "candle"
+ALL_PRICE_EVENT = "all_price"
+DEPTH_EVENT = "depth"
+
+Event = Tuple[str, Tuple[Any, ...]]
+Handler = Callable[..., Optional[Awaitable[None]]]
+
+
+def from_ms(value: int) -> datetime:
+    return datetime.utcfromtimestamp(value / 1000)
+
+
+def decode_frame(source: str, msg: Dict[str, Any]) -> Optional[Event]:
+    """
+    Combined stream message -> callback arguments in the tc client contracts:
+    on_trade(symbol, price, volume, is_buyer, timestamp),
+    on_candle_callback(symbol, tf, candle_closed, candle_item, close_time),
+    on_all_price_callback(data) of the spot (!miniTicker@arr) or futures (!markPrice@arr) public client,
+    OrderBookManager.on_message(event) of the @depth streams.
+    """
+    data = msg["data"]
+    if isinstance(data, list):
+        return ALL_PRICE_EVENT, (source == "futures", data)
+
+    event = data.get("e", None)
+    if event == "aggTrade":
+        return TRADE_EVENT, (SymbolStr(data["s"]), float(data["p"]), float(data["q"]), not data["m"],
+                             from_ms(data["T"]))
+    if event == "kline":
+        k = data["k"]
+        candle_item = [from_ms(k["t"]), float(k["o"]), float(k["h"]), float(k["l"]), float(k["c"]), float(k["v"]),
+                       from_ms(k["T"]), float(k["q"]), int(k["n"]), float(k["V"]), float(k["Q"]), 0]
+        return CANDLE_EVENT, (SymbolStr(data["s"]), Tf(k["i"]), k["x"], candle_item, from_ms(k["T"]))
+    if event == "depthUpdate":
+        return DEPTH_EVENT, (data,)
+    return None
+
+
+class LatencyStats(object):
+    def __init__(self):
+        self.values: Dict[str, List[float]] = {}
+
+    def add(self, name: str, value: float):
+        self.values.setdefault(name, []).append(value)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for name, values in self.values.items():
+            v = np.array(values) * 1000
+            result[name] = dict(count=len(v), mean_ms=float(v.mean()), p50_ms=float(np.percentile(v, 50)),
+                                p95_ms=float(np.percentile(v, 95)), p99_ms=float(np.percentile(v, 99)),
+                                max_ms=float(v.max()))
+        return result
+
+
+class StubDb(object):
+    """
+    Local stand-in for TimesScaleDb: every coroutine method succeeds and is counted, reads return empty data.
+    """
+
+    def __init__(self, symbol_status: Optional[List[Dict[str, Any]]] = None):
+        self.symbol_status = symbol_status or []
+        self.calls: Dict[str, int] = {}
+        self.symbol_tf = AutoIdDict()
+
+    async def init(self, *args, **kwargs):
+        pass
+
+    async def get_symbol_status(self, *args, **kwargs) -> List[Dict[str, Any]]:
+        return self.symbol_status
+
+    async def load_levels(self, *args, **kwargs) -> List[Dict[str, Any]]:
+        return []
+
+    def __getattr__(self, name: str):
+        async def method(*args, **kwargs):
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+        return method
+
+
+class AutoIdDict(dict):
+    def __missing__(self, key):
+        self[key] = len(self) + 1
+        return self[key]
+
+
+class StubSocket(object):
+    """
+    Stand-in for the collector PUSH socket, there is no TA worker during replay.
+    """
+
+    def __init__(self):
+        self.messages = 0
+
+    def send_string(self, *args, **kwargs):
+        pass
+
+    def send_pyobj(self, *args, **kwargs):
+        self.messages += 1
+
+
+class ReplayDriver(object):
+    """
+    Feeds captured frames into target callbacks at the captured pace multiplied by speed (None = max speed)
+    and measures throughput and per-callback latency. Periodic target tasks run on the replay clock.
+    """
+
+    def __init__(self, handlers: Dict[str, Handler], speed: Optional[float] = 1.0,
+                 periodic: Optional[List[Tuple[float, Callable[[], Awaitable[None]]]]] = None):
+        self.handlers = handlers
+        self.speed = speed
+        self.periodic = periodic or []
+        self.latency = LatencyStats()
+        self.frames = 0
+        self.events = 0
+        self.errors = 0
+        self.max_behind = 0.0
+
+    async def call(self, name: str, handler: Handler, args: Tuple[Any, ...]):
+        started = time.perf_counter()
+        try:
+            result = handler(*args)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            self.errors += 1
+            if self.errors <= 10:
+                logging.error(add_traceback(e))
+        self.latency.add(name, time.perf_counter() - started)
+
+    async def run(self, frames: Iterable[Frame], limit: Optional[int] = None) -> Dict[str, Any]:
+        started = time.perf_counter()
+        first_t = None
+        next_periodic = [interval for interval, _ in self.periodic]
+        for t, source, msg in frames:
+            if first_t is None:
+                first_t = t
+            replay_t = t - first_t
+            if self.speed is not None:
+                delay = replay_t / self.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    self.max_behind = max(self.max_behind, -delay)
+
+            for i, (interval, task) in enumerate(self.periodic):
+                if replay_t >= next_periodic[i]:
+                    next_periodic[i] = replay_t + interval
+                    await self.call(f"periodic_{task.__name__}", task, ())
+
+            self.frames += 1
+            event = decode_frame(source, msg)
+            handler = self.handlers.get(event[0], None) if event is not None else None
+            if handler is not None:
+                self.events += 1
+                await self.call(event[0], handler, event[1])
+            if limit is not None and self.frames >= limit:
+                break
+            if self.speed is None and self.frames % 1000 == 0:
+                await asyncio.sleep(0)  # let target tasks (writers, flushes) run
+
+        elapsed = time.perf_counter() - started
+        return dict(frames=self.frames, events=self.events, errors=self.errors, elapsed_s=elapsed,
+                    frames_per_s=self.frames / max(elapsed, 1e-9), events_per_s=self.events / max(elapsed, 1e-9),
+                    captured_s=(t - first_t) if first_t is not None else 0.0, max_behind_s=self.max_behind,
+                    latency=self.latency.summary())
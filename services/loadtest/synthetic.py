@@ -0,0 +1,274 @@
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from tc.core.types import SymbolStr, Tf
+from services.collector.order_book import DEPTH_STREAM
+from services.collector.resampler import get_bucket_start, get_bucket_end
+from services.loadtest.capture import Frame
+
+SYNTHETIC_TICK = 0.1  # s of simulated time per generator step
+SYNTHETIC_TRADE_RATE = 5.0  # trades per second per symbol
+SYNTHETIC_VOLATILITY = 0.02  # daily log-return std
+SYNTHETIC_FUTURES_CORRELATION = 0.98
+SYNTHETIC_FUTURES_BASIS = 0.0005
+KLINE_UPDATE_INTERVAL = 2.0  # s, binance pushes open kline updates about every 2s
+ALL_PRICE_INTERVAL = 1.0  # s, !miniTicker@arr and !markPrice@arr@1s
+SYNTHETIC_DEPTH_LEVELS = 20  # order book levels per side, 0 disables the depth streams
+DEPTH_REDRAWS = 2  # level sizes per side redrawn by every depth diff
+DAY_SECONDS = 24 * 60 * 60
+
+
+def get_symbol_name(n: int) -> SymbolStr:
+    return SymbolStr(f"SYN{n:04d}USDT")
+
+
+def fmt(value: float) -> str:
+    return f"{value:.8f}"
+
+
+def kline_to_rest(k: Dict[str, Any]) -> List[Any]:
+    """
+    "k" payload of a kline stream message as a REST kline.
+    """
+    return [k["t"], k["o"], k["h"], k["l"], k["c"], k["v"], k["T"], k["q"], k["n"], k["V"], k["Q"], k["B"]]
+
+
+class KlineState(object):
+    """
+    Open klines of one tf for all symbols as arrays, updated per generator step.
+    """
+
+    def __init__(self, tf: Tf, start_ms: int, prices: np.ndarray):
+        self.tf = tf
+        self.start = get_bucket_start(start_ms, tf)
+        self.end = get_bucket_end(self.start, tf)
+        n = len(prices)
+        self.o, self.h, self.l, self.c = prices.copy(), prices.copy(), prices.copy(), prices.copy()
+        self.v, self.q, self.taker_v, self.taker_q = np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n)
+        self.n = np.zeros(n, dtype=np.int64)
+        self.first_id = np.zeros(n, dtype=np.int64)
+        self.last_id = np.zeros(n, dtype=np.int64)
+
+    def update(self, idx: np.ndarray, price: np.ndarray, qty: np.ndarray, is_buyer: np.ndarray, trade_id: np.ndarray):
+        np.maximum.at(self.h, idx, price)
+        np.minimum.at(self.l, idx, price)
+        np.add.at(self.v, idx, qty)
+        np.add.at(self.q, idx, qty * price)
+        np.add.at(self.taker_v, idx, np.where(is_buyer, qty, 0))
+        np.add.at(self.taker_q, idx, np.where(is_buyer, qty * price, 0))
+        np.add.at(self.n, idx, 1)
+        symbols, first = np.unique(idx, return_index=True)
+        opened = self.first_id[symbols] == 0
+        self.first_id[symbols[opened]] = trade_id[first[opened]]
+        self.c[idx] = price  # the last assignment wins, trades are in time order
+        self.last_id[idx] = trade_id
+
+    def roll(self, prices: np.ndarray):
+        self.start, self.end = self.end, get_bucket_end(self.end, self.tf)
+        self.o, self.h, self.l, self.c = prices.copy(), prices.copy(), prices.copy(), prices.copy()
+        for a in (self.v, self.q, self.taker_v, self.taker_q, self.n, self.first_id, self.last_id):
+            a.fill(0)
+
+    def message(self, i: int, symbol: SymbolStr, event_ms: int, closed: bool) -> Dict[str, Any]:
+        return dict(e="kline", E=event_ms, s=symbol,
+                    k=dict(t=self.start, T=self.end - 1, s=symbol, i=self.tf, f=int(self.first_id[i]),
+                           L=int(self.last_id[i]), o=fmt(self.o[i]), c=fmt(self.c[i]), h=fmt(self.h[i]),
+                           l=fmt(self.l[i]), v=fmt(self.v[i]), n=int(self.n[i]), x=closed, q=fmt(self.q[i]),
+                           V=fmt(self.taker_v[i]), Q=fmt(self.taker_q[i]), B="0"))
+
+
+class DepthState(object):
+    """
+    Order books of all symbols: levels one tick apart on both sides of the price, {price in ticks: qty} per side.
+    Every diff re-centers a book on the price and redraws a few sizes, snapshots are read from the same dicts,
+    so a book synced from a snapshot plus the later diffs matches them. The books start empty at update id 0.
+    """
+
+    def __init__(self, rnd: np.random.Generator, ticks: np.ndarray, sizes: np.ndarray, levels: int):
+        self.rnd = rnd
+        self.ticks = ticks
+        self.sizes = sizes
+        self.levels = levels
+        self.bids: List[Dict[int, float]] = [{} for _ in ticks]
+        self.asks: List[Dict[int, float]] = [{} for _ in ticks]
+        self.update_id = np.zeros(len(ticks), dtype=np.int64)
+
+    def update_side(self, i: int, book: Dict[int, float], keys: range) -> List[List[str]]:
+        changes = {k: 0.0 for k in book.keys() - set(keys)}
+        for k in changes:
+            del book[k]
+        added = [k for k in keys if k not in book]
+        redrawn = self.rnd.choice(keys, size=min(DEPTH_REDRAWS, len(keys)), replace=False) if len(keys) else []
+        for k in added + [int(k) for k in redrawn]:
+            book[k] = changes[k] = float(self.rnd.exponential(self.sizes[i]))
+        return [[fmt(k * self.ticks[i]), fmt(q)] for k, q in sorted(changes.items())]
+
+    def diff(self, i: int, symbol: SymbolStr, price: float, event_ms: int) -> Dict[str, Any]:
+        anchor = int(round(price / self.ticks[i]))
+        bids = self.update_side(i, self.bids[i], range(anchor - self.levels, anchor))
+        asks = self.update_side(i, self.asks[i], range(anchor + 1, anchor + self.levels + 1))
+        self.update_id[i] += 1
+        u = int(self.update_id[i])
+        return dict(e="depthUpdate", E=event_ms, s=symbol, U=u, u=u, b=bids, a=asks)
+
+    def snapshot(self, i: int, limit: int) -> Dict[str, Any]:
+        tick = self.ticks[i]
+        return dict(lastUpdateId=int(self.update_id[i]),
+                    bids=[[fmt(k * tick), fmt(q)] for k, q in sorted(self.bids[i].items(), reverse=True)[:limit]],
+                    asks=[[fmt(k * tick), fmt(q)] for k, q in sorted(self.asks[i].items())[:limit]])
+
+
+class SyntheticMarket(object):
+    """
+    Binance-format spot/futures streams for any number of symbols:
+    - spot prices are geometric random walks, futures follow them with correlated noise and a basis
+    - trades arrive as a Poisson process per symbol, with exponential sizes and random aggressor side
+    - klines of every tf are built from the generated trades and close on binance bucket boundaries
+    - @depth diffs of the symbols traded in a step, from DepthState books around the price
+    Simulated time only moves in step(), so the same seed gives the same frames.
+    """
+
+    def __init__(self, symbols: int, tfs: List[Tf], trade_rate: float = SYNTHETIC_TRADE_RATE,
+                 volatility: float = SYNTHETIC_VOLATILITY, correlation: float = SYNTHETIC_FUTURES_CORRELATION,
+                 basis: float = SYNTHETIC_FUTURES_BASIS, seed: int = 0, start_ms: Optional[int] = None,
+                 depth_levels: int = SYNTHETIC_DEPTH_LEVELS):
+        self.rnd = np.random.default_rng(seed)
+        self.symbols = [get_symbol_name(n) for n in range(symbols)]
+        self.trade_rate = trade_rate
+        self.volatility = volatility
+        self.correlation = correlation
+        self.basis = basis
+        start_ms = int(time.time() * 1000) if start_ms is None else start_ms
+        self.now_ms = start_ms - start_ms % int(SYNTHETIC_TICK * 1000)  # steps end on candle boundaries
+        self.prices = np.exp(self.rnd.uniform(np.log(0.01), np.log(50000), size=symbols))
+        self.futures_noise = np.zeros(symbols)
+        self.sizes = 1000 / self.prices  # mean trade of ~1000 USDT
+        self.cluster_sizes = 10 ** np.floor(np.log10(self.prices * 0.001))  # fixed, the tick size is 1/10 of it
+        self.traded = np.empty(0, dtype=np.int64)  # symbols traded in the last step
+        # own generator: the trade and kline frames of a seed do not depend on the depth streams
+        self.depth = DepthState(np.random.default_rng([seed, 1]), self.cluster_sizes / 10, self.sizes,
+                                depth_levels) if depth_levels > 0 else None
+        self.klines = [KlineState(tf, self.now_ms, self.prices) for tf in tfs]
+        self.day_open = self.prices.copy()
+        self.day_volume = np.zeros(symbols)
+        self.trade_id = 0
+        self.last_kline_update = self.now_ms
+        self.last_all_price = self.now_ms
+
+    def get_cluster_sizes(self) -> Dict[SymbolStr, float]:
+        return {s: float(c) for s, c in zip(self.symbols, self.cluster_sizes)}
+
+    @property
+    def futures_prices(self) -> np.ndarray:
+        return self.prices * (1 + self.basis + self.futures_noise)
+
+    def walk(self, dt: float):
+        n = len(self.symbols)
+        sigma = self.volatility * np.sqrt(dt / DAY_SECONDS)
+        spot = self.rnd.standard_normal(n)
+        independent = self.rnd.standard_normal(n)
+        self.prices *= np.exp(sigma * spot)
+        # futures/spot spread mean-reverts, its shocks are correlated with spot moves
+        shock = self.correlation * spot + np.sqrt(1 - self.correlation ** 2) * independent
+        self.futures_noise = 0.9 * self.futures_noise + sigma * 0.1 * shock
+
+    def trades(self, dt: float) -> List[Frame]:
+        count = self.rnd.poisson(self.trade_rate * len(self.symbols) * dt)
+        if count == 0:
+            self.traded = np.empty(0, dtype=np.int64)
+            return []
+        offsets = np.sort(self.rnd.uniform(0, dt * 1000, size=count)).astype(np.int64)
+        idx = self.rnd.integers(0, len(self.symbols), size=count)
+        price = self.prices[idx] * (1 + self.rnd.normal(0, 0.0002, size=count))
+        qty = self.rnd.exponential(self.sizes[idx])
+        is_buyer = self.rnd.random(count) < 0.5
+        trade_id = np.arange(self.trade_id + 1, self.trade_id + count + 1)
+        self.trade_id += count
+        for k in self.klines:
+            k.update(idx, price, qty, is_buyer, trade_id)
+        np.add.at(self.day_volume, idx, qty)
+        self.traded = np.unique(idx)
+
+        frames = []
+        for i, o, p, q, b, a in zip(idx, offsets, price, qty, is_buyer, trade_id):
+            symbol = self.symbols[i]
+            t_ms = self.now_ms + int(o)
+            frames.append((t_ms / 1000, "spot", dict(
+                stream=f"{symbol.lower()}@aggTrade",
+                data=dict(e="aggTrade", E=t_ms, s=symbol, a=int(a), p=fmt(p), q=fmt(q), f=int(a), l=int(a), T=t_ms,
+                          m=not b, M=True))))
+        return frames
+
+    def kline_frames(self, closed: bool) -> List[Frame]:
+        frames = []
+        for k in self.klines:
+            if closed != (self.now_ms >= k.end):
+                continue
+            event_ms = k.end if closed else self.now_ms
+            for i, symbol in enumerate(self.symbols):
+                if closed or k.n[i] > 0:
+                    frames.append((event_ms / 1000, "spot", dict(stream=f"{symbol.lower()}@kline_{k.tf}",
+                                                                 data=k.message(i, symbol, event_ms, closed))))
+            if closed:
+                k.roll(self.prices)
+        return frames
+
+    def depth_frames(self) -> List[Frame]:
+        if self.depth is None:
+            return []
+        return [(self.now_ms / 1000, "spot", dict(stream=f"{self.symbols[i].lower()}@{DEPTH_STREAM}",
+                                                  data=self.depth.diff(i, self.symbols[i], self.prices[i],
+                                                                       self.now_ms)))
+                for i in self.traded]
+
+    def depth_snapshot(self, symbol: SymbolStr, limit: int) -> Optional[Dict[str, Any]]:
+        return self.depth.snapshot(self.symbols.index(symbol), limit) if self.depth is not None else None
+
+    def all_price_frames(self) -> List[Frame]:
+        t = self.now_ms / 1000
+        futures = self.futures_prices
+        tickers = [dict(e="24hrMiniTicker", E=self.now_ms, s=s, c=fmt(self.prices[i]), o=fmt(self.day_open[i]),
+                        h=fmt(max(self.prices[i], self.day_open[i])), l=fmt(min(self.prices[i], self.day_open[i])),
+                        v=fmt(self.day_volume[i]), q=fmt(self.day_volume[i] * self.prices[i]))
+                   for i, s in enumerate(self.symbols)]
+        marks = [dict(e="markPriceUpdate", E=self.now_ms, s=s, p=fmt(futures[i]), i=fmt(self.prices[i]),
+                      P=fmt(futures[i]), r="0.00010000", T=self.now_ms + 8 * 60 * 60 * 1000)
+                 for i, s in enumerate(self.symbols)]
+        return [(t, "spot", dict(stream="!miniTicker@arr", data=tickers)),
+                (t, "futures", dict(stream="!markPrice@arr@1s", data=marks))]
+
+    def step(self, dt: float = SYNTHETIC_TICK) -> List[Frame]:
+        self.walk(dt)
+        frames = self.trades(dt)
+        self.now_ms += int(dt * 1000)
+        frames += self.depth_frames()
+        frames += self.kline_frames(closed=True)
+        if self.now_ms - self.last_kline_update >= KLINE_UPDATE_INTERVAL * 1000:
+            self.last_kline_update = self.now_ms
+            frames += self.kline_frames(closed=False)
+        if self.now_ms - self.last_all_price >= ALL_PRICE_INTERVAL * 1000:
+            self.last_all_price = self.now_ms
+            frames += self.all_price_frames()
+        return frames
+
+    def frames(self, duration: float, dt: float = SYNTHETIC_TICK) -> Iterator[Frame]:
+        for _ in range(int(duration / dt)):
+            yield from self.step(dt)
+
+    def record_klines(self, duration: float, dt: float = SYNTHETIC_TICK) -> Dict[SymbolStr, Dict[Tf, List[List[Any]]]]:
+        """
+        REST klines of the candles closed while the market runs for duration s: every tf is built from the trades,
+        not from the smaller tfs, as on the exchange.
+        """
+        klines: Dict[SymbolStr, Dict[Tf, List[List[Any]]]] = {s: {k.tf: [] for k in self.klines} for s in self.symbols}
+        for _, _, msg in self.frames(duration, dt):
+            data = msg["data"]
+            if isinstance(data, dict) and data.get("e") == "kline" and data["k"]["x"]:
+                klines[data["s"]][data["k"]["i"]].append(kline_to_rest(data["k"]))
+        return klines
+
+    def manifest(self) -> Dict[str, Any]:
+        return dict(synthetic=True, symbols=[dict(symbol=s, cluster_size=c) for s, c in self.get_cluster_sizes().items()],
+                    tfs=[k.tf for k in self.klines], trade_rate=self.trade_rate)
@@ -0,0 +1,97 @@
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from tc.config import Config
+from tc.core.exchange.common.mappers import binance_to_symbol
+from tc.core.types import SymbolStr
+from services.market_data import CandleCache, MarketDataStore
+from services.loadtest.replay import ReplayDriver, StubDb, StubSocket, TRADE_EVENT, CANDLE_EVENT, ALL_PRICE_EVENT, \
+    DEPTH_EVENT
+
+LOADTEST_SHM_NAME = "tc_loadtest_market_data"
+ORACLE_CHECK_INTERVAL = 5  # s of captured time, as MarketPredictionOracle.update_loop
+ARBITRAGE_UPDATE_INTERVAL = 5  # s of captured time, as ArbitrageBot.update_loop
+
+
+def get_symbol_status(manifest: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [dict(symbol=SymbolStr(s["symbol"]), cluster_size=s["cluster_size"]) for s in manifest["symbols"]]
+
+
+async def collector_target(config: Config, manifest: Dict[str, Any], speed: Optional[float]) -> ReplayDriver:
+    """
+    DataCollector without websockets, DB, TA worker and REST gap backfill: candle cache goes to a temp dir,
+    the market data store lives in its own shared memory segment. The @depth diffs of synthetic captures go to
+    the order books, which start empty as the synthetic ones.
+    """
+    from services.collector.data_collector import DataCollector, DATA_COLLECTOR_TFS
+    from services.collector.order_book import OrderBookManager
+
+    db = StubDb(get_symbol_status(manifest))
+    dc = DataCollector(config, backfill_gaps=False)
+    dc.socket.close(linger=0)
+    dc.db = dc.candle_writer.db = db
+    dc.socket = StubSocket()
+    dc.candle_cache = CandleCache(tempfile.mkdtemp(prefix="loadtest-candles-"))
+    await dc.init_symbols()
+    dc.market_store = MarketDataStore.create(list(dc.symbols.keys()), DATA_COLLECTOR_TFS, name=LOADTEST_SHM_NAME)
+    handlers = {TRADE_EVENT: dc.on_trade, CANDLE_EVENT: dc.on_candle_callback}
+    if manifest.get("synthetic", False):
+        dc.order_books = OrderBookManager(list(dc.symbols.keys()))
+        for book in dc.order_books.books.values():
+            book.apply_snapshot(dict(lastUpdateId=0, bids=[], asks=[]))
+        handlers[DEPTH_EVENT] = dc.order_books.on_message
+    return ReplayDriver(handlers, speed=speed)
+
+
+async def oracle_target(config: Config, manifest: Dict[str, Any], speed: Optional[float]) -> ReplayDriver:
+    """
+    MarketPredictionOracle reading a market data store which the driver writes in place of the collector,
+    signals are checked every ORACLE_CHECK_INTERVAL of captured time.
+    """
+    from services.market_prediction.oracle import MarketPredictionOracle
+
+    oracle = MarketPredictionOracle(config)
+    oracle.db = StubDb(get_symbol_status(manifest))
+    oracle.candle_cache = CandleCache(tempfile.mkdtemp(prefix="loadtest-candles-"))
+    await oracle.init_symbols()
+    store = MarketDataStore.create(oracle.symbols, oracle.tfs, name=LOADTEST_SHM_NAME)
+    oracle.market_store = store
+    oracle.market_store_counts = {key_: 0 for key_ in oracle.symbol_tfs}
+    await oracle.init_oracle_data()
+    oracle.initialized = True
+
+    def on_trade(symbol: SymbolStr, price: float, volume: float, is_buyer: bool, timestamp: Any):
+        store.update_price(symbol, price, timestamp)
+        oracle.mark_prices_.setdefault(binance_to_symbol(symbol), price)
+
+    def on_candle(symbol: SymbolStr, tf: str, candle_closed: bool, candle_item: List[Any], close_time: Any):
+        if store.has(symbol, tf):
+            store.update_candle(symbol, tf, candle_item, candle_closed)
+
+    async def check_signals():
+        await oracle.poll_market_store()
+        if oracle.update_levels_flag:
+            await oracle.update_levels()
+            oracle.update_levels_flag = False
+        await oracle.check_signals()
+
+    return ReplayDriver({TRADE_EVENT: on_trade, CANDLE_EVENT: on_candle}, speed=speed,
+                        periodic=[(ORACLE_CHECK_INTERVAL, check_signals)])
+
+
+async def arbitrage_target(config: Config, manifest: Dict[str, Any], speed: Optional[float]) -> ReplayDriver:
+    """
+    ArbitrageBot spreads from the captured spot/futures all-price streams, without exchange clients and trading.
+    """
+    from services.arbitrage import ArbitrageBot
+
+    bot = ArbitrageBot()
+    bot.db = StubDb()
+    bot.symbols = [SymbolStr(s["symbol"]) for s in manifest["symbols"]]
+    bot.spreads['symbol'] = bot.symbols
+    bot.spreads.set_index("symbol", inplace=True)
+    return ReplayDriver({ALL_PRICE_EVENT: bot.on_price_change}, speed=speed,
+                        periodic=[(ARBITRAGE_UPDATE_INTERVAL, bot.update_spreads)])
+
+
+TARGETS = dict(collector=collector_target, oracle=oracle_target, arbitrage=arbitrage_target)
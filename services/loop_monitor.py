@@ -0,0 +1,204 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from datetime import datetime
+from types import FrameType
+from typing import Any, Deque, Dict, Optional
+
+from services.metrics import add_exporter_route, counter, histogram
+
+LOOP_HEARTBEAT_INTERVAL = 0.1  # s
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.25"))  # s the loop may stay blocked unreported
+PROFILE_INTERVAL = 0.005  # s between stack samples
+PROFILE_DIR = "./data/profiles"
+STALL_HISTORY_SIZE = 20
+
+LOOP_LAG = histogram("event_loop_lag_seconds", "Delay of asyncio wakeups over the expected time")
+LOOP_STALLS = counter("event_loop_stalls", "Event loop blocked longer than the stall threshold")
+
+
+def get_frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def fold_stack(frame: Optional[FrameType]) -> str:
+    """
+    Root first, ';' separated, as the collapsed stacks of flamegraph.pl / speedscope.
+    """
+    names = []
+    while frame is not None:
+        names.append(get_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def write_folded(stacks: Counter, file_name: str):
+    os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+    with open(file_name, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stack of one thread from a daemon thread: no tracing hooks, the cost stays in the sampler thread
+    apart from the GIL switches.
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started = 0.0
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None
+
+    def start(self):
+        if self.running:
+            return
+        self.stacks, self.samples, self.started = Counter(), 0, time.time()
+        self.thread = threading.Thread(target=self.run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> Counter:
+        thread, self.thread = self.thread, None
+        if thread is not None:
+            thread.join()
+        return self.stacks
+
+    def run(self):
+        while self.thread is not None:
+            frame = sys._current_frames().get(self.thread_id, None)
+            if frame is not None:
+                self.stacks[fold_stack(frame)] += 1
+                self.samples += 1
+            del frame
+            time.sleep(self.interval)
+
+
+class LoopMonitor(object):
+    """
+    A heartbeat task measures the loop lag, a watchdog thread reports the stack of the loop thread once the heartbeat
+    is late by more than the threshold: the frames of the blocking callback, captured while it still blocks.
+    The sampling profiler of the loop thread is toggled by SIGUSR2 or a POST to the /profile routes of the metrics exporter from localhost.
+    """
+
+    def __init__(self, service: str, threshold: float = LOOP_STALL_THRESHOLD,
+                 interval: float = LOOP_HEARTBEAT_INTERVAL, profile_dir: str = PROFILE_DIR):
+        self.service = service
+        self.threshold = threshold
+        self.interval = interval
+        self.profile_dir = profile_dir
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread_id = 0
+        self.beat = time.monotonic()
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=STALL_HISTORY_SIZE)
+        self.profiler: Optional[SamplingProfiler] = None
+        self.last_profile: Optional[str] = None
+
+    def start(self):
+        """
+        Called from a coroutine running in the monitored loop.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        self.profiler = SamplingProfiler(self.thread_id)
+        self.beat = time.monotonic()
+        self.loop.create_task(self.heartbeat_loop())
+        threading.Thread(target=self.watchdog, name="loop-watchdog", daemon=True).start()
+        try:
+            self.loop.add_signal_handler(signal.SIGUSR2, self.toggle_profiler)
+        except (NotImplementedError, RuntimeError, ValueError):  # windows, or the loop is not in the main thread
+            logging.info("SIGUSR2 profiler toggle unavailable")
+        add_exporter_route("/profile/start", "application/json", lambda: json.dumps(self.start_profiler()).encode(),
+                           method="POST")
+        add_exporter_route("/profile/stop", "application/json", lambda: json.dumps(self.stop_profiler()).encode(),
+                           method="POST")
+        add_exporter_route("/stalls", "text/plain", lambda: self.format_stalls().encode())
+        logging.info(f"Loop monitor of {self.service}: stalls over {self.threshold}s reported")
+
+    async def heartbeat_loop(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            LOOP_LAG.observe(max(time.perf_counter() - start - self.interval, 0.0))
+            self.beat = time.monotonic()
+
+    def watchdog(self):
+        reported = None
+        while True:
+            time.sleep(self.interval)
+            beat = self.beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked > self.threshold and reported != beat:  # once per stall
+                reported = beat
+                self.report_stall(blocked)
+
+    def report_stall(self, blocked: float):
+        frame = sys._current_frames().get(self.thread_id, None)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        del frame
+        task = asyncio.current_task(self.loop)
+        task_name = task.get_name() if task is not None else None
+        coro = getattr(task.get_coro(), "__qualname__", None) if task is not None else None
+        LOOP_STALLS.inc()
+        self.stalls.append(dict(time=time.time(), blocked=blocked, task=task_name, coro=coro, stack=stack))
+        logging.warning(f"Event loop of {self.service} blocked for {blocked:.3f}s+ in task {task_name} ({coro}):\n"
+                        f"{stack}")
+
+    def format_stalls(self) -> str:
+        return "\n".join(f"{datetime.utcfromtimestamp(s['time'])} blocked {s['blocked']:.3f}s+ "
+                         f"task {s['task']} ({s['coro']})\n{s['stack']}" for s in self.stalls)
+
+    def get_profiler_status(self) -> Dict[str, Any]:
+        return dict(running=self.profiler.running, samples=self.profiler.samples, file=self.last_profile)
+
+    def start_profiler(self) -> Dict[str, Any]:
+        if not self.profiler.running:
+            self.profiler.start()
+            logging.info(f"Sampling profiler of {self.service} started")
+        return self.get_profiler_status()
+
+    def stop_profiler(self) -> Dict[str, Any]:
+        """
+        file: collapsed stacks of the last profile, render with flamegraph.pl or speedscope
+        """
+        if not self.profiler.running:
+            return self.get_profiler_status()
+        started = self.profiler.started
+        stacks = self.profiler.stop()
+        file_name = os.path.join(self.profile_dir,
+                                 f"{self.service}_{datetime.utcfromtimestamp(started):%Y%m%d_%H%M%S}.folded")
+        write_folded(stacks, file_name)
+        self.last_profile = file_name
+        logging.info(f"Sampling profiler of {self.service} stopped: {sum(stacks.values())} samples in {file_name}")
+        return self.get_profiler_status()
+
+    def toggle_profiler(self) -> Dict[str, Any]:
+        return self.stop_profiler() if self.profiler.running else self.start_profiler()
+
+
+LOOP_MONITOR: Optional[LoopMonitor] = None
+
+
+def start_loop_monitor(service: str, **kwargs) -> LoopMonitor:
+    """
+    Once per process, from a coroutine running in the service loop.
+    """
+    global LOOP_MONITOR
+    if LOOP_MONITOR is None:
+        LOOP_MONITOR = LoopMonitor(service, **kwargs)
+        LOOP_MONITOR.start()
+    return LOOP_MONITOR
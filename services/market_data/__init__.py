@@ -0,0 +1,2 @@
+from .candle_cache import CandleCache, CachedDataProvider
+from .shm_store import MarketDataStore, SeqLockTimeout, MARKET_DATA_SHM_NAME
@@ -0,0 +1,247 @@
+import fcntl
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, BinaryIO, Iterator, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from tc.core.exchange.common.mappers import symbol_to_binance
+from tc.core.types import Symbol, SymbolStr, Tf
+
+CANDLE_CACHE_DIR = "./data/candles"
+CANDLE_COLUMNS = ["o", "h", "l", "c", "v"]
+ROW_WIDTH = len(CANDLE_COLUMNS) + 1  # timestamp(ms) + ohlcv
+
+
+def to_symbol_str(symbol: Union[Symbol, SymbolStr, str]) -> str:
+    return (symbol if isinstance(symbol, str) else symbol_to_binance(symbol)).upper()
+
+
+def to_timestamp_ms(value: Union[datetime, pd.Timestamp]) -> float:
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert("UTC").tz_localize(None)
+    return float(ts.value // 10 ** 6)
+
+
+def rows_to_data_frame(rows: np.ndarray) -> pd.DataFrame:
+    index = pd.DatetimeIndex(pd.to_datetime(rows[:, 0].astype(np.int64), unit="ms"), name="timestamp")
+    return pd.DataFrame(rows[:, 1:], index=index, columns=CANDLE_COLUMNS)
+
+
+def data_frame_to_rows(candles: pd.DataFrame) -> np.ndarray:
+    rows = np.empty((len(candles), ROW_WIDTH), dtype=np.float64)
+    rows[:, 0] = [to_timestamp_ms(ts) for ts in candles.index]
+    rows[:, 1:] = candles[CANDLE_COLUMNS].to_numpy(dtype=np.float64)
+    return rows
+
+
+@contextmanager
+def locked_file(file_name: str) -> Iterator[BinaryIO]:
+    """
+    Exclusive flock of the file, reopened when a trim replaced it while waiting for the lock.
+    """
+    while True:
+        f = open(file_name, "ab+")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        if os.path.exists(file_name) and os.fstat(f.fileno()).st_ino == os.stat(file_name).st_ino:
+            break
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+    try:
+        yield f
+    finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+
+def read_rows(file_name: str, width: int) -> np.ndarray:
+    size = os.path.getsize(file_name) if os.path.exists(file_name) else 0
+    n = size // (width * 8)  # ignore a partially written tail row
+    if n == 0:
+        return np.empty((0, width), dtype=np.float64)
+    return np.memmap(file_name, dtype=np.float64, mode="r", shape=(n, width))
+
+
+def is_open(open_time: Union[datetime, pd.Timestamp], tf: Tf) -> bool:
+    from services.collector.resampler import get_bucket_end  # the resampler imports this module
+    return get_bucket_end(int(to_timestamp_ms(open_time)), tf) > time.time() * 1000
+
+
+class CandleCache(object):
+    """
+    Closed candles per (symbol, tf) as append-only float64 files: [timestamp_ms, o, h, l, c, v] rows,
+    read through np.memmap. Appends are serialized with flock, so collector and oracle can share a directory.
+    Other numeric columns of appended frames (quote volume, trades...) go to an .extra.f8 file of
+    [timestamp_ms, *columns] rows, the column names in .extra.json; load joins them by timestamp.
+    """
+
+    def __init__(self, path: str = CANDLE_CACHE_DIR):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def file_name(self, symbol: Union[Symbol, SymbolStr], tf: Tf) -> str:
+        return os.path.join(self.path, f"{to_symbol_str(symbol)}_{tf}.f8")
+
+    def extra_file_name(self, symbol: Union[Symbol, SymbolStr], tf: Tf, ext: str = "f8") -> str:
+        return os.path.join(self.path, f"{to_symbol_str(symbol)}_{tf}.extra.{ext}")
+
+    def get_extra_columns(self, symbol: Union[Symbol, SymbolStr], tf: Tf) -> List[str]:
+        file_name = self.extra_file_name(symbol, tf, "json")
+        if not os.path.exists(file_name):
+            return []
+        with open(file_name) as f:
+            return json.load(f)
+
+    def read(self, symbol: Union[Symbol, SymbolStr], tf: Tf) -> np.ndarray:
+        return read_rows(self.file_name(symbol, tf), ROW_WIDTH)
+
+    def load(self, symbol: Union[Symbol, SymbolStr], tf: Tf) -> pd.DataFrame:
+        candles = rows_to_data_frame(np.array(self.read(symbol, tf)))
+        columns = self.get_extra_columns(symbol, tf)
+        if columns:
+            rows = np.array(read_rows(self.extra_file_name(symbol, tf), len(columns) + 1))
+            index = pd.DatetimeIndex(pd.to_datetime(rows[:, 0].astype(np.int64), unit="ms"), name="timestamp")
+            extra = pd.DataFrame(rows[:, 1:], index=index, columns=columns)
+            candles = candles.join(extra[~extra.index.duplicated(keep="last")])
+        return candles
+
+    def last_timestamp(self, symbol: Union[Symbol, SymbolStr], tf: Tf) -> Optional[datetime]:
+        rows = self.read(symbol, tf)
+        return pd.to_datetime(int(rows[-1, 0]), unit="ms").to_pydatetime() if len(rows) > 0 else None
+
+    @staticmethod
+    def append_file(file_name: str, rows: np.ndarray) -> int:
+        """
+        Appends the rows newer than the last one of the file.
+        """
+        if len(rows) == 0:
+            return 0
+
+        row_size = rows.shape[1] * 8
+        with locked_file(file_name) as f:
+            size = f.seek(0, os.SEEK_END)
+            if size % row_size:
+                size = size - size % row_size
+                f.truncate(size)
+            last_ts = -np.inf
+            if size > 0:
+                f.seek(size - row_size)
+                last_ts = np.frombuffer(f.read(row_size), dtype=np.float64)[0]
+            rows = rows[rows[:, 0] > last_ts]
+            if len(rows) > 0:
+                f.seek(0, os.SEEK_END)
+                f.write(np.ascontiguousarray(rows, dtype=np.float64).tobytes())
+                f.flush()
+            return len(rows)
+
+    def append_rows(self, symbol: Union[Symbol, SymbolStr], tf: Tf, rows: np.ndarray) -> int:
+        return self.append_file(self.file_name(symbol, tf), rows)
+
+    def append(self, symbol: Union[Symbol, SymbolStr], tf: Tf, candles: pd.DataFrame) -> int:
+        candles = candles.sort_index()
+        count = self.append_rows(symbol, tf, data_frame_to_rows(candles))
+        extra_columns = [c for c in candles.columns
+                         if c not in CANDLE_COLUMNS and pd.api.types.is_numeric_dtype(candles[c])]
+        if extra_columns and len(candles) > 0:
+            self.append_extra(symbol, tf, candles, extra_columns)
+        return count
+
+    def append_extra(self, symbol: Union[Symbol, SymbolStr], tf: Tf, candles: pd.DataFrame, columns: List[str]):
+        stored = self.get_extra_columns(symbol, tf)
+        if not stored:
+            file_name = self.extra_file_name(symbol, tf, "json")
+            with open(f"{file_name}.tmp", "w") as f:
+                json.dump(columns, f)
+            os.replace(f"{file_name}.tmp", file_name)
+            stored = columns
+
+        rows = np.full((len(candles), len(stored) + 1), np.nan, dtype=np.float64)
+        rows[:, 0] = [to_timestamp_ms(ts) for ts in candles.index]
+        for i, column in enumerate(stored):
+            if column in candles.columns:
+                rows[:, i + 1] = candles[column].to_numpy(dtype=np.float64)
+        self.append_file(self.extra_file_name(symbol, tf), rows)
+
+    def trim(self, symbol: Union[Symbol, SymbolStr], tf: Tf, start_time: Union[datetime, pd.Timestamp]) -> int:
+        """
+        Drops the rows older than start_time: the kept rows are written to a new file renamed over the old one,
+        memmaps of the old file stay valid.
+        :return: rows dropped from the candles file
+        """
+        start_ms = to_timestamp_ms(start_time)
+        dropped = 0
+        columns = self.get_extra_columns(symbol, tf)
+        files = [(self.file_name(symbol, tf), ROW_WIDTH)]
+        if columns:
+            files.append((self.extra_file_name(symbol, tf), len(columns) + 1))
+        for i, (file_name, width) in enumerate(files):
+            if not os.path.exists(file_name):
+                continue
+            with locked_file(file_name):
+                rows = read_rows(file_name, width)
+                keep = np.searchsorted(rows[:, 0], start_ms)
+                if keep == 0:
+                    continue
+                with open(f"{file_name}.tmp", "wb") as f:
+                    f.write(np.ascontiguousarray(rows[keep:]).tobytes())
+                os.replace(f"{file_name}.tmp", file_name)
+                if i == 0:
+                    dropped = int(keep)
+        return dropped
+
+    def append_item(self, symbol: Union[Symbol, SymbolStr], tf: Tf, candle_item: List[Any]) -> int:
+        """
+        :param candle_item: [timestamp, o, h, l, c, v, ...] as passed to on_candle_callback
+        """
+        row = [to_timestamp_ms(candle_item[0])] + [float(v) for v in candle_item[1:ROW_WIDTH]]
+        return self.append_rows(symbol, tf, np.array([row], dtype=np.float64))
+
+
+class CachedDataProvider(object):
+    """
+    Wraps a candles data provider (e.g. TimescaleDataProvider): history is served from CandleCache
+    and only the tail since the last cached candle is requested from the wrapped provider.
+    The cache is trimmed to the requested window once more than half of it is older.
+    """
+
+    def __init__(self, provider: Any, cache: CandleCache):
+        self.provider = provider
+        self.cache = cache
+
+    def __getattr__(self, name: str):
+        return getattr(self.provider, name)
+
+    async def load_candles(self, symbol: Union[Symbol, SymbolStr], tf: Tf, start_time: Optional[datetime] = None,
+                           end_time: Optional[datetime] = None, *args, **kwargs) -> pd.DataFrame:
+        cached = self.cache.load(symbol, tf)
+        fetch_from = start_time
+        if len(cached) > 0 and (start_time is None or cached.index[0] <= pd.Timestamp(start_time)):
+            fetch_from = cached.index[-1].to_pydatetime()
+
+        fresh = await self.provider.load_candles(symbol, tf, *args, start_time=fetch_from, end_time=end_time,
+                                                 **kwargs)
+        if fresh is None or len(fresh) == 0:
+            candles = cached
+        else:
+            fresh = fresh.sort_index()
+            self.cache.append(symbol, tf, fresh.iloc[:-1] if is_open(fresh.index[-1], tf) else fresh)
+            candles = pd.concat([cached, fresh])
+            candles = candles[~candles.index.duplicated(keep="last")]
+
+        if start_time is not None:
+            outdated = int(np.searchsorted(cached.index, pd.Timestamp(start_time)))
+            if outdated > len(cached) - outdated:
+                self.cache.trim(symbol, tf, start_time)
+            candles = candles[candles.index >= pd.Timestamp(start_time)]
+        if end_time is not None:
+            candles = candles[candles.index <= pd.Timestamp(end_time)]
+
+        logging.debug(f"Candles {to_symbol_str(symbol)} {tf}: {len(cached)} cached, "
+                      f"{0 if fresh is None else len(fresh)} fetched")
+        return candles
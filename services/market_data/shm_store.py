@@ -0,0 +1,237 @@
+import json
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from tc.core.types import Symbol, SymbolStr, Tf
+from services.market_data.candle_cache import ROW_WIDTH, rows_to_data_frame, data_frame_to_rows, to_symbol_str, \
+    to_timestamp_ms
+
+MARKET_DATA_SHM_NAME = "tc_market_data"
+SHM_CANDLES_CAPACITY = 1000
+SHM_MAGIC = 0x7463_6D64_0001  # "tcmd" v1
+HEADER_SIZE = 64
+META_SIZE = 64 * 1024
+READ_RETRIES = 1000
+READ_SPINS = 100  # retries before every further one yields the cpu to the writer
+
+
+class SeqLockTimeout(Exception):
+    pass
+
+
+def _align(offset: int) -> int:
+    return (offset + 63) // 64 * 64
+
+
+class MarketDataStore(object):
+    """
+    Single-writer / multi-reader candles and prices store in multiprocessing.shared_memory.
+
+    Layout: header | json meta (symbols, tfs, capacity) | price seq + [price, timestamp] per symbol |
+    candle seq + closed count + open candle row + ring of closed candles per (symbol, tf).
+    Every slot is guarded by a seqlock: the writer makes seq odd while writing, readers retry
+    until they copied the slot with the same even seq before and after.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, symbols: List[str], tfs: List[str], capacity: int,
+                 is_writer: bool):
+        self.shm = shm
+        self.symbols = symbols
+        self.tfs = tfs
+        self.capacity = capacity
+        self.is_writer = is_writer
+        self.symbol_idx: Dict[str, int] = {s: i for i, s in enumerate(symbols)}
+        self.tf_idx: Dict[str, int] = {tf: i for i, tf in enumerate(tfs)}
+
+        n_symbols, n_slots = len(symbols), len(symbols) * len(tfs)
+        buf = shm.buf
+        self.header = np.ndarray((HEADER_SIZE // 8,), dtype=np.uint64, buffer=buf)
+        offset = HEADER_SIZE + META_SIZE
+        self.price_seq = np.ndarray((n_symbols,), dtype=np.uint64, buffer=buf, offset=offset)
+        offset = _align(offset + self.price_seq.nbytes)
+        self.prices = np.ndarray((n_symbols, 2), dtype=np.float64, buffer=buf, offset=offset)
+        offset = _align(offset + self.prices.nbytes)
+        self.candle_seq = np.ndarray((n_slots,), dtype=np.uint64, buffer=buf, offset=offset)
+        offset = _align(offset + self.candle_seq.nbytes)
+        self.candle_count = np.ndarray((n_slots,), dtype=np.uint64, buffer=buf, offset=offset)
+        offset = _align(offset + self.candle_count.nbytes)
+        self.open_candle = np.ndarray((n_slots, ROW_WIDTH), dtype=np.float64, buffer=buf, offset=offset)
+        offset = _align(offset + self.open_candle.nbytes)
+        self.ring = np.ndarray((n_slots, capacity, ROW_WIDTH), dtype=np.float64, buffer=buf, offset=offset)
+
+    @staticmethod
+    def get_size(n_symbols: int, n_tfs: int, capacity: int) -> int:
+        n_slots = n_symbols * n_tfs
+        size = HEADER_SIZE + META_SIZE
+        for nbytes in [n_symbols * 8, n_symbols * 16, n_slots * 8, n_slots * 8, n_slots * ROW_WIDTH * 8]:
+            size = _align(size + nbytes)
+        return size + n_slots * capacity * ROW_WIDTH * 8
+
+    @classmethod
+    def create(cls, symbols: List[Union[Symbol, SymbolStr]], tfs: List[Tf], name: str = MARKET_DATA_SHM_NAME,
+               capacity: int = SHM_CANDLES_CAPACITY) -> "MarketDataStore":
+        symbols_ = [to_symbol_str(s) for s in symbols]
+        tfs_ = [str(tf) for tf in tfs]
+        meta = json.dumps(dict(symbols=symbols_, tfs=tfs_, capacity=capacity)).encode()
+        if len(meta) > META_SIZE:
+            raise ValueError(f"Market data store meta is too large: {len(meta)} bytes")
+
+        try:  # stale segment of a previous writer
+            old = shared_memory.SharedMemory(name=name)
+            old.close()
+            old.unlink()
+        except FileNotFoundError:
+            pass
+
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.get_size(len(symbols_), len(tfs_), capacity))
+        shm.buf[HEADER_SIZE:HEADER_SIZE + len(meta)] = meta
+        store = cls(shm, symbols_, tfs_, capacity, is_writer=True)
+        store.header[2] = len(meta)
+        store.header[0] = SHM_MAGIC
+        return store
+
+    @classmethod
+    def attach(cls, name: str = MARKET_DATA_SHM_NAME) -> "MarketDataStore":
+        shm = shared_memory.SharedMemory(name=name)
+        try:  # readers must not unlink the segment on exit
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        header = np.ndarray((HEADER_SIZE // 8,), dtype=np.uint64, buffer=shm.buf)
+        if int(header[0]) != SHM_MAGIC:
+            shm.close()
+            raise FileNotFoundError(f"Market data store {name} is not initialized")
+        meta = json.loads(bytes(shm.buf[HEADER_SIZE:HEADER_SIZE + int(header[2])]).decode())
+        del header
+        return cls(shm, meta["symbols"], meta["tfs"], meta["capacity"], is_writer=False)
+
+    def close(self):
+        del self.header, self.price_seq, self.prices, self.candle_seq, self.candle_count, self.open_candle, self.ring
+        self.shm.close()
+        if self.is_writer:
+            self.shm.unlink()
+
+    @property
+    def version(self) -> int:
+        return int(self.header[1])
+
+    def slot(self, symbol: Union[Symbol, SymbolStr], tf: Tf) -> int:
+        return self.symbol_idx[to_symbol_str(symbol)] * len(self.tfs) + self.tf_idx[str(tf)]
+
+    def has(self, symbol: Union[Symbol, SymbolStr], tf: Optional[Tf] = None) -> bool:
+        return to_symbol_str(symbol) in self.symbol_idx and (tf is None or str(tf) in self.tf_idx)
+
+    # writer
+
+    def _write(self, seq: np.ndarray, i: int, fn: Callable[[], None]):
+        seq[i] += 1
+        try:
+            fn()
+        finally:
+            seq[i] += 1
+            self.header[1] += 1
+
+    def update_price(self, symbol: Union[Symbol, SymbolStr], price: float, timestamp: Optional[Any] = None):
+        i = self.symbol_idx[to_symbol_str(symbol)]
+        ts = to_timestamp_ms(timestamp) if timestamp is not None else time.time() * 1000
+
+        def write():
+            self.prices[i, 0] = price
+            self.prices[i, 1] = ts
+
+        self._write(self.price_seq, i, write)
+
+    def update_candle(self, symbol: Union[Symbol, SymbolStr], tf: Tf, candle_item: List[Any], closed: bool):
+        """
+        :param candle_item: [timestamp, o, h, l, c, v, ...] as passed to on_candle_callback
+        """
+        i = self.slot(symbol, tf)
+        row = [to_timestamp_ms(candle_item[0])] + [float(v) for v in candle_item[1:ROW_WIDTH]]
+
+        def write():
+            self.open_candle[i] = row
+            if closed:
+                count = int(self.candle_count[i])
+                if count > 0 and self.ring[i, (count - 1) % self.capacity, 0] >= row[0]:
+                    return  # already stored
+                self.ring[i, count % self.capacity] = row
+                self.candle_count[i] = count + 1
+
+        self._write(self.candle_seq, i, write)
+
+    def seed_candles(self, symbol: Union[Symbol, SymbolStr], tf: Tf, candles: pd.DataFrame):
+        i = self.slot(symbol, tf)
+        rows = data_frame_to_rows(candles.sort_index().iloc[-self.capacity:])
+
+        def write():
+            self.ring[i, :len(rows)] = rows
+            self.candle_count[i] = len(rows)
+
+        self._write(self.candle_seq, i, write)
+
+    # readers
+
+    def _read(self, seq: np.ndarray, i: int, fn: Callable[[], Any]) -> Any:
+        for attempt in range(READ_RETRIES):
+            s1 = int(seq[i])
+            if s1 % 2 == 0:
+                result = fn()
+                if int(seq[i]) == s1:
+                    return result
+            if attempt >= READ_SPINS:
+                time.sleep(0)
+        raise SeqLockTimeout(f"Slot {i} is being written for too long")
+
+    def get_price(self, symbol: Union[Symbol, SymbolStr]) -> Tuple[Optional[float], Optional[float]]:
+        """
+        :return: last price and its timestamp (ms)
+        """
+        i = self.symbol_idx[to_symbol_str(symbol)]
+        price, ts = self._read(self.price_seq, i, lambda: tuple(self.prices[i]))
+        return (price, ts) if ts > 0 else (None, None)
+
+    def get_closed_count(self, symbol: Union[Symbol, SymbolStr], tf: Tf) -> int:
+        return int(self.candle_count[self.slot(symbol, tf)])
+
+    def get_open_candle(self, symbol: Union[Symbol, SymbolStr], tf: Tf) -> Optional[np.ndarray]:
+        i = self.slot(symbol, tf)
+        row = self._read(self.candle_seq, i, lambda: self.open_candle[i].copy())
+        return row if row[0] > 0 else None
+
+    def candles_view(self, symbol: Union[Symbol, SymbolStr], tf: Tf) -> Tuple[np.ndarray, int]:
+        """
+        Zero-copy view of the ring and the number of closed candles written so far,
+        the newest candle is at (count - 1) % capacity. Not guarded by the seqlock.
+        """
+        i = self.slot(symbol, tf)
+        return self.ring[i], int(self.candle_count[i])
+
+    def read_candle_rows(self, symbol: Union[Symbol, SymbolStr], tf: Tf, n: Optional[int] = None,
+                         include_open: bool = False) -> np.ndarray:
+        """
+        :param include_open: append the open candle, read under the same seqlock as the closed ones
+        """
+        i = self.slot(symbol, tf)
+
+        def read():
+            count = int(self.candle_count[i])
+            size = min(count, self.capacity, n or self.capacity)
+            start = (count - size) % self.capacity
+            if start + size <= self.capacity:
+                rows = self.ring[i, start:start + size].copy()
+            else:
+                rows = np.concatenate([self.ring[i, start:], self.ring[i, :start + size - self.capacity]])
+            open_row = self.open_candle[i]
+            if include_open and open_row[0] > 0 and (size == 0 or open_row[0] > rows[-1, 0]):
+                rows = np.concatenate([rows[1:] if n is not None and size == n else rows, open_row[None, :]])
+            return rows
+
+        return self._read(self.candle_seq, i, read)
+
+    def get_candles(self, symbol: Union[Symbol, SymbolStr], tf: Tf, n: Optional[int] = None,
+                    include_open: bool = False) -> pd.DataFrame:
+        return rows_to_data_frame(self.read_candle_rows(symbol, tf, n, include_open))
@@ -0,0 +1,40 @@
+import os
+import pickle
+import tempfile
+from typing import Any, Dict, Optional
+
+CHECKPOINT_FILE = "./data/oracle_checkpoint.pkl"
+CHECKPOINT_INTERVAL = 60  # s
+CHECKPOINT_FORMAT_VERSION = 1
+
+
+def save_checkpoint(state: Dict[str, Any], file_name: str = CHECKPOINT_FILE):
+    """
+    Atomic write: dump to a temp file in the same directory, fsync and rename over the old checkpoint.
+    """
+    dir_name = os.path.dirname(file_name) or "."
+    os.makedirs(dir_name, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=dir_name, prefix=".checkpoint-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(dict(version=CHECKPOINT_FORMAT_VERSION, state=state), f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, file_name)
+    except Exception:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+
+def load_checkpoint(file_name: str = CHECKPOINT_FILE) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(file_name):
+        return None
+
+    with open(file_name, "rb") as f:
+        data = pickle.load(f)
+
+    if data.get("version") != CHECKPOINT_FORMAT_VERSION:
+        return None
+
+    return data["state"]
@@ -0,0 +1,210 @@
+from typing import Any, Dict, Optional, Sequence, Set
+
+import numpy as np
+import pandas as pd
+
+from services.market_data.candle_cache import to_timestamp_ms
+from tc.core.types import SymbolTf
+
+FEATURE_MAX_ROWS = 10000  # rows kept per (symbol, tf), the older half is dropped above
+FEATURE_REBUILD_ROWS = 16  # more new rows than this are computed vectorized over the whole frame
+
+# column -> (source column, window) of the rolling means
+FEATURE_WINDOWS = {
+    "dnv_mean_60": ("dnv", 60),
+    "dnv_mean_100": ("dnv", 100),
+    "range_mean_5": ("range", 5),
+    "range_mean_60": ("range", 60),
+    "atr_14": ("tr", 14),
+}
+FEATURE_COLUMNS = ["dnv", "range", "tr"] + list(FEATURE_WINDOWS.keys())
+
+
+class CandleFeatures(object):
+    """
+    Derived columns of one candle series: dnv (c * v), range (h - l), true range and their rolling means, as partial
+    windows at the start like iloc[-n:].mean(). Every appended candle computes its row from the previous rows only,
+    the candle frames themselves are never written. Reads are read-only views of the arrays.
+    """
+
+    def __init__(self, max_rows: int = FEATURE_MAX_ROWS):
+        self.max_rows = max_rows
+        self.min_rows = 0  # longest candle frame synced, never trimmed below
+        self.columns = {name: i for i, name in enumerate(FEATURE_COLUMNS)}
+        self.data = np.empty((0, len(FEATURE_COLUMNS)), dtype=np.float64)
+        self.timestamps = np.empty(0, dtype=np.int64)  # ms, open time of the candles
+        self.size = 0
+        self.last_candle: Optional[np.ndarray] = None  # [timestamp_ms, o, h, l, c, v] of the last row
+        self.prev_close = np.nan  # close before the last row, the true range of an updated last row needs it
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def limit(self) -> int:
+        return max(self.max_rows, 2 * self.min_rows)
+
+    @property
+    def last_timestamp(self) -> Optional[int]:
+        return int(self.timestamps[self.size - 1]) if self.size else None
+
+    def rebuild(self, rows: np.ndarray):
+        """
+        :param rows: [timestamp_ms, o, h, l, c, v]
+        """
+        rows = rows[-self.limit:]
+        h, l, c, v = rows[:, 2], rows[:, 3], rows[:, 4], rows[:, 5]
+        prev_c = np.concatenate([[np.nan], c[:-1]])
+        computed = dict(dnv=c * v, range=h - l,
+                        tr=np.fmax(h - l, np.fmax(np.abs(h - prev_c), np.abs(l - prev_c))))
+        for name, (source, window) in FEATURE_WINDOWS.items():
+            computed[name] = pd.Series(computed[source]).rolling(window, min_periods=1).mean().to_numpy()
+
+        self.data = np.empty((max(len(rows), 64), len(FEATURE_COLUMNS)), dtype=np.float64)
+        self.timestamps = np.empty(len(self.data), dtype=np.int64)
+        self.size = len(rows)
+        for name, i in self.columns.items():
+            self.data[:self.size, i] = computed[name]
+        self.timestamps[:self.size] = rows[:, 0]
+        self.last_candle = rows[-1].copy() if len(rows) else None
+        self.prev_close = float(prev_c[-1]) if len(rows) else np.nan
+
+    def append(self, row: Sequence[float]):
+        """
+        One candle [timestamp_ms, o, h, l, c, v] newer than the last row, or the last row updated (same timestamp).
+        """
+        row = np.asarray(row, dtype=np.float64)
+        if self.size and int(row[0]) == self.last_timestamp:
+            self.size -= 1
+        elif self.last_candle is not None:
+            self.prev_close = float(self.last_candle[4])
+        if self.size == len(self.data):
+            self.grow()
+
+        _, _, h, l, c, v = row[:6]
+        n = self.size
+        data = self.data
+        columns = self.columns
+        data[n, columns["dnv"]] = c * v
+        data[n, columns["range"]] = h - l
+        data[n, columns["tr"]] = np.fmax(h - l, np.fmax(abs(h - self.prev_close), abs(l - self.prev_close)))
+        for name, (source, window) in FEATURE_WINDOWS.items():
+            data[n, columns[name]] = data[max(n + 1 - window, 0):n + 1, columns[source]].mean()
+        self.timestamps[n] = int(row[0])
+        self.size = n + 1
+        self.last_candle = row[:6].copy()
+
+    def grow(self):
+        if self.size >= self.limit:  # drop the older half, amortized O(1) per append
+            keep = self.limit // 2
+            self.data[:keep] = self.data[self.size - keep:self.size]
+            self.timestamps[:keep] = self.timestamps[self.size - keep:self.size]
+            self.size = keep
+            return
+        capacity = min(max(2 * len(self.data), 64), self.limit)
+        data = np.empty((capacity, len(FEATURE_COLUMNS)), dtype=np.float64)
+        timestamps = np.empty(capacity, dtype=np.int64)
+        data[:self.size] = self.data[:self.size]
+        timestamps[:self.size] = self.timestamps[:self.size]
+        self.data, self.timestamps = data, timestamps
+
+    def get(self, column: str, n: Optional[int] = None) -> np.ndarray:
+        """
+        Read-only view of the last n values of the column, all by default.
+        """
+        start = max(self.size - n, 0) if n is not None else 0
+        view = self.data[start:self.size, self.columns[column]]
+        view.flags.writeable = False
+        return view
+
+    def last(self, column: str, offset: int = 1) -> float:
+        """
+        :param offset: 1 the last row, 24 the row of iloc[-24], NaN when there are fewer rows
+        """
+        if self.size < offset:
+            return np.nan
+        return float(self.data[self.size - offset, self.columns[column]])
+
+    def to_data_frame(self, n: Optional[int] = None) -> pd.DataFrame:
+        start = max(self.size - n, 0) if n is not None else 0
+        index = pd.DatetimeIndex(pd.to_datetime(self.timestamps[start:self.size], unit="ms"), name="timestamp")
+        return pd.DataFrame(self.data[start:self.size].copy(), index=index, columns=FEATURE_COLUMNS)
+
+
+def get_timestamps_ms(candles: pd.DataFrame) -> np.ndarray:
+    return candles.index.values.astype("datetime64[ms]").astype(np.int64)  # whatever the unit of the index
+
+
+def candles_to_rows(candles: pd.DataFrame) -> np.ndarray:
+    rows = np.empty((len(candles), 6), dtype=np.float64)
+    rows[:, 0] = get_timestamps_ms(candles)
+    rows[:, 1:] = candles[["o", "h", "l", "c", "v"]].to_numpy(dtype=np.float64)
+    return rows
+
+
+class FeatureStore(object):
+    """
+    CandleFeatures per (symbol, tf), kept next to the candles: extended by the closed candle callbacks, or synced
+    with a candle frame on read, which only computes the rows newer than the stored ones (none most of the time).
+    """
+
+    def __init__(self, max_rows: int = FEATURE_MAX_ROWS):
+        self.max_rows = max_rows
+        self.features: Dict[SymbolTf, CandleFeatures] = {}
+        self.dirty: Set[SymbolTf] = set()  # keys whose candles changed without a row appended
+
+    def get(self, key_: SymbolTf) -> Optional[CandleFeatures]:
+        return self.features.get(key_, None) if key_ not in self.dirty else None
+
+    def invalidate(self, key_: SymbolTf):
+        self.dirty.add(key_)
+
+    def append(self, key_: SymbolTf, row: Sequence[float]):
+        """
+        :param row: [timestamp_ms, o, h, l, c, v] of a closed candle
+        """
+        features = self.features.get(key_, None)
+        if features is None or key_ in self.dirty:
+            return  # built from the candles on the next read
+        if features.last_timestamp is not None and int(row[0]) < features.last_timestamp:
+            self.invalidate(key_)
+            return
+        features.append(row)
+
+    def append_item(self, key_: SymbolTf, candle_item: Sequence[Any]):
+        """
+        :param candle_item: [timestamp, o, h, l, c, v, ...] as passed to on_candle_callback
+        """
+        self.append(key_, [to_timestamp_ms(candle_item[0])] + [float(v) for v in candle_item[1:6]])
+
+    def sync(self, key_: SymbolTf, candles: pd.DataFrame) -> CandleFeatures:
+        """
+        Features aligned with the candles: the last len(candles) rows are those of the candles.
+        """
+        features = self.features.get(key_, None)
+        if features is None:
+            features = self.features[key_] = CandleFeatures(self.max_rows)
+        self.dirty.discard(key_)
+        features.min_rows = max(features.min_rows, len(candles))
+        if len(candles) == 0:
+            features.rebuild(np.empty((0, 6), dtype=np.float64))
+            return features
+
+        index = get_timestamps_ms(candles)
+        last_timestamp = features.last_timestamp
+        if last_timestamp is None or last_timestamp < index[0] or index[-1] < last_timestamp or \
+                (features.size < len(candles) and index[0] < features.timestamps[0]):
+            features.rebuild(candles_to_rows(candles))
+            return features
+
+        i = int(np.searchsorted(index, last_timestamp))
+        last_candle = candles.iloc[-1]
+        if i == len(index) - 1 and np.array_equal(features.last_candle[1:], [last_candle.o, last_candle.h, last_candle.l,
+                                                                             last_candle.c, last_candle.v]):
+            return features  # up to date
+        if index[i] != last_timestamp or len(index) - i > FEATURE_REBUILD_ROWS:
+            features.rebuild(candles_to_rows(candles))
+            return features
+        for row in candles_to_rows(candles.iloc[i:]):
+            features.append(row)
+        return features
@@ -0,0 +1,120 @@
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from tc.core.types import SymbolTf
+
+LEVEL_KEY_SPAN = 128.0  # > the log range of any price, keeps the log levels of every key in its own band
+
+
+class LevelIndex(Mapping):
+    """
+    Price levels per (symbol, tf) as sorted lists: O(log n) nearest/range/crossing lookups with bisect.
+    Batched queries over many keys go through one flat array of key_position * LEVEL_KEY_SPAN + log(level),
+    sorted by key and then by level, so a single np.searchsorted answers all keys; built lazily once per levels update.
+    Reads as a dict of sorted lists, the lists are shared: callers must not modify them.
+    """
+
+    def __init__(self, levels: Optional[Mapping[SymbolTf, Iterable[float]]] = None):
+        self.levels: Dict[SymbolTf, List[float]] = {}
+        self.flat: Optional[np.ndarray] = None
+        self.positions: Dict[SymbolTf, int] = {}
+        self.bounds: Optional[np.ndarray] = None  # [start, end) of every key position in flat
+        for key_, values in (levels or {}).items():
+            self[key_] = values
+
+    def __getitem__(self, key_: SymbolTf) -> List[float]:
+        return self.levels[key_]
+
+    def __setitem__(self, key_: SymbolTf, values: Iterable[float]):
+        self.levels[key_] = sorted(float(v) for v in values)
+        self.flat = None
+
+    def __iter__(self) -> Iterator[SymbolTf]:
+        return iter(self.levels)
+
+    def __len__(self) -> int:
+        return len(self.levels)
+
+    def setdefault(self, key_: SymbolTf, default: Iterable[float] = ()) -> List[float]:
+        if key_ not in self.levels:
+            self[key_] = default
+        return self.levels[key_]
+
+    def to_dict(self) -> Dict[SymbolTf, List[float]]:
+        return {key_: list(values) for key_, values in self.levels.items()}
+
+    def get_nearest(self, key_: SymbolTf, price: float) -> Tuple[Optional[float], Optional[float]]:
+        """
+        :return: nearest level above (>=) and below (<=) the price
+        """
+        levels = self.levels.get(key_, [])
+        i_up = bisect_left(levels, price)
+        i_down = bisect_right(levels, price) - 1
+        return levels[i_up] if i_up < len(levels) else None, levels[i_down] if i_down >= 0 else None
+
+    def get_range(self, key_: SymbolTf, low: float, high: float) -> List[float]:
+        """
+        Levels within [low, high].
+        """
+        levels = self.levels.get(key_, [])
+        return levels[bisect_left(levels, low):bisect_right(levels, high)]
+
+    def get_crossed(self, key_: SymbolTf, price_from: float, price_to: float) -> List[float]:
+        """
+        Levels strictly between two prices, the price went across them moving from price_from to price_to.
+        """
+        levels = self.levels.get(key_, [])
+        low, high = (price_from, price_to) if price_from <= price_to else (price_to, price_from)
+        return levels[bisect_right(levels, low):bisect_left(levels, high)]
+
+    def build_flat(self):
+        self.positions = {key_: i for i, key_ in enumerate(self.levels.keys())}
+        counts = np.fromiter((len(v) for v in self.levels.values()), dtype=np.int64, count=len(self.levels))
+        ends = np.cumsum(counts)
+        self.bounds = np.stack([ends - counts, ends], axis=1) if len(counts) else np.zeros((0, 2), dtype=np.int64)
+        values = np.fromiter((l for v in self.levels.values() for l in v), dtype=np.float64, count=int(counts.sum()))
+        keys = np.repeat(np.arange(len(counts), dtype=np.float64), counts)
+        self.flat = keys * LEVEL_KEY_SPAN + np.log(np.maximum(values, np.finfo(np.float64).tiny))
+
+    def encode(self, keys: Sequence[SymbolTf], prices: Union[Sequence[float], np.ndarray]) -> Tuple[np.ndarray,
+                                                                                                    np.ndarray]:
+        if self.flat is None:
+            self.build_flat()
+        positions = np.fromiter((self.positions[k] for k in keys), dtype=np.int64, count=len(keys))
+        prices = np.maximum(np.asarray(prices, dtype=np.float64), np.finfo(np.float64).tiny)
+        return positions, positions * LEVEL_KEY_SPAN + np.log(prices)
+
+    def get_nearest_many(self, keys: Sequence[SymbolTf],
+                         prices: Union[Sequence[float], np.ndarray]) -> List[Tuple[Optional[float], Optional[float]]]:
+        """
+        get_nearest of many keys with one searchsorted, keys must be in the index.
+        """
+        positions, encoded = self.encode(keys, prices)
+        i_up = np.searchsorted(self.flat, encoded, side="left")
+        i_down = np.searchsorted(self.flat, encoded, side="right") - 1
+        starts, ends = self.bounds[positions, 0], self.bounds[positions, 1]
+        result = []
+        for key_, up, down, start, end in zip(keys, i_up.tolist(), i_down.tolist(), starts.tolist(), ends.tolist()):
+            levels = self.levels[key_]
+            result.append((levels[up - start] if up < end else None, levels[down - start] if down >= start else None))
+        return result
+
+    def get_crossed_many(self, keys: Sequence[SymbolTf], prices_from: Union[Sequence[float], np.ndarray],
+                         prices_to: Union[Sequence[float], np.ndarray]) -> List[Tuple[SymbolTf, List[float]]]:
+        """
+        get_crossed of many keys with one searchsorted per side, only the keys with crossed levels are returned.
+        """
+        prices_from, prices_to = np.asarray(prices_from, dtype=np.float64), np.asarray(prices_to, dtype=np.float64)
+        positions, low = self.encode(keys, np.minimum(prices_from, prices_to))
+        _, high = self.encode(keys, np.maximum(prices_from, prices_to))
+        first = np.searchsorted(self.flat, low, side="right")
+        last = np.searchsorted(self.flat, high, side="left")
+        starts = self.bounds[positions, 0]
+        result = []
+        for n in np.flatnonzero(last > first).tolist():
+            key_ = keys[n]
+            start = int(starts[n])
+            result.append((key_, self.levels[key_][int(first[n]) - start:int(last[n]) - start]))
+        return result
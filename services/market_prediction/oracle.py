@@ -1,50 +1,83 @@
 import asyncio
 import logging
+import math
+import time
+from contextlib import nullcontext
 from datetime import datetime
 from enum import Enum
-from typing import Any, Callable, Dict, List, Tuple, Union, Optional
+from typing import Any, Callable, Dict, List, Union, Optional
 
 import pandas as pd
 
 from tc.core.db import TimesScaleDb
 import cachetools.func
 from tc.core.providers import TimescaleDataProvider
+from services.market_data import CandleCache, CachedDataProvider, MarketDataStore, SeqLockTimeout
+from services.market_prediction.checkpoint import save_checkpoint, load_checkpoint, CHECKPOINT_FILE, \
+    CHECKPOINT_INTERVAL
 from tc.config import Config, ZMQ_ARBITRAGE_BOT_PORT, CMD_ARBITRAGE_SPREADS
 from tc.core.base import CoreBase
 from tc.core.exchange.binance.public import PublicBinance
 from tc.core.exchange.common.mappers import binance_to_symbol, symbol_to_binance
 from tc.core.types import Symbol, SymbolTf, Tf, TaLevels
 from tc.core.utils.logs import setup_logger, add_traceback
+from services.market_prediction.signal_dedup import SignalDedup
+from services.market_prediction.level_index import LevelIndex
+from services.market_prediction.features import CandleFeatures, FeatureStore
+from services.metrics import REGISTRY, counter, gauge, histogram
+from services.tracing import TRACER
 import zmq
 import zmq.asyncio
 
 
+CHECK_SIGNALS = histogram("oracle_check_signals_seconds", "check_signals pass over all symbol/tfs")
+SIGNALS = counter("oracle_signals", "Signals fired", ["type"])
+SIGNAL_LATENCY = histogram("oracle_signal_latency_seconds", "Last market store price update to signal", ["type"])
+DONE_SIGNALS = gauge("oracle_done_signals", "Fired signals suppressed until re-armed")
+SIGNAL_CALLBACK = histogram("oracle_signal_callback_seconds", "Signal callback (delivery) duration", ["type"])
+
+
 class SignalCallbackType(Enum):
     VOLUME_LEVEL = "VOLUME_LEVEL"
     PRICE_LEVEL = "PRICE_LEVEL"
 
 
+def get_price_level_symbol(signal_key: Any) -> Optional[Symbol]:
+    return signal_key[0][0] if signal_key[2] == SignalCallbackType.PRICE_LEVEL else None
+
+
 class MarketPredictionOracle(object):
-    def __init__(self, config: Config, signal_callback: Optional[Callable] = None):
+    def __init__(self, config: Config, signal_callback: Optional[Callable] = None,
+                 market_store_name: Optional[str] = None):
         self.db = TimesScaleDb(**config.get_timescale_db_params())
+        self.candle_cache = CandleCache()
 
         self.api_client = PublicBinance(on_candle_callback=self.callback_candle,
-                                        data_provider=TimescaleDataProvider(db=self.db))
+                                        data_provider=CachedDataProvider(TimescaleDataProvider(db=self.db),
+                                                                         self.candle_cache))
         self.dnv_levels: Dict[SymbolTf, Optional[float]] = {}
-        self.price_levels: Dict[SymbolTf, List[float]] = {}
+        self.price_levels = LevelIndex()
+        self.features = FeatureStore()  # derived candle columns (dnv, ranges, ATR), see get_features
         self.symbols: List[Symbol] = []
         self.tfs: List[Tf] = []
         self.symbol_tfs: List[SymbolTf] = []
         self.signal_callback = signal_callback
         self.config = config
-        self.done_signals: Dict[
-            Tuple[SymbolTf, Union[float, None], SignalCallbackType], bool
-        ] = {}
+        # keys: (SymbolTf, level or None, SignalCallbackType), price level keys grouped by symbol
+        self.done_signals = SignalDedup(group_of=get_price_level_symbol)
+        REGISTRY.register_collector(self.done_signals.metrics.collect)
         self.initialized = False
         self.logger = setup_logger(name="oracle")
         self.mark_prices_: Dict[Symbol, float] = {}  # PREV
         self.update_levels_flag: bool = False
         self.arbitrage_spreads: pd.DataFrame = pd.DataFrame()
+        self.data_version: int = 0
+        self.stale: bool = False  # serving data restored from checkpoint
+        self.price_precisions: Dict[Symbol, int] = {}  # restored from checkpoint, symbol_info before init
+        self.checkpoint_file = CHECKPOINT_FILE
+        self.market_store_name = market_store_name
+        self.market_store: Optional[MarketDataStore] = None  # filled by the data collector
+        self.market_store_counts: Dict[SymbolTf, int] = {}
 
     async def init_symbols(self):
         symbol_status = await self.db.get_symbol_status(active=True)
@@ -52,11 +85,12 @@ class MarketPredictionOracle(object):
         self.tfs: List[Tf] = [Tf(tf) for tf in self.config.ORACLE_TFS]
         # self.price_levels
         # self.dnv_levels
+        self.symbol_tfs = []
         for tf in self.tfs:
             for s in self.symbols:
                 self.symbol_tfs.append((s, tf))
-                self.price_levels[(s, tf)] = []
-                self.dnv_levels[(s, tf)] = None
+                self.price_levels.setdefault((s, tf), [])  # keep levels restored from checkpoint
+                self.dnv_levels.setdefault((s, tf), None)
 
     async def init_ws_subscriptions(self):
         feeds = [f"kline_{tf}" for tf in self.tfs]
@@ -73,22 +107,102 @@ class MarketPredictionOracle(object):
         #         callback=self.callback_candle,
         #     )
 
+    async def attach_market_store(self):
+        while self.market_store is None:
+            try:
+                self.market_store = MarketDataStore.attach(self.market_store_name)
+            except FileNotFoundError:
+                self.logger.info(f"Wait for market data store {self.market_store_name}...")
+                await asyncio.sleep(5)
+
+        self.market_store_counts = {(s, tf): self.market_store.get_closed_count(s, tf)
+                                    for s, tf in self.symbol_tfs if self.market_store.has(s, tf)}
+        self.logger.info(f"Market data store attached: {len(self.market_store_counts)} symbol/tfs")
+
+    async def poll_market_store(self):
+        for key_, count_ in self.market_store_counts.items():
+            count = self.market_store.get_closed_count(*key_)
+            if count > count_:
+                try:
+                    rows = self.market_store.read_candle_rows(*key_, n=1)
+                except SeqLockTimeout as e:
+                    self.logger.warning(f"{key_}: {e}, retry on the next poll")
+                    continue
+                self.market_store_counts[key_] = count
+                candle_item = [pd.to_datetime(int(rows[-1, 0]), unit="ms").to_pydatetime()] + list(rows[-1, 1:])
+                await self.callback_candle(key_[0], key_[1], True, candle_item)
+
     async def init(self):
         try:
             await self.db.init()
             await self.init_symbols()
 
-            await self.api_client.async_init()
-            self.mark_prices_ = self.api_client.mark_prices
-            await self.api_client.wait_for_connection()
-            await self.init_ws_subscriptions()
+            if self.market_store_name is not None:  # candles and prices come from the collector, no REST history
+                await self.attach_market_store()
+                self.mark_prices_ = {s: self.get_mark_price(s) for s in self.symbols}
+            else:
+                await self.api_client.async_init()
+                self.mark_prices_ = self.api_client.mark_prices
+                await self.api_client.wait_for_connection()
+                await self.init_ws_subscriptions()
             await self.init_oracle_data()
             CoreBase.get_loop().create_task(self.arbitrage_zmq_loop())
+            CoreBase.get_loop().create_task(self.checkpoint_loop())
             self.initialized = True
+            self.stale = False
             self.logger.info("Oracle initialized.")
         except Exception as ex:
             self.logger.error(add_traceback(ex))
 
+    def get_state(self) -> Dict[str, Any]:
+        return dict(symbols=self.symbols, tfs=self.tfs, symbol_tfs=self.symbol_tfs, dnv_levels=self.dnv_levels,
+                    price_levels=self.price_levels.to_dict(), mark_prices=dict(self.mark_prices_),
+                    arbitrage_spreads=self.arbitrage_spreads, done_signals=self.done_signals.get_state(),
+                    price_precisions={s: self.get_price_precision(s) for s in self.symbols})
+
+    def restore_checkpoint(self) -> bool:
+        try:
+            state = load_checkpoint(self.checkpoint_file)
+        except Exception as e:
+            self.logger.warning(f"Oracle checkpoint not restored: {add_traceback(e)}")
+            return False
+
+        if state is None or self.initialized:
+            return False
+
+        self.symbols = state["symbols"]
+        self.tfs = state["tfs"]
+        self.symbol_tfs = state["symbol_tfs"]
+        self.dnv_levels = state["dnv_levels"]
+        self.price_levels = LevelIndex(state["price_levels"])
+        self.mark_prices_ = state["mark_prices"]
+        self.arbitrage_spreads = state["arbitrage_spreads"]
+        self.done_signals.set_state(state["done_signals"])
+        self.price_precisions = state.get("price_precisions", {})
+        self.data_version += 1
+        self.stale = True
+        self.logger.info(f"Oracle state restored from checkpoint: {len(self.symbol_tfs)} symbol/tfs")
+        return True
+
+    @property
+    def serving_checkpoint(self) -> bool:
+        """
+        Reads fall back to the restored state and the candle cache until init completes.
+        """
+        return self.stale and not self.initialized
+
+    def save_checkpoint(self):
+        save_checkpoint(self.get_state(), self.checkpoint_file)
+
+    async def checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(CHECKPOINT_INTERVAL)
+            try:
+                if self.initialized:
+                    self.save_checkpoint()
+            except Exception as e:
+                self.logger.error(add_traceback(e))
+
     async def init_oracle_data(self):
         try:
             self.logger.info("Initialize signals")
@@ -113,62 +227,143 @@ class MarketPredictionOracle(object):
             if l['level_type'] == TaLevels.Price.value:
                 new_price_levels[(symbol, tf)].append(l['level_value'])
 
-        self.price_levels = new_price_levels
+        self.price_levels = LevelIndex(new_price_levels)
+        self.data_version += 1
 
     async def callback_candle(self, symbol: Symbol, tf: Tf, candle_closed: bool, *args, **kwargs):
+        if not candle_closed or len(args) == 0:
+            self.features.invalidate((symbol, tf))  # the open candle of the api_client frames changed
         if candle_closed:
             self.logger.info(f"Callback: {symbol}-{tf}")
+            if len(args) > 0:
+                self.candle_cache.append_item(symbol, tf, args[0])
+                self.features.append_item((symbol, tf), args[0])
             self.update_levels_flag = True
+            self.data_version += 1
             # await self.update_levels()
 
+    def get_candles(self, symbol: Symbol, tf: Tf) -> pd.DataFrame:
+        if self.market_store is not None and self.market_store.has(symbol, tf):
+            try:  # closed candles and the open one, as the api client frames
+                return self.market_store.get_candles(symbol, tf, include_open=True)
+            except SeqLockTimeout as e:
+                self.logger.warning(f"{symbol} {tf}: {e}, closed candles from the candle cache")
+        if self.serving_checkpoint or self.market_store is not None:
+            return self.candle_cache.load(symbol, tf)
+        return self.api_client.candles[symbol][tf]
+
+    def get_features(self, symbol: Symbol, tf: Tf, candles: Optional[pd.DataFrame] = None) -> CandleFeatures:
+        """
+        Derived columns of the candles, computed once per appended candle; read them with get/last, never write.
+        :param candles: get_candles result already at hand, the features are then aligned with its rows
+        """
+        key_ = (symbol, tf)
+        # the open candle of the market store changes without a callback, only a sync picks it up
+        features = self.features.get(key_) if candles is None and self.market_store is None else None
+        if features is None:
+            features = self.features.sync(key_, candles if candles is not None else self.get_candles(symbol, tf))
+        return features
+
+    def get_mark_price(self, symbol: Symbol) -> Optional[float]:
+        if self.market_store is not None and self.market_store.has(symbol):
+            try:
+                return self.market_store.get_price(symbol)[0]
+            except SeqLockTimeout as e:
+                self.logger.warning(f"{symbol}: {e}, last known price")
+        if self.serving_checkpoint or self.market_store is not None:
+            return self.mark_prices_.get(symbol, None)
+        return self.api_client.get_mark_price(symbol)
+
+    def get_dnv(self, symbol: Symbol, tf: Tf) -> Optional[float]:
+        if self.market_store is not None and self.market_store.has(symbol, tf):
+            try:
+                row = self.market_store.get_open_candle(symbol, tf)
+                return float(row[4] * row[5]) if row is not None else None
+            except SeqLockTimeout as e:
+                self.logger.warning(f"{symbol} {tf}: {e}, dnv of the last cached candle")
+        if self.serving_checkpoint or self.market_store is not None:  # the last cached candle
+            rows = self.candle_cache.read(symbol, tf)
+            return float(rows[-1, 4] * rows[-1, 5]) if len(rows) > 0 else None
+        return self.api_client.get_dnv(symbol, tf)
+
+    def get_price_precision(self, symbol: Symbol) -> int:
+        symbol_info = getattr(self.api_client, "symbol_info", None) or {}
+        if symbol in symbol_info:
+            return symbol_info[symbol].price_precision
+        return self.price_precisions.get(symbol, 8)
+
     def update_mark_price(self, symbol: Symbol):
-        price_ = self.mark_prices_[symbol]
-        price = self.api_client.get_mark_price(symbol)
+        price_ = self.mark_prices_.get(symbol, None)
+        price = self.get_mark_price(symbol)
         self.mark_prices_[symbol] = price
         return price_, price
 
+    async def send_signal(self, level_key: SymbolTf, signal_type: SignalCallbackType, level: float):
+        SIGNALS.labels(signal_type.value).inc()
+        symbol = level_key[0]
+        trace = None
+        if self.market_store is not None and self.market_store.has(symbol):
+            try:
+                timestamp = self.market_store.get_price(symbol)[1]
+            except SeqLockTimeout:
+                timestamp = None
+            if timestamp is not None:  # the trade that moved the price is the origin of the signal
+                SIGNAL_LATENCY.labels(signal_type.value).observe(time.time() - timestamp / 1000)
+                trace = TRACER.new_context(timestamp / 1000)
+                TRACER.record("signal", trace, type=signal_type.value)
+        if self.signal_callback is not None:
+            delivered = TRACER.span("signal_delivered", trace, type=signal_type.value) if trace is not None \
+                else nullcontext()
+            with SIGNAL_CALLBACK.labels(signal_type.value).time(), delivered:
+                await self.signal_callback(level_key, signal_type, level=level)
+
     async def check_signals(self):
+        check_start = time.perf_counter()
         try:
+            moves = {s: self.update_mark_price(s) for s in self.symbols}  # one price move per symbol and pass
+            for symbol, (price_, price) in moves.items():
+                if price is not None and price != price_:  # only a moved price can re-arm a level of the symbol
+                    for signal_key in self.done_signals.group_keys(symbol):
+                        self.done_signals.rearm(signal_key, price)
+
+            moved = [key_ for key_ in self.symbol_tfs if key_ in self.price_levels
+                     and None not in moves[key_[0]] and moves[key_[0]][0] != moves[key_[0]][1]]
+            crossed = self.price_levels.get_crossed_many(moved, [moves[k[0]][0] for k in moved],
+                                                         [moves[k[0]][1] for k in moved]) if moved else []
+            for level_key, levels in crossed:
+                price = moves[level_key[0]][1]
+                for pl in levels:
+                    signal_key = (level_key, pl, SignalCallbackType.PRICE_LEVEL)
+                    if self.done_signals.is_armed(signal_key):
+                        await self.send_signal(level_key, SignalCallbackType.PRICE_LEVEL, pl)
+                        self.done_signals.fire(signal_key, level=pl, side=1 if price > pl else -1)
+
             for symbol, tf in self.symbol_tfs:
-                current_dnv = self.api_client.get_dnv(symbol, tf)
+                current_dnv = self.get_dnv(symbol, tf)
 
                 level_key = (symbol, tf)
                 current_level = self.dnv_levels.get(level_key, None)
 
-                for pl in self.price_levels[level_key]:
-                    price_, price = self.update_mark_price(symbol)
-
-                    if price is not None:
-                        signal_key = (level_key, pl, SignalCallbackType.PRICE_LEVEL)
-                        if (price_ < pl < price) or (price_ > pl > price):
-                            if not self.done_signals.get(signal_key, False):
-                                if self.signal_callback is not None:
-                                    await self.signal_callback(
-                                        level_key, SignalCallbackType.PRICE_LEVEL, level=pl
-                                    )
-                                self.done_signals.setdefault(signal_key, True)
-                                # TODO: CLEAN DONE SIGNALS FOR PRICE LEVEL
-
                 if current_dnv is not None and current_level is not None:
                     signal_key = (level_key, None, SignalCallbackType.VOLUME_LEVEL)
 
                     if current_dnv >= current_level:
-                        if not self.done_signals.get(signal_key, False):
-                            if self.signal_callback is not None:
-                                await self.signal_callback(
-                                    level_key,
-                                    SignalCallbackType.VOLUME_LEVEL,
-                                    level=current_level,
-                                )
-                            self.done_signals.setdefault(signal_key, True)
+                        if self.done_signals.is_armed(signal_key):
+                            await self.send_signal(level_key, SignalCallbackType.VOLUME_LEVEL, current_level)
+                            self.done_signals.fire(signal_key, ttl=math.inf)  # until the volume drops
                     else:
-                        self.done_signals.pop(signal_key, None)
+                        self.done_signals.discard(signal_key)
+            self.done_signals.expire()
+            DONE_SIGNALS.set(len(self.done_signals))
         except Exception as e:
             logging.error(add_traceback(e))
+        CHECK_SIGNALS.observe(time.perf_counter() - check_start)
 
     async def update_loop(self):
         while True:
             if self.initialized:
+                if self.market_store is not None:
+                    await self.poll_market_store()
                 if self.update_levels_flag:
                     await self.update_levels()
                     self.update_levels_flag = False
@@ -194,10 +389,8 @@ class MarketPredictionOracle(object):
     def get_summary_by_symbol(self, symbol: Symbol) -> Dict[Union[Tf, str], Union[float, Dict[str, Any]]]:
         result: Dict[Union[Tf, str], Union[float, Dict[str, Any]]] = {}
         for tf in self.tfs:
-            candles = self.api_client.candles[symbol][tf]
-            candles["dnv"] = candles.c * candles.v
-            dnv_avg100 = candles["dnv"].iloc[-100:].mean()
-            dnv_current = self.api_client.candle_dnv.get(symbol, {}).get(tf, None)
+            dnv_avg100 = self.get_features(symbol, tf).last("dnv_mean_100")
+            dnv_current = self.get_dnv(symbol, tf)
             key_ = (symbol, tf)
             dnv_level = self.dnv_levels[key_]
             dnv_diff = 0
@@ -212,10 +405,8 @@ class MarketPredictionOracle(object):
                 dnv_diff=dnv_diff,
                 price_levels=price_levels,
             )
-        last_1d = self.api_client.candles[symbol][Tf("1d")].iloc[-1]
-        last_24h = self.api_client.candles[symbol][Tf("1h")].iloc[-24]
-        atr_last = float(last_1d.h - last_1d.l)
-        atr_24 = float(last_24h.h.mean() - last_24h.l.mean())
+        atr_last = self.get_features(symbol, Tf("1d")).last("range")
+        atr_24 = self.get_features(symbol, Tf("1h")).last("range", 24)
         result["atr"] = {"last": atr_last, "24h": atr_24}
         return result
 
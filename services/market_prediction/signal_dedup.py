@@ -0,0 +1,160 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+SIGNAL_DEDUP_TTL = 4 * 60 * 60  # s a fired signal stays suppressed
+SIGNAL_DEDUP_MAX_SIZE = 100000
+SIGNAL_REARM_BAND = 0.002  # part of the level the price has to move back past the level to re-arm
+SIGNAL_DEDUP_METRICS = dict(fired="Signals fired and suppressed", rearmed="Suppressed signals re-armed",
+                            expired="Suppressed signals armed again by their TTL",
+                            evicted="Suppressed signals dropped above the size limit")
+
+# key -> (expires at, level, side of the crossing: 1 up, -1 down, 0 none, ttl)
+Entry = Tuple[float, Optional[float], int, float]
+
+
+class SignalDedupMetrics(object):
+    def __init__(self):
+        self.fired = 0
+        self.rearmed = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(fired=self.fired, rearmed=self.rearmed, expired=self.expired, evicted=self.evicted)
+
+    def collect(self):
+        for name, value in self.as_dict().items():
+            yield f"signal_dedup_{name}_total", "counter", SIGNAL_DEDUP_METRICS[name], (), value
+
+
+class SignalDedup(object):
+    """
+    Fired signals suppressed until re-armed: the TTL of the key passed, the price moved back across the level by more
+    than the hysteresis band, or the key is discarded (volume dropped below its level).
+    fired keeps the keys in fire order; one more OrderedDict per ttl value is in expiry order too, so the sweep only
+    looks at the expired heads. Above max_size the key closest to expiry is evicted, keys without a TTL (held until
+    discarded) only once no other is left. Every operation is O(1) (the sweep
+    amortized) and the memory is bounded whatever the uptime.
+    group_of maps a key to its group (e.g. the symbol of a price level) or None, group_keys lists the fired keys
+    of one group without a scan of all of them.
+    """
+
+    def __init__(self, ttl: Optional[float] = SIGNAL_DEDUP_TTL, max_size: int = SIGNAL_DEDUP_MAX_SIZE,
+                 band: float = SIGNAL_REARM_BAND, group_of: Optional[Callable[[Hashable], Hashable]] = None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.band = band
+        self.group_of = group_of
+        self.fired: "OrderedDict[Hashable, Entry]" = OrderedDict()
+        self.expiry: Dict[float, "OrderedDict[Hashable, None]"] = {}  # ttl -> keys
+        self.groups: Dict[Hashable, Dict[Hashable, None]] = {}  # group -> keys
+        self.metrics = SignalDedupMetrics()
+
+    def __len__(self) -> int:
+        return len(self.fired)
+
+    def keys(self) -> List[Hashable]:
+        return list(self.fired)
+
+    def group_keys(self, group: Hashable) -> List[Hashable]:
+        return list(self.groups.get(group, ()))
+
+    def add(self, key: Hashable, entry: Entry):
+        self.fired[key] = entry
+        self.expiry.setdefault(entry[3], OrderedDict())[key] = None
+        group = self.group_of(key) if self.group_of is not None else None
+        if group is not None:
+            self.groups.setdefault(group, {})[key] = None
+
+    def is_armed(self, key: Hashable, now: Optional[float] = None) -> bool:
+        entry = self.fired.get(key, None)
+        if entry is None:
+            return True
+        if entry[0] <= (now if now is not None else time.time()):
+            self.remove(key)
+            self.metrics.expired += 1
+            return True
+        return False
+
+    def remove(self, key: Hashable) -> Optional[Entry]:
+        entry = self.fired.pop(key, None)
+        if entry is not None:
+            del self.expiry[entry[3]][key]
+            group = self.group_of(key) if self.group_of is not None else None
+            if group is not None:
+                keys = self.groups[group]
+                del keys[key]
+                if not keys:
+                    del self.groups[group]
+        return entry
+
+    def fire(self, key: Hashable, level: Optional[float] = None, side: int = 0, ttl: Optional[float] = None,
+             now: Optional[float] = None):
+        """
+        :param ttl: of this key, the store ttl by default, None on both means until re-armed
+        """
+        ttl = ttl if ttl is not None else self.ttl
+        ttl = ttl if ttl is not None else float("inf")
+        self.remove(key)
+        self.add(key, ((now if now is not None else time.time()) + ttl, level, side, ttl))
+        self.metrics.fired += 1
+        while len(self.fired) > self.max_size:
+            self.evict()
+            self.metrics.evicted += 1
+
+    def evict(self):
+        heads = [next(iter(keys)) for ttl, keys in self.expiry.items() if keys and ttl != float("inf")]
+        self.remove(min(heads, key=lambda k: self.fired[k][0]) if heads else next(iter(self.fired)))
+
+    def rearm(self, key: Hashable, price: float) -> bool:
+        """
+        Hysteresis: a level crossed upwards is armed again once the price is back below level * (1 - band),
+        a level crossed downwards once above level * (1 + band).
+        """
+        entry = self.fired.get(key, None)
+        if entry is None or entry[1] is None or entry[2] == 0:
+            return False
+        _, level, side, _ = entry
+        if (side > 0 and price < level * (1 - self.band)) or (side < 0 and price > level * (1 + self.band)):
+            self.remove(key)
+            self.metrics.rearmed += 1
+            return True
+        return False
+
+    def discard(self, key: Hashable):
+        if self.remove(key) is not None:
+            self.metrics.rearmed += 1
+
+    def expire(self, now: Optional[float] = None) -> int:
+        now = now if now is not None else time.time()
+        count = 0
+        for keys in self.expiry.values():
+            while keys:
+                key = next(iter(keys))
+                if self.fired[key][0] > now:
+                    break
+                self.remove(key)
+                count += 1
+        self.metrics.expired += count
+        return count
+
+    def get_state(self) -> List[Tuple[Hashable, Entry]]:
+        return list(self.fired.items())
+
+    def set_state(self, state: Any, now: Optional[float] = None):
+        """
+        :param state: get_state() result, or the done_signals dict of older checkpoints (fired now, without level)
+        """
+        self.fired.clear()
+        self.expiry.clear()
+        self.groups.clear()
+        if isinstance(state, dict):
+            for key in state.keys():
+                self.fire(key, now=now)
+            return
+        for key, entry in state:  # in fire order, so the expiry queues stay sorted
+            self.add(key, entry)
+        self.expire(now)
+        while len(self.fired) > self.max_size:
+            self.evict()
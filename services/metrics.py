@@ -0,0 +1,302 @@
+import ipaddress
+import logging
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Labels, float]  # name suffix, labels, value
+
+
+def escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{escape_label(v)}"' for k, v in labels) + "}"
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class ThreadCells(object):
+    """
+    One accumulator list per thread: writers only touch their own cell, so no lock on the hot path
+    (list item updates are atomic under the GIL); readers sum the cells of all threads.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.local = threading.local()
+        self.cells: List[List[float]] = []
+        self.lock = threading.Lock()
+
+    def get(self) -> List[float]:
+        cell = getattr(self.local, "cell", None)
+        if cell is None:
+            cell = self.local.cell = [0.0] * self.size
+            with self.lock:
+                self.cells.append(cell)
+        return cell
+
+    def sum(self) -> List[float]:
+        with self.lock:
+            cells = list(self.cells)
+        return [sum(c[i] for c in cells) for i in range(self.size)]
+
+
+class Metric(ABC):
+    type_name = "untyped"
+    family_suffix = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (), labels: Labels = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.label_values = labels
+        self.children: Dict[Tuple[str, ...], "Metric"] = {}
+        self.children_lock = threading.Lock()
+
+    def new_child(self, labels: Labels) -> "Metric":
+        return type(self)(self.name, self.documentation, labels=labels)
+
+    def labels(self, *values: str, **kwargs: str) -> "Metric":
+        key = values or tuple(kwargs[n] for n in self.label_names)
+        child = self.children.get(key, None)
+        if child is None:
+            with self.children_lock:
+                child = self.children.get(key, None)
+                if child is None:
+                    child = self.children[key] = self.new_child(tuple(zip(self.label_names, map(str, key))))
+        return child
+
+    def samples(self) -> List[Sample]:
+        if self.label_names:
+            return [s for child in list(self.children.values()) for s in child.samples()]
+        return self.own_samples()
+
+    @abstractmethod
+    def own_samples(self) -> List[Sample]:
+        pass
+
+
+class Counter(Metric):
+    type_name = "counter"
+    family_suffix = "_total"
+
+    def __init__(self, *args, **kwargs):
+        super(Counter, self).__init__(*args, **kwargs)
+        self.cells = ThreadCells(1)
+
+    def inc(self, value: float = 1.0):
+        self.cells.get()[0] += value
+
+    def get(self) -> float:
+        return self.cells.sum()[0]
+
+    def own_samples(self) -> List[Sample]:
+        return [("_total", self.label_values, self.get())]
+
+
+class Gauge(Metric):
+    """
+    Last written value; set_function makes it computed at scrape time.
+    """
+    type_name = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super(Gauge, self).__init__(*args, **kwargs)
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, value: float = 1.0):
+        self.value += value
+
+    def dec(self, value: float = 1.0):
+        self.value -= value
+
+    def set_function(self, function: Callable[[], float]):
+        self.function = function
+
+    def get(self) -> float:
+        return float(self.function()) if self.function is not None else self.value
+
+    def own_samples(self) -> List[Sample]:
+        return [("", self.label_values, self.get())]
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (), labels: Labels = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, label_names, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.cells = ThreadCells(len(self.buckets) + 2)  # bucket counts, sum, count
+
+    def new_child(self, labels: Labels) -> "Histogram":
+        return Histogram(self.name, self.documentation, labels=labels, buckets=self.buckets[:-1])
+
+    def observe(self, value: float):
+        cell = self.cells.get()
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def time(self) -> "Timer":
+        return Timer(self)
+
+    def own_samples(self) -> List[Sample]:
+        values = self.cells.sum()
+        samples, cumulative = [], 0.0
+        for bound, count in zip(self.buckets, values):
+            cumulative += count
+            samples.append(("_bucket", self.label_values + (("le", format_value(bound)),), cumulative))
+        samples.append(("_sum", self.label_values, values[-2]))
+        samples.append(("_count", self.label_values, values[-1]))
+        return samples
+
+
+class Timer(object):
+    """
+    with histogram.time(): ...
+    """
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.collectors: List[Callable[[], Iterable[Tuple[str, str, str, Labels, float]]]] = []
+        self.lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self.lock:
+            existing = self.metrics.get(metric.name, None)
+            if existing is not None:  # modules imported in several services share the metric
+                return existing
+            self.metrics[metric.name] = metric
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, Labels, float]]]):
+        """
+        :param collector: called on every scrape, yields (name, type, help, labels, value) of existing stats objects
+        """
+        self.collectors.append(collector)
+
+    def generate_text(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            family = metric.name + metric.family_suffix
+            lines.append(f"# HELP {family} {metric.documentation}")
+            lines.append(f"# TYPE {family} {metric.type_name}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{format_labels(labels)} {format_value(value)}")
+
+        described = set()
+        for collector in self.collectors:
+            try:
+                for name, type_name, documentation, labels, value in collector():
+                    if name not in described:
+                        described.add(name)
+                        lines.append(f"# HELP {name} {documentation}")
+                        lines.append(f"# TYPE {name} {type_name}")
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+            except Exception as e:
+                logging.error(f"Metrics collector failed: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, label_names))
+
+
+def gauge(name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, label_names))
+
+
+def histogram(name: str, documentation: str, label_names: Sequence[str] = (),
+              buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, label_names, buckets=buckets))
+
+
+# (method, path) -> (content type, body), extra pages of the exporter, POST ones only for loopback clients
+EXPORTER_ROUTES: Dict[Tuple[str, str], Tuple[str, Callable[[], bytes]]] = {
+    ("GET", "/metrics"): (METRICS_CONTENT_TYPE, lambda: REGISTRY.generate_text().encode()),
+}
+
+
+def add_exporter_route(path: str, content_type: str, body: Callable[[], bytes], method: str = "GET"):
+    EXPORTER_ROUTES[(method, path)] = (content_type, body)
+
+
+def is_loopback(host: Optional[str]) -> bool:
+    try:
+        return host is not None and ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.respond("GET")
+
+    def do_POST(self):
+        if not is_loopback(self.client_address[0]):
+            self.send_error(403)
+            return
+        self.respond("POST")
+
+    def respond(self, method: str):
+        route = EXPORTER_ROUTES.get((method, self.path.split("?")[0]), None)
+        if route is None:
+            self.send_error(404)
+            return
+        content_type, get_body = route
+        body = get_body()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_http_exporter(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    /metrics of this process REGISTRY on a daemon thread, for services without the FastAPI app.
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+    logging.info(f"Metrics exporter on :{port}/metrics")
+    return server
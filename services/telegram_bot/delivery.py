@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Set, Tuple
+
+from telegram import Bot, constants
+from telegram.error import Forbidden, BadRequest, RetryAfter, TelegramError
+
+from tc.core.utils.logs import add_traceback
+
+DELIVERY_WORKERS = 8
+DELIVERY_QUEUE_SIZE = 10000
+GLOBAL_RATE_LIMIT = 25  # msg/s, telegram allows ~30 msg/s per bot
+CHAT_INTERVAL = 1.0  # s, telegram allows ~1 msg/s per chat
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0  # s, doubled every attempt
+RETRY_BACKOFF_MAX = 30.0
+
+
+class RateLimiter(object):
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.next_time = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            now_ = time.monotonic()
+            wait = self.next_time - now_
+            self.next_time = max(now_, self.next_time) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, delay: float):
+        """
+        No acquire returns before delay from now, the next ones are spaced by the interval again after it.
+        """
+        self.next_time = max(self.next_time, time.monotonic() + delay)
+
+
+class SignalDelivery(object):
+    def __init__(self, bot: Bot, workers: int = DELIVERY_WORKERS, queue_size: int = DELIVERY_QUEUE_SIZE,
+                 global_rate: float = GLOBAL_RATE_LIMIT, chat_interval: float = CHAT_INTERVAL,
+                 max_retries: int = MAX_RETRIES):
+        self.bot = bot
+        self.workers_count = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.global_limiter = RateLimiter(global_rate)
+        self.chat_interval = chat_interval
+        self.chat_next_time: Dict[int, float] = {}
+        self.max_retries = max_retries
+        self.workers: List[asyncio.Task] = []
+        self.retries: Set[asyncio.Task] = set()  # pending requeues, referenced until done
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def start(self):
+        if not self.workers:
+            self.workers = [asyncio.create_task(self.worker()) for _ in range(self.workers_count)]
+
+    async def stop(self):
+        tasks = self.workers + list(self.retries)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.workers = []
+        self.retries.clear()
+
+    def enqueue(self, chat_id: int, text: str) -> bool:
+        try:
+            self.queue.put_nowait((chat_id, text, 0))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logging.warning(f"Delivery queue is full, message to {chat_id} dropped")
+            return False
+
+    def enqueue_many(self, chat_ids: List[int], text: str):
+        for chat_id in chat_ids:
+            self.enqueue(chat_id, text)
+
+    async def wait_for_chat(self, chat_id: int):
+        now_ = time.monotonic()
+        next_time = self.chat_next_time.get(chat_id, 0.0)
+        self.chat_next_time[chat_id] = max(now_, next_time) + self.chat_interval
+        if next_time > now_:
+            await asyncio.sleep(next_time - now_)
+
+    def retry_later(self, item: Tuple[int, str, int], delay: float):
+        chat_id, text, attempt = item
+        if attempt + 1 >= self.max_retries:
+            self.failed += 1
+            logging.warning(f"Delivery to {chat_id} failed after {attempt + 1} attempts")
+            return
+
+        async def requeue():
+            await asyncio.sleep(delay)
+            await self.queue.put((chat_id, text, attempt + 1))
+
+        task = asyncio.create_task(requeue())
+        self.retries.add(task)
+        task.add_done_callback(self.retries.discard)
+
+    async def send(self, item: Tuple[int, str, int]):
+        chat_id, text, attempt = item
+        await self.wait_for_chat(chat_id)
+        await self.global_limiter.acquire()
+        try:
+            await self.bot.send_message(chat_id=chat_id, parse_mode=constants.ParseMode.HTML, text=text)
+            self.sent += 1
+        except RetryAfter as e:  # the flood wait applies to the whole bot, not only to this chat
+            self.global_limiter.pause(float(e.retry_after))
+            self.retry_later(item, float(e.retry_after))
+        except (Forbidden, BadRequest) as e:
+            self.failed += 1
+            logging.warning(f"Delivery to {chat_id} rejected: {e}")
+        except TelegramError as e:
+            self.retry_later(item, min(RETRY_BACKOFF * 2 ** attempt, RETRY_BACKOFF_MAX))
+            logging.warning(f"Delivery to {chat_id} error: {e}")
+
+    async def worker(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                await self.send(item)
+            except Exception as e:
+                logging.error(add_traceback(e))
+            finally:
+                self.queue.task_done()
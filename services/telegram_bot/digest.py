@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from tc.core.utils.logs import add_traceback
+
+SIGNAL_DIGEST_WINDOW = 3.0  # s
+SUBSCRIPTIONS_FILE = "./data/telegram_subscriptions.json"
+MESSAGE_MAX_LENGTH = 4096
+DIGEST_TEMPLATE = "🔔 <b>Signals digest</b> ({count})"
+
+# (symbol, tf, text) - symbol in binance format, e.g. BTCUSDT
+SignalItem = Tuple[str, str, str]
+
+
+def pack_lines(lines: List[str], header: Optional[str] = None, limit: int = MESSAGE_MAX_LENGTH) -> List[str]:
+    messages: List[str] = []
+    current: List[str] = [header] if header else []
+    size = len(header) if header else 0
+    for line in lines:
+        line = line[:limit]
+        if current and size + len(line) + 2 > limit:
+            messages.append("\r\n".join(current))
+            current, size = [], 0
+        size += len(line) + (2 if current else 0)
+        current.append(line)
+    if current:
+        messages.append("\r\n".join(current))
+    return messages
+
+
+def render_digest(texts: List[str]) -> List[str]:
+    if len(texts) == 1:
+        return texts
+    return pack_lines(texts, header=DIGEST_TEMPLATE.format(count=len(texts)))
+
+
+class Subscription(object):
+    """
+    None symbols or tfs match all of them, an empty set matches none (the last one unsubscribed). Muted matches
+    nothing and keeps the filter for the next /subscribe.
+    """
+
+    def __init__(self, symbols: Optional[Iterable[str]] = None, tfs: Optional[Iterable[str]] = None,
+                 muted: bool = False):
+        self.symbols: Optional[Set[str]] = {s.upper() for s in symbols} if symbols is not None else None
+        self.tfs: Optional[Set[str]] = {tf.lower() for tf in tfs} if tfs is not None else None
+        self.muted = muted
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Subscription":
+        symbols, tfs = data.get("symbols"), data.get("tfs")
+        if "muted" not in data:  # written before the muted state, an empty list was all
+            symbols, tfs = symbols or None, tfs or None
+        return cls(symbols=symbols, tfs=tfs, muted=data.get("muted", False))
+
+    def match(self, symbol: str, tf: str) -> bool:
+        return not self.muted and (self.symbols is None or symbol in self.symbols) and \
+            (self.tfs is None or tf in self.tfs)
+
+    @property
+    def is_all(self) -> bool:
+        return not self.muted and self.symbols is None and self.tfs is None
+
+    def to_dict(self):
+        return dict(symbols=sorted(self.symbols) if self.symbols is not None else None,
+                    tfs=sorted(self.tfs) if self.tfs is not None else None,
+                    muted=self.muted)
+
+
+class SubscriptionStore(object):
+    def __init__(self, file_name: str = SUBSCRIPTIONS_FILE):
+        self.file_name = file_name
+        self.items: Dict[int, Subscription] = {}
+
+    def load(self):
+        if os.path.exists(self.file_name):
+            with open(self.file_name) as f:
+                data = json.load(f)
+            self.items = {int(k): Subscription.from_dict(v) for k, v in data.items()}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.file_name) or ".", exist_ok=True)
+        tmp_name = f"{self.file_name}.tmp"
+        with open(tmp_name, "w") as f:
+            json.dump({k: v.to_dict() for k, v in self.items.items()}, f)
+        os.replace(tmp_name, self.file_name)
+
+    def get(self, user_id: int) -> Subscription:
+        return self.items.get(user_id, Subscription())
+
+    def subscribe(self, user_id: int, symbols: Iterable[str] = (), tfs: Iterable[str] = ()) -> Subscription:
+        """
+        Unmutes and adds the symbols and tfs to the filter. Without any, resets the filter to all signals.
+        """
+        symbols, tfs = list(symbols), list(tfs)
+        sub = self.items.setdefault(user_id, Subscription())
+        sub.muted = False
+        if not symbols and not tfs:
+            sub.symbols, sub.tfs = None, None
+        if symbols:
+            sub.symbols = (sub.symbols or set()) | {s.upper() for s in symbols}
+        if tfs:
+            sub.tfs = (sub.tfs or set()) | {tf.lower() for tf in tfs}
+        self.save()
+        return sub
+
+    def unsubscribe(self, user_id: int, symbols: Iterable[str] = (), tfs: Iterable[str] = ()) -> Subscription:
+        """
+        Removes the symbols and tfs from the filter, an emptied one matches nothing. Without any, mutes the user.
+        """
+        symbols, tfs = list(symbols), list(tfs)
+        sub = self.items.setdefault(user_id, Subscription())
+        if not symbols and not tfs:
+            sub.muted = True
+        if symbols and sub.symbols is not None:
+            sub.symbols.difference_update(s.upper() for s in symbols)
+        if tfs and sub.tfs is not None:
+            sub.tfs.difference_update(tf.lower() for tf in tfs)
+        self.save()
+        return sub
+
+
+class SignalCoalescer(object):
+    def __init__(self, flush_callback: Callable[[List[SignalItem]], Awaitable[None]],
+                 window: float = SIGNAL_DIGEST_WINDOW):
+        self.flush_callback = flush_callback
+        self.window = window
+        self.pending: List[SignalItem] = []
+        self.flush_task: Optional[asyncio.Task] = None
+
+    def add(self, symbol: str, tf: str, text: str):
+        self.pending.append((symbol, tf, text))
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.window)
+        items, self.pending = self.pending, []
+        self.flush_task = None
+        try:
+            await self.flush_callback(items)
+        except Exception as e:
+            logging.error(add_traceback(e))
@@ -0,0 +1,56 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from tc.core.exchange.common.mappers import symbol_to_binance
+from tc.core.types import Symbol
+from services.market_prediction import MarketPredictionOracle
+from services.telegram_bot.digest import pack_lines
+
+SUMMARY_RENDER_TTL = 10  # s, same as oracle get_summary_by_symbol cache
+STALE_HEADER = "⏳ Restored data, Oracle initialization in progress..."
+
+
+class VolumeLevelsSummary(object):
+    def __init__(self, oracle: MarketPredictionOracle):
+        self.oracle = oracle
+        self.version: Optional[Tuple[int, int, bool]] = None
+        self.messages: List[str] = []
+        self.lock = asyncio.Lock()
+
+    def current_version(self) -> Tuple[int, int, bool]:
+        return self.oracle.data_version, int(time.time() // SUMMARY_RENDER_TTL), self.oracle.stale
+
+    async def get_messages(self) -> List[str]:
+        async with self.lock:
+            version = self.current_version()
+            if version != self.version:
+                self.messages = self.render()
+                self.version = version
+
+        return self.messages
+
+    def render_symbol(self, symbol: Symbol, tfs: Dict[Union[str, Any], Any]) -> str:
+        prec = self.oracle.get_price_precision(symbol)
+        price = self.oracle.get_mark_price(symbol)
+        lines = [f"▪️ <b>{symbol_to_binance(symbol)}</b>"]
+
+        for tf, v in tfs.items():
+            if tf == "atr":
+                continue
+            up_level, down_level = self.oracle.price_levels.get_nearest((symbol, tf), price)
+            up_level = round(up_level, prec) if up_level is not None else "-"
+            down_level = round(down_level, prec) if down_level is not None else "-"
+
+            lines.append(
+                f"{' '*3}▫️ {tf} level: {round(v['dnv_level'])}/{round(v['dnv_current'])}"
+                f"({round(v['dnv_diff'])}%) avg100. {round(v['dnv_avg100'])} "
+                f"\r\n{' '*6}p.levels: [{up_level} > <code>{price}</code> > {down_level}"
+            )
+
+        return "\r\n".join(lines)
+
+    def render(self) -> List[str]:
+        summary = self.oracle.get_summary()
+        return pack_lines([self.render_symbol(symbol, tfs) for symbol, tfs in summary.items()],
+                          header=STALE_HEADER if self.oracle.stale else None)
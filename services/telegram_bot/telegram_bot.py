@@ -23,8 +23,12 @@ from tc.core.types import SymbolTf
 from tc.core.utils.logs import add_traceback
 from services.market_prediction import MarketPredictionOracle, SignalCallbackType
 from services.telegram_bot.utils import get_user_familiar
-from typing import Callable
+from services.telegram_bot.delivery import SignalDelivery
+from services.telegram_bot.digest import SignalCoalescer, SubscriptionStore, SignalItem, render_digest
+from services.telegram_bot.summary import VolumeLevelsSummary
+from typing import Callable, Dict, Any, List, Optional, Set, Tuple
 GREETINGS_TEMPLATE = "{name} ({id}),\r\n welcome to Dasein Trading Systems! 🚀"
+SUBSCRIPTION_TEMPLATE = "Signals: <code>{state}</code>\r\nSymbols: <code>{symbols}</code>\r\nTimeframes: <code>{tfs}</code>"
 
 
 class ReplyButtons(Enum):
@@ -42,13 +46,21 @@ class TradingSysTelegramBot(object):
         # self.trading_diary = trading_diary
         self.mongodb = MongoDb(config)
         self.oracle = oracle
+        self.delivery = SignalDelivery(self.application.bot)
+        self.users: Dict[int, Dict[str, Any]] = {}
+        self.coalescer = SignalCoalescer(self.flush_signals)
+        self.subscriptions = SubscriptionStore()
+        self.volume_levels = VolumeLevelsSummary(oracle)
+
+    async def refresh_users(self):
+        users = await self.mongodb.list_users()
+        self.users = {u["telegram_id"]: u for u in users}
 
     async def send_signal(
         self, symbol_tf: SymbolTf, signal_type: SignalCallbackType, **kwargs
     ):
         logging.warning(f"SIGNAL: {symbol_tf} - {signal_type}")
 
-        users = await self.mongodb.list_users()
         symbol_str = symbol_to_binance(symbol_tf[0]).upper()
         tf_str = symbol_tf[1]
 
@@ -59,10 +71,19 @@ class TradingSysTelegramBot(object):
         elif signal_type == SignalCallbackType.PRICE_LEVEL:
             text = f"<b>{symbol_str} {tf_str}</b> Level break <code>{round(kwargs['level'])}</code> ⚡️"
 
-        for u in users:
-            await self.application.bot.send_message(
-                chat_id=u["telegram_id"], parse_mode=constants.ParseMode.HTML, text=text
-            )
+        self.coalescer.add(symbol_str, tf_str, text)
+
+    async def flush_signals(self, items: List[SignalItem]):
+        digests: Dict[Tuple[int, ...], List[int]] = {}
+        for user_id in self.users.keys():
+            sub = self.subscriptions.get(user_id)
+            matched = tuple(i for i, (symbol, tf, _) in enumerate(items) if sub.match(symbol, tf))
+            if matched:
+                digests.setdefault(matched, []).append(user_id)
+
+        for matched, user_ids in digests.items():
+            for text in render_digest([items[i][2] for i in matched]):
+                self.delivery.enqueue_many(user_ids, text)
 
         # async def oracle_loops(self):
         #     try:
@@ -74,10 +95,16 @@ class TradingSysTelegramBot(object):
     async def start(self):
         try:
             self.application.add_handler(CommandHandler("start", self._start_command))
+            self.application.add_handler(CommandHandler("subscribe", self._subscribe_command))
+            self.application.add_handler(CommandHandler("unsubscribe", self._unsubscribe_command))
+            self.application.add_handler(CommandHandler("subscriptions", self._subscriptions_command))
             self.application.add_handler(
                 MessageHandler(filters.TEXT, self._message_handler)
             )
 
+            self.subscriptions.load()
+            await self.refresh_users()
+            self.delivery.start()
             self.oracle.signal_callback = self.send_signal
 
             # self.application.add_handler(CallbackQueryHandler(self._section_item_click_callback))
@@ -99,6 +126,7 @@ class TradingSysTelegramBot(object):
 
         user = from_tg_user(from_user)
         await self.mongodb.add_user(user)
+        await self.refresh_users()
 
         name = get_user_familiar(from_user)
 
@@ -108,6 +136,38 @@ class TradingSysTelegramBot(object):
             reply_markup=self._get_reply_markup(),
         )
 
+    def _parse_subscription_args(self, args: List[str]) -> Tuple[List[str], List[str]]:
+        tfs = [str(tf) for tf in self.oracle.tfs]
+        return [a.upper() for a in args if a.lower() not in tfs], [a.lower() for a in args if a.lower() in tfs]
+
+    @staticmethod
+    def _format_filter(values: Optional[Set[str]]) -> str:
+        if values is None:
+            return "all"
+        return ", ".join(sorted(values)) or "none"
+
+    async def _reply_subscription(self, update: Update):
+        sub = self.subscriptions.get(update.message.from_user.id)
+        await update.message.reply_text(
+            SUBSCRIPTION_TEMPLATE.format(symbols=self._format_filter(sub.symbols),
+                                         tfs=self._format_filter(sub.tfs),
+                                         state="muted" if sub.muted else "on"),
+            parse_mode=constants.ParseMode.HTML,
+        )
+
+    async def _subscribe_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        symbols, tfs = self._parse_subscription_args(context.args or [])
+        self.subscriptions.subscribe(update.message.from_user.id, symbols, tfs)
+        await self._reply_subscription(update)
+
+    async def _unsubscribe_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        symbols, tfs = self._parse_subscription_args(context.args or [])
+        self.subscriptions.unsubscribe(update.message.from_user.id, symbols, tfs)
+        await self._reply_subscription(update)
+
+    async def _subscriptions_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await self._reply_subscription(update)
+
     async def _message_handler(
         self, update: Update, context: ContextTypes.DEFAULT_TYPE
     ):
@@ -115,42 +175,14 @@ class TradingSysTelegramBot(object):
         if ReplyButtons.has_value(text):
             reply_button = ReplyButtons(text)
             if reply_button == ReplyButtons.VOLUME_LEVELS_ALL_NAME:
-                if not self.oracle.initialized:
-                    text = "⏳ Wait for Oracle initialization..."
+                if not (self.oracle.initialized or self.oracle.stale):
+                    messages = ["⏳ Wait for Oracle initialization..."]
                 else:
-                    summary = self.oracle.get_summary()
-                    for symbol, tfs in summary.items():
-                        lines = [f"▪️ <b>{symbol_to_binance(symbol)}</b>"]
-
-                        for tf, v in tfs.items():
-                            prec = self.oracle.api_client.symbol_info[
-                                symbol
-                            ].price_precision
-                            price = self.oracle.api_client.mark_prices[symbol]
-                            p_levels = v["price_levels"]
-                            up_levels = p_levels[p_levels >= price]
-                            up_level = (
-                                round(up_levels[-1], prec)
-                                if len(up_levels) > 0
-                                else "-"
-                            )
-                            down_levels = p_levels[p_levels <= price]
-                            down_level = (
-                                round(down_levels[-1], prec)
-                                if len(down_levels) > 0
-                                else "-"
-                            )
-
-                            lines.append(
-                                f"{' '*3}▫️ {tf} level: {round(v['dnv_level'])}/{round(v['dnv_current'])}"
-                                f"({round(v['dnv_diff'])}%) avg100. {round(v['dnv_avg100'])} "
-                                f"\r\n{' '*6}p.levels: [{up_level} > <code>{price}</code> > {down_level}"
-                            )
-
-                        text = "\r\n".join(lines)
-
-                        await update.message.reply_text(
-                            text,
-                            parse_mode=constants.ParseMode.HTML,
-                            reply_markup=self._get_reply_markup(),
-                        )
+                    messages = await self.volume_levels.get_messages()
+
+                for text in messages:
+                    await update.message.reply_text(
+                        text,
+                        parse_mode=constants.ParseMode.HTML,
+                        reply_markup=self._get_reply_markup(),
+                    )
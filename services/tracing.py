@@ -0,0 +1,157 @@
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from services.metrics import REGISTRY, add_exporter_route
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))  # part of the traces kept as spans
+TRACE_BUFFER_SIZE = 20000  # spans
+TRACE_STAGE_WINDOW = 4096  # last latencies per stage used for the percentiles
+TRACE_QUANTILES = (0.5, 0.9, 0.99)
+
+# (trace id, stage, start, end, thread id, args), times in epoch seconds
+Span = Tuple[int, str, float, float, int, Optional[Dict[str, Any]]]
+# sent inside the ZMQ frames: id, origin (exchange event time, epoch seconds), sampled
+TraceContext = Dict[str, Any]
+
+
+def event_time(value: datetime) -> float:
+    """
+    Epoch seconds of an exchange timestamp, naive datetimes are UTC as everywhere in tc.
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class Tracer(object):
+    """
+    Event-time latency of the pipeline stages: every record stores now - origin of the trace in the stage window,
+    sampled traces also keep their spans in a ring buffer, dumped as Chrome trace (chrome://tracing, Perfetto).
+    One tracer per process, the trace context travels between processes inside the ZMQ frames.
+    """
+
+    def __init__(self, service: str = "", sample_rate: float = TRACE_SAMPLE_RATE,
+                 buffer_size: int = TRACE_BUFFER_SIZE, window: int = TRACE_STAGE_WINDOW):
+        self.sample_rate = sample_rate
+        self.window = window
+        self.buffer_size = buffer_size
+        self.init(service)
+
+    def init(self, service: str):
+        """
+        Called first in the process of every service, forked processes start over with their own ids and buffers.
+        """
+        self.service = service or str(os.getpid())
+        self.spans: Deque[Span] = deque(maxlen=self.buffer_size)
+        self.origins: Dict[int, float] = {}  # sampled trace id -> origin, bounded as the spans
+        self.latencies: Dict[str, Deque[float]] = {}
+        self.counts: Dict[str, int] = {}
+        self.ids = itertools.count((os.getpid() & 0xffff) << 32)  # unique across the processes, exact as JS numbers
+
+    def new_context(self, origin: float) -> TraceContext:
+        """
+        :param origin: exchange event time, epoch seconds
+        """
+        return dict(id=next(self.ids), origin=origin, sampled=random.random() < self.sample_rate)
+
+    def record(self, stage: str, ctx: TraceContext, start: Optional[float] = None, end: Optional[float] = None,
+               **args):
+        """
+        The stage is done: its latency is end - origin of the trace, start only matters for the span of sampled traces.
+        """
+        end = end if end is not None else time.time()
+        latencies = self.latencies.get(stage, None)
+        if latencies is None:
+            latencies = self.latencies.setdefault(stage, deque(maxlen=self.window))
+        latencies.append(end - ctx['origin'])
+        self.counts[stage] = self.counts.get(stage, 0) + 1
+        if ctx['sampled']:
+            if len(self.origins) >= 2 * self.spans.maxlen:  # drop the traces without spans left, amortized O(1)
+                alive = {s[0] for s in self.spans}
+                self.origins = {k: v for k, v in self.origins.items() if k in alive}
+            self.origins[ctx['id']] = ctx['origin']
+            self.spans.append((ctx['id'], stage, start if start is not None else end, end, threading.get_ident(),
+                               args or None))
+
+    def span(self, stage: str, ctx: TraceContext, **args) -> "TraceSpan":
+        return TraceSpan(self, stage, ctx, args)
+
+    def get_quantiles(self) -> Dict[str, Dict[float, float]]:
+        result = {}
+        for stage, latencies in list(self.latencies.items()):
+            values = sorted(latencies)
+            if values:
+                result[stage] = {q: values[min(int(q * len(values)), len(values) - 1)] for q in TRACE_QUANTILES}
+        return result
+
+    def collect_metrics(self):
+        for stage, quantiles in self.get_quantiles().items():
+            for q, value in quantiles.items():
+                yield ("trace_stage_latency_seconds", "gauge", "Exchange event time to the end of the stage",
+                       (("service", self.service), ("stage", stage), ("quantile", str(q))), value)
+        for stage, count in list(self.counts.items()):
+            yield ("trace_stage_records_total", "counter", "Traced stage completions",
+                   (("service", self.service), ("stage", stage)), count)
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """
+        Complete events per span, pid is the process, tid the thread; the exchange event of every trace is an instant.
+        """
+        pid = os.getpid()
+        spans, origins = list(self.spans), dict(self.origins)  # C level copies, safe against the writer thread
+        events: List[Dict[str, Any]] = [dict(name="process_name", ph="M", pid=pid, args=dict(name=self.service))]
+        seen = set()
+        for trace_id, stage, start, end, tid, args in spans:
+            if trace_id not in seen and trace_id in origins:
+                seen.add(trace_id)
+                events.append(dict(name="exchange_event", ph="i", s="p", ts=origins[trace_id] * 1e6, pid=pid, tid=tid,
+                                   args=dict(trace_id=trace_id)))
+            events.append(dict(name=stage, cat="pipeline", ph="X", ts=start * 1e6, dur=(end - start) * 1e6, pid=pid,
+                               tid=tid, args=dict(trace_id=trace_id, latency=end - origins.get(trace_id, end),
+                                                  **(args or {}))))
+        return dict(traceEvents=events, displayTimeUnit="ms")
+
+    def dump(self, file_name: str):
+        os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+        with open(file_name, "w") as f:
+            json.dump(self.to_chrome_trace(), f, default=str)
+
+
+class TraceSpan(object):
+    """
+    with TRACER.span("db_commit", ctx): ...
+    """
+
+    def __init__(self, tracer: Tracer, stage: str, ctx: TraceContext, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.stage = stage
+        self.ctx = ctx
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:  # a failed stage is not done
+            self.tracer.record(self.stage, self.ctx, start=self.start, **self.args)
+
+
+def merge_chrome_traces(traces: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    One timeline of the dumps of several processes, span times are wall clock so they line up.
+    """
+    return dict(traceEvents=[e for t in traces for e in t["traceEvents"]], displayTimeUnit="ms")
+
+
+TRACER = Tracer()
+REGISTRY.register_collector(TRACER.collect_metrics)
+add_exporter_route("/traces", "application/json", lambda: json.dumps(TRACER.to_chrome_trace(), default=str).encode())
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.utils.logs import add_traceback
+
+EXPORT_SPOOL_FILE = "./data/trading_diary_spool.sqlite"
+EXPORT_FLUSH_INTERVAL = 5.0  # s
+EXPORT_BATCH_SIZE = 500
+EXPORT_BACKOFF_MAX = 300.0  # s
+
+
+def is_quota_error(e: Exception) -> bool:
+    res = getattr(e, "res", None)
+    return getattr(res, "status_code", None) == 429
+
+
+class RowsSpool(object):
+    """
+    Durable local spool of rows waiting for export, survives restarts.
+    """
+
+    def __init__(self, file_name: str = EXPORT_SPOOL_FILE):
+        if file_name != ":memory:":
+            os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(file_name)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS rows "
+                          "(id INTEGER PRIMARY KEY AUTOINCREMENT, sheet_name TEXT NOT NULL, row_values TEXT NOT NULL)")
+        self.conn.commit()
+
+    def add(self, sheet_name: str, rows: List[List[Any]]):
+        self.conn.executemany("INSERT INTO rows (sheet_name, row_values) VALUES (?, ?)",
+                              [(sheet_name, json.dumps(r, default=str)) for r in rows])
+        self.conn.commit()
+
+    def peek(self, limit: int) -> List[Tuple[int, str, List[Any]]]:
+        cursor = self.conn.execute("SELECT id, sheet_name, row_values FROM rows ORDER BY id LIMIT ?", (limit,))
+        return [(id_, sheet_name, json.loads(values)) for id_, sheet_name, values in cursor.fetchall()]
+
+    def remove(self, ids: List[int]):
+        self.conn.executemany("DELETE FROM rows WHERE id = ?", [(i,) for i in ids])
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+class SheetsExportQueue(object):
+    """
+    Batches spooled rows into one values.append call per sheet,
+    sheets - any client with GoogleSheets.add_sheet_rows signature.
+    """
+
+    def __init__(self, sheets: Any, spool: Optional[RowsSpool] = None,
+                 flush_interval: float = EXPORT_FLUSH_INTERVAL, batch_size: int = EXPORT_BATCH_SIZE):
+        self.sheets = sheets
+        self.spool = spool if spool is not None else RowsSpool()  # an empty spool is falsy
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.delay = flush_interval
+        self.task: Optional[asyncio.Task] = None
+        self.logger = logging.getLogger("trading_diary")
+
+    def add_rows(self, sheet_name: str, rows: List[List[Any]]):
+        self.spool.add(sheet_name, rows)
+
+    async def flush(self) -> int:
+        exported = 0
+        while True:
+            items = self.spool.peek(self.batch_size)
+            if not items:
+                return exported
+
+            by_sheet: Dict[str, List[Tuple[int, List[Any]]]] = {}
+            for id_, sheet_name, values in items:
+                by_sheet.setdefault(sheet_name, []).append((id_, values))
+
+            for sheet_name, rows in by_sheet.items():
+                await self.sheets.add_sheet_rows(sheet_name, [values for _, values in rows])
+                self.spool.remove([id_ for id_, _ in rows])
+                exported += len(rows)
+                self.logger.info(f"Exported {len(rows)} rows to {sheet_name}")
+
+    async def export(self) -> bool:
+        """
+        One flush of the run loop: on failure the rows stay spooled and the delay to the next one doubles.
+        """
+        try:
+            await self.flush()
+            self.delay = self.flush_interval
+            return True
+        except Exception as e:
+            self.delay = min(self.delay * 2, EXPORT_BACKOFF_MAX)
+            if is_quota_error(e):
+                self.logger.warning(f"Sheets quota exceeded, retry in {self.delay}s")
+            else:
+                self.logger.error(add_traceback(e))
+            return False
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.delay)
+            await self.export()
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_event_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
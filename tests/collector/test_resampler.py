@@ -0,0 +1,120 @@
+import asyncio
+import glob
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pytest
+
+from services.collector.gaps import kline_to_item
+from services.collector.resampler import BASE_TF, ADDITIVE_FIELDS, CandleResampler, compare_candles, \
+    kline_to_base_item, klines_to_data_frame, resample_candles
+from services.market_data.candle_cache import to_timestamp_ms
+
+# klines_<name>.json: {symbol, source, klines: {tf: [REST klines]}}, recorded with
+# python -m services.collector.resampler BTCUSDT 15m 1h 4h 1d --periods 1 --record tests/fixtures/klines_btcusdt.json
+# klines_synthetic.json comes from SyntheticMarket.record_klines: every tf is built from the trades, not from 1m
+FIXTURES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), os.pardir, "fixtures", "klines_*.json")))
+RTOL = 1e-7  # klines are decimal strings, the sums of the 1m fields differ in the last digits
+CANDLE_FIELDS = (1, 2, 3, 4, 5) + ADDITIVE_FIELDS  # ohlcv, quote volume, trades, taker base/quote volume
+
+
+@pytest.fixture(params=FIXTURES, ids=os.path.basename)
+def fixture(request) -> Dict[str, Any]:
+    with open(request.param) as f:
+        return json.load(f)
+
+
+def get_tfs(fixture: Dict[str, Any]) -> List[str]:
+    return [tf for tf in fixture["klines"].keys() if tf != BASE_TF]
+
+
+class FixtureBackfiller(object):
+    """
+    GapBackfiller.fetch_candles answered from the fixture base klines.
+    """
+
+    def __init__(self, klines: List[List[Any]]):
+        self.klines = klines
+        self.calls = 0
+
+    async def fetch_candles(self, symbol, tf, start_ms, end_ms, template, missing=True):
+        self.calls += 1
+        return [kline_to_item(k, template) for k in self.klines if start_ms <= k[0] < end_ms]
+
+
+def run_resampler(fixture: Dict[str, Any], klines: List[List[Any]],
+                  backfiller: Optional[FixtureBackfiller] = None) -> Tuple[Dict[str, List[Tuple[List[Any], Any]]],
+                                                                           CandleResampler]:
+    """
+    Feeds the 1m klines as live kline_1m updates and closes, returns the closed (candle_item, close_time) per tf.
+    """
+    closed = {tf: [] for tf in get_tfs(fixture)}
+
+    async def on_candle(symbol, tf, candle_closed, candle_item, close_time):
+        if candle_closed:
+            closed[tf].append((candle_item, close_time))
+
+    resampler = CandleResampler(get_tfs(fixture), on_candle, backfiller=backfiller)
+
+    async def feed():
+        for kline in klines:
+            item = kline_to_base_item(kline)
+            await resampler.on_base_candle(fixture["symbol"], BASE_TF, False, item, item[6])
+            await resampler.on_base_candle(fixture["symbol"], BASE_TF, True, item, item[6])
+        await asyncio.gather(*resampler.tasks)
+
+    asyncio.run(feed())
+    for tf in closed.keys():
+        closed[tf].sort(key=lambda c: to_timestamp_ms(c[0][0]))  # backfilled candles are stored later
+    return closed, resampler
+
+
+def assert_same_candle(candle_item: List[Any], close_time: Any, kline: List[Any]):
+    assert to_timestamp_ms(candle_item[0]) == kline[0]
+    assert to_timestamp_ms(close_time) == kline[6]
+    assert to_timestamp_ms(candle_item[6]) == kline[6]
+    np.testing.assert_allclose([candle_item[i] for i in CANDLE_FIELDS], [float(kline[i]) for i in CANDLE_FIELDS],
+                               rtol=RTOL)
+    assert candle_item[8] == kline[8]
+
+
+def test_resample_candles_matches_exchange_klines(fixture):
+    base = klines_to_data_frame(fixture["klines"][BASE_TF])
+    for tf in get_tfs(fixture):
+        exchange = klines_to_data_frame(fixture["klines"][tf])
+        resampled = resample_candles(base, tf)
+        assert list(resampled.index) == list(exchange.index), tf
+        diff = compare_candles(resampled, exchange, rtol=RTOL)
+        assert diff.empty, f"{tf}:\n{diff}"
+
+
+def test_live_resampler_matches_exchange_klines(fixture):
+    closed, _ = run_resampler(fixture, fixture["klines"][BASE_TF])
+    for tf in get_tfs(fixture):
+        exchange = fixture["klines"][tf]
+        assert len(closed[tf]) == len(exchange), tf
+        for (candle_item, close_time), kline in zip(closed[tf], exchange):
+            assert_same_candle(candle_item, close_time, kline)
+
+
+@pytest.mark.parametrize("missed", [1, 2 * 60 - 1, 2 * 60])  # inside the periods, closing an hour, opening one
+def test_missed_base_candles_are_backfilled(fixture, missed):
+    base = fixture["klines"][BASE_TF]
+    backfiller = FixtureBackfiller(base)
+    closed, resampler = run_resampler(fixture, base[:missed] + base[missed + 1:], backfiller)
+    assert backfiller.calls > 0 and resampler.incomplete == 0
+    for tf in get_tfs(fixture):
+        exchange = fixture["klines"][tf]
+        assert len(closed[tf]) == len(exchange), tf
+        for (candle_item, close_time), kline in zip(closed[tf], exchange):
+            assert_same_candle(candle_item, close_time, kline)
+
+
+def test_missed_base_candle_without_backfiller_is_stored_incomplete(fixture):
+    base = fixture["klines"][BASE_TF]
+    closed, resampler = run_resampler(fixture, base[:5] + base[6:])
+    for tf in get_tfs(fixture):
+        assert len(closed[tf]) == len(fixture["klines"][tf]), tf
+    assert resampler.incomplete == len(get_tfs(fixture))
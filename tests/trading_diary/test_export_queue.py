@@ -0,0 +1,128 @@
+from patch_submod import dummy  # <- REQUIRED
+import asyncio
+from typing import Any, List, Optional, Tuple
+
+import pytest
+
+from services.trading_diary.export_queue import EXPORT_BACKOFF_MAX, RowsSpool, SheetsExportQueue, is_quota_error
+
+
+class QuotaResponse(object):
+    status_code = 429
+
+
+class QuotaError(Exception):
+    """
+    gspread APIError of an exceeded quota: the response is in e.res.
+    """
+
+    def __init__(self):
+        super(QuotaError, self).__init__("Quota exceeded")
+        self.res = QuotaResponse()
+
+
+class StubSheets(object):
+    """
+    GoogleSheets.add_sheet_rows, one values.append call per invocation; fails with a 429 while quota_errors > 0.
+    """
+
+    def __init__(self, spool: Optional[RowsSpool] = None, quota_errors: int = 0):
+        self.spool = spool
+        self.quota_errors = quota_errors
+        self.appends: List[Tuple[str, List[List[Any]]]] = []
+        self.spooled_on_append: List[int] = []  # spool size while each append runs
+
+    async def add_sheet_rows(self, sheet_name: str, rows: List[List[Any]]):
+        if self.spool is not None:
+            self.spooled_on_append.append(len(self.spool))
+        if self.quota_errors > 0:
+            self.quota_errors -= 1
+            raise QuotaError()
+        self.appends.append((sheet_name, rows))
+
+
+def make_rows(n: int, start: int = 0) -> List[List[Any]]:
+    return [[f"2024-01-01 00:00:{i:02d}", "BTCUSDT", i] for i in range(start, start + n)]
+
+
+@pytest.fixture
+def spool(tmp_path) -> RowsSpool:
+    spool = RowsSpool(str(tmp_path / "spool.sqlite"))
+    yield spool
+    spool.close()
+
+
+def test_burst_is_one_append_per_sheet(spool):
+    sheets = StubSheets()
+    queue = SheetsExportQueue(sheets, spool)
+    for row in make_rows(20):
+        queue.add_rows("trades", [row])
+    queue.add_rows("balances", make_rows(3))
+
+    assert asyncio.run(queue.flush()) == 23
+    assert sheets.appends == [("trades", make_rows(20)), ("balances", make_rows(3))]
+    assert len(spool) == 0
+
+
+def test_spooled_rows_survive_reopening(tmp_path):
+    file_name = str(tmp_path / "spool.sqlite")
+    spool = RowsSpool(file_name)
+    spool.add("trades", make_rows(5))
+    spool.close()
+
+    spool = RowsSpool(file_name)
+    try:
+        assert [(sheet_name, values) for _, sheet_name, values in spool.peek(10)] == \
+               [("trades", row) for row in make_rows(5)]
+        sheets = StubSheets()
+        asyncio.run(SheetsExportQueue(sheets, spool).flush())
+        assert sheets.appends == [("trades", make_rows(5))]
+    finally:
+        spool.close()
+
+
+def test_quota_error_backs_off_and_keeps_rows(spool):
+    sheets = StubSheets(quota_errors=3)
+    queue = SheetsExportQueue(sheets, spool, flush_interval=1.0)
+    queue.add_rows("trades", make_rows(4))
+
+    delays = []
+    for _ in range(3):
+        assert not asyncio.run(queue.export())
+        delays.append(queue.delay)
+        assert len(spool) == 4
+    assert delays == [2.0, 4.0, 8.0]
+    assert sheets.appends == []
+
+    assert asyncio.run(queue.export())
+    assert queue.delay == 1.0
+    assert sheets.appends == [("trades", make_rows(4))]
+    assert len(spool) == 0
+
+
+def test_backoff_is_capped():
+    queue = SheetsExportQueue(StubSheets(quota_errors=100), RowsSpool(":memory:"), flush_interval=100.0)
+    queue.add_rows("trades", make_rows(1))
+    for _ in range(5):
+        asyncio.run(queue.export())
+    assert queue.delay == EXPORT_BACKOFF_MAX
+
+
+def test_rows_removed_only_after_successful_append(spool):
+    sheets = StubSheets(spool, quota_errors=1)
+    queue = SheetsExportQueue(sheets, spool)
+    queue.add_rows("trades", make_rows(2))
+    queue.add_rows("balances", make_rows(3))
+
+    assert not asyncio.run(queue.export())
+    assert sheets.spooled_on_append == [5]  # failed on the first sheet, nothing removed
+    assert len(spool) == 5
+
+    assert asyncio.run(queue.export())
+    assert sheets.spooled_on_append == [5, 5, 3]  # the trades rows removed after their append only
+    assert len(spool) == 0
+
+
+def test_is_quota_error():
+    assert is_quota_error(QuotaError())
+    assert not is_quota_error(ValueError("quota"))
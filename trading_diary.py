@@ -16,6 +16,7 @@ from core.exchange.common.mappers import symbol_to_binance
 from core.types import Side
 from core.utils.logs import setup_logger
 from services import GoogleSheets
+from services.trading_diary.export_queue import SheetsExportQueue
 
 DIARY_SHEET_NAME = "trading"
 
@@ -38,10 +39,12 @@ class TradingDiary(object):
             spreadsheet_id=spreadsheet_id,
             google_docs_creds_file_name=f'./secrets/{google_service_key_file_name}',
         )
+        self.export_queue = SheetsExportQueue(self.gs)
 
     async def init(self):
         self.logger.info("Trading diary init...")
         await self.gs.init()
+        self.export_queue.start()
         self.binance_futures.add_callback(
             id="position", channel="position", callback=self.position_callback
         )
@@ -96,7 +99,7 @@ class TradingDiary(object):
             tp_price,
             sl_price,
         ]
-        await self.gs.add_sheet_rows(DIARY_SHEET_NAME, [item])
+        self.export_queue.add_rows(DIARY_SHEET_NAME, [item])
 
     async def export_to_chart(self, position):
         tf = "1h"